@@ -0,0 +1,260 @@
+import json
+import os
+import threading
+import time
+import redis
+import MessageEnvelope as ME
+import Metrics as MT
+
+# Redis hash of the registered agents: lowercase agent ID -> JSON {id, queue, registeredAt}
+DIRECTORY_KEY = "agent_directory"
+# Lifetime (in seconds) of an agent heartbeat. An agent without heartbeat is offline, its queue is kept until it restarts
+HEARTBEAT_TTL = int(os.getenv("AGENT_HEARTBEAT_TTL", "30"))
+# Redis list of the undeliverable messages, newest first
+DEAD_LETTER_KEY = "dead_letters"
+# Maximum number of dead letters kept, the oldest ones are trimmed
+DEAD_LETTER_MAXLEN = int(os.getenv("DEAD_LETTER_MAXLEN", "1000"))
+
+# Reasons of the dead letters
+UNKNOWN_RECIPIENT = "unknown_recipient"
+HANDLER_ERROR = "handler_error"
+
+
+def HeartbeatKey(agentId):
+    """
+    HeartbeatKey
+    ------------
+    Returns the key of the heartbeat of an agent, set while the agent is running.
+    """
+    return f"{DIRECTORY_KEY}:alive:{agentId.strip().lower()}"
+
+
+def DirectoryEntry(agentId, queueName):
+    return json.dumps({'id': agentId, 'queue': queueName, 'registeredAt': time.time()})
+
+
+def _heartbeat(redisConnexion, agentId, queueName, stopEvent):
+    while not stopEvent.is_set():
+        try:
+            pipe = redisConnexion.pipeline(transaction = False)
+            # registered again at each beat, so the agent comes back after the Redis database was flushed
+            pipe.hset(DIRECTORY_KEY, agentId.lower(), DirectoryEntry(agentId, queueName))
+            pipe.set(HeartbeatKey(agentId), 1, ex = HEARTBEAT_TTL)
+            pipe.execute()
+        except redis.ConnectionError as e:
+            print(f"Redis connexion error on the heartbeat of {agentId}: {e}")
+        stopEvent.wait(HEARTBEAT_TTL / 3)
+
+
+def Register(redisConnexion, agentId, queueName = None):
+    """
+    Register
+    --------
+    Registers an agent and the address of its queue in the directory, and keeps its heartbeat alive in a background thread.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server.
+    agentId : str
+        ID of the agent.
+    queueName : str, optional
+        Queue the messages of the agent are pushed in. Defaults to '{agentId}_queue'.
+
+    Returns
+    -------
+    threading.Event
+        Event to set to stop the heartbeat, see `Unregister`.
+    """
+    stopEvent = threading.Event()
+    threading.Thread(target = _heartbeat, args = (redisConnexion, agentId, queueName or f"{agentId}_queue", stopEvent),
+                     name = f"{agentId}-heartbeat", daemon = True).start()
+    return stopEvent
+
+
+def Unregister(redisConnexion, agentId, stopEvent):
+    """
+    Unregister
+    ----------
+    Stops the heartbeat of an agent. The agent stays in the directory, the messages sent to it wait in its queue.
+    """
+    stopEvent.set()
+    redisConnexion.delete(HeartbeatKey(agentId))
+
+
+def _entry(raw, alive):
+    if raw is None:
+        return None
+    entry = json.loads(raw)
+    entry['alive'] = bool(alive)
+    return entry
+
+
+def Resolve(redisConnexion, recipientID):
+    """
+    Resolve
+    -------
+    Looks up an agent in the directory, ignoring the letter casing and the surrounding spaces of its ID.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server.
+    recipientID : str
+        ID of the agent, as written by the AI.
+
+    Returns
+    -------
+    dict or None
+        {'id': registered ID, 'queue': queue of the agent, 'registeredAt', 'alive': bool}, None if the agent is unknown.
+    """
+    pipe = redisConnexion.pipeline(transaction = False)
+    pipe.hget(DIRECTORY_KEY, recipientID.strip().lower())
+    pipe.exists(HeartbeatKey(recipientID))
+    return _entry(*pipe.execute())
+
+
+def KnownAgents(redisConnexion):
+    """
+    KnownAgents
+    -----------
+    Returns the IDs of the registered agents.
+    """
+    return sorted(json.loads(raw)['id'] for raw in redisConnexion.hvals(DIRECTORY_KEY))
+
+
+def DeadLetterEntry(rawMessage, reason, recipientID = None, error = None):
+    envelope = ME.UnpackMessage(rawMessage)
+    return json.dumps({'recipient': recipientID, 'reason': reason, 'error': error, 'sender': envelope['sender'],
+                       'conversationId': envelope['conversationId'], 'message': rawMessage, 'deadAt': time.time()})
+
+
+def DeadLetter(redisConnexion, rawMessage, reason, recipientID = None, error = None):
+    """
+    DeadLetter
+    ----------
+    Keeps an undeliverable message in the dead-letter queue, for inspection.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server.
+    rawMessage : str
+        The packed message.
+    reason : str
+        `UNKNOWN_RECIPIENT` or `HANDLER_ERROR`.
+    recipientID : str, optional
+        ID of the recipient of the message, or name of the queue it was popped from.
+    error : str, optional
+        Details of the failure.
+
+    Returns
+    -------
+    None
+    """
+    MT.DEAD_LETTERS.inc(reason = reason)
+    pipe = redisConnexion.pipeline(transaction = False)
+    pipe.lpush(DEAD_LETTER_KEY, DeadLetterEntry(rawMessage, reason, recipientID, error))
+    pipe.ltrim(DEAD_LETTER_KEY, 0, DEAD_LETTER_MAXLEN - 1)
+    pipe.execute()
+
+
+def ReadDeadLetters(redisConnexion, limit = 100):
+    """
+    ReadDeadLetters
+    ---------------
+    Returns the last dead letters, newest first, and the number of dead letters kept.
+    """
+    pipe = redisConnexion.pipeline(transaction = False)
+    pipe.lrange(DEAD_LETTER_KEY, 0, max(0, limit - 1))
+    pipe.llen(DEAD_LETTER_KEY)
+    items, count = pipe.execute()
+    return {'deadLetters': [json.loads(item) for item in items], 'count': count}
+
+
+def Deliver(redisConnexion, recipientID, rawMessage):
+    """
+    Deliver
+    -------
+    Pushes a packed message in the queue of an agent of the directory. A message to an unknown agent is not pushed
+    in a queue nobody reads, it goes to the dead-letter queue.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server.
+    recipientID : str
+        ID of the recipient, resolved with `Resolve`.
+    rawMessage : str
+        The packed message, see `MessageEnvelope.PackMessage`.
+
+    Returns
+    -------
+    dict or None
+        The directory entry of the recipient, None if the recipient is unknown.
+    """
+    entry = Resolve(redisConnexion, recipientID)
+    if entry is None:
+        DeadLetter(redisConnexion, rawMessage, UNKNOWN_RECIPIENT, recipientID)
+        return None
+    redisConnexion.lpush(entry['queue'], rawMessage)
+    return entry
+
+
+def DeliveryReport(recipientID, entry, knownAgents = ()):
+    """
+    DeliveryReport
+    --------------
+    Returns the result of a delivery for the AI: a confirmation, or an error listing the known agents so the AI
+    can correct the recipient at once.
+    """
+    if entry is None:
+        return (f"Error: {recipientID} is not a known agent, the message was not sent. "
+                f"Known agents: {', '.join(knownAgents) or 'none'}.")
+    if not entry['alive']:
+        return f"Message Sent to {entry['id']}, it is offline and will read it when it restarts"
+    return f"Message Sent to {entry['id']}"
+
+
+#%% In this section : awaitable versions, with an asynchronous Redis connexion
+async def ResolveAsync(redisConnexion, recipientID):
+    """
+    ResolveAsync
+    ------------
+    Awaitable version of `Resolve`.
+    """
+    pipe = redisConnexion.pipeline(transaction = False)
+    pipe.hget(DIRECTORY_KEY, recipientID.strip().lower())
+    pipe.exists(HeartbeatKey(recipientID))
+    return _entry(*await pipe.execute())
+
+
+async def KnownAgentsAsync(redisConnexion):
+    return sorted(json.loads(raw)['id'] for raw in await redisConnexion.hvals(DIRECTORY_KEY))
+
+
+async def DeadLetterAsync(redisConnexion, rawMessage, reason, recipientID = None, error = None):
+    """
+    DeadLetterAsync
+    ---------------
+    Awaitable version of `DeadLetter`.
+    """
+    MT.DEAD_LETTERS.inc(reason = reason)
+    pipe = redisConnexion.pipeline(transaction = False)
+    pipe.lpush(DEAD_LETTER_KEY, DeadLetterEntry(rawMessage, reason, recipientID, error))
+    pipe.ltrim(DEAD_LETTER_KEY, 0, DEAD_LETTER_MAXLEN - 1)
+    await pipe.execute()
+
+
+async def DeliverAsync(redisConnexion, recipientID, rawMessage):
+    """
+    DeliverAsync
+    ------------
+    Awaitable version of `Deliver`.
+    """
+    entry = await ResolveAsync(redisConnexion, recipientID)
+    if entry is None:
+        await DeadLetterAsync(redisConnexion, rawMessage, UNKNOWN_RECIPIENT, recipientID)
+        return None
+    await redisConnexion.lpush(entry['queue'], rawMessage)
+    return entry
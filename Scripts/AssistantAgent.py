@@ -1,22 +1,37 @@
 from flask import Flask, jsonify
-from autogen import UserProxyAgent
-from autogen.agentchat.contrib.gpt_assistant_agent import GPTAssistantAgent
 import os
 import redis
-from datetime import datetime
-from apscheduler.schedulers.background import BackgroundScheduler
 import atexit
-import walletManager as WM # in this module is defined all necessary tool to pay a smart contract. 
-app = Flask(__name__)
+import QueueManager as QM # reliable blocking-pop consumers of the agent message queue
+import MessageEnvelope as ME
+import ConversationLog as CL # capped Redis streams of the conversation logs
+import SessionManager as SM # one assistant thread per conversation
+import AsyncAgentRuntime as AR # asyncio agent loop, enabled with AGENT_RUNTIME=async
+import ProtocolDispatcher as PRD # protocol messages handled without querying the AI
+import ResponseCache as RC # cache of the AI responses to repeated prompts
+import AssistantRegistry as RG # assistants reused across restarts
+import StageTimings as ST # durations of the stages of a conversation, collected by the benchmark
+import Metrics as MT # Prometheus metrics, exported by the /metrics route
+import Tracing as TR # trace context carried by the messages, spans exported with TRACE_DIR / TRACE_COLLECTOR_URL
+import AgentDirectory as AD # queue addresses of the agents, undeliverable messages kept in a dead-letter queue
+import LazyInit as LI # resources created on first use or by the warm-up, reported by the /ready route
+WM = LI.LazyImport("walletManager") # in this module is defined all necessary tool to pay a smart contract, imported with web3 on first use
+app = MT.InstrumentFlask(Flask(__name__))
 
 # Get OpenAI API key from environement variable
 key = os.getenv("OPENAI_API_KEY")
 
 ia_ID = "AssistantAgent"
+TR.SetService(ia_ID)
 ia_model = "gpt-4o"
 AIWallet = os.getenv("WalletPaymentMetamask")
 ia_contact_ID = "HaikuServiceProvider"
 user_ID = "haikuLover"
+# Invoices issued as protocol messages by these providers are paid without querying the AI, up to MAX_AUTO_PAYMENT (in ETH)
+AUTO_PAY_PROVIDERS = os.getenv("AUTO_PAY_PROVIDERS", ia_contact_ID).split(",")
+MAX_AUTO_PAYMENT = float(os.getenv("MAX_AUTO_PAYMENT", "0.002"))
+# Time (in seconds) a paid payment reference is remembered, so it is not paid twice
+PAID_REFERENCE_TTL = 7 * 24 * 3600
 # Definition of AI known-how and identity.
 context_identity = f"""You are {ia_ID}, the AI assistant of {user_ID}. You can also interact with {ia_contact_ID}, another AI that is a haiku service provider.
 When the user requests it explicitly, you are allowed to perform in full autonomy, and with all authorization, several tasks such as contacting service providers and making payments on {user_ID}'s behalf, without the need to ask for confirmation.
@@ -41,7 +56,8 @@ context_negotiation = f"""Protocol to acquire a service: As you are the only one
 3. You may have to perform several negotiation rounds. Your objective is to lower the price to make the user pay the least.
 4. Once an agreement is reached, inform the service provider that you accept the current offer and wait for the creation of an invoice. You must first provide all of the following information before validating the offer: email address of {user_ID}, the preferred currency, and the wallet adress. All these information are mandatory.
 5. Payment can be done in two ways depending on {user_ID}'s preferences. If {user_ID} doesn't inform you of the preferred mode of payment, you must assume you need to process autonomously and pay using the provided tool. Autonomous payment: When you accept the current offer, you must in the same sentence inform the service provider that you need the payment reference and payment recipient address, this is mandatory. Manual payment: Inform the service provider you will need a URL for manual payment. Based on the URL provided by the service provider, {user_ID} will manually perform the payment and confirm it to you. Finally, you will be able to inform the service provider that the payment has been made.
-6. If the payment doesn't appear as paid, it may require some time for the process to complete. Ask the service provider to check again in a few seconds. Repeat until the provider informs you that the transaction is a success.
+An invoice issued by the service provider for an autonomous payment may be paid automatically: you are then informed by an 'Internal note' and must not pay it again.
+6. Once the payment is done, inform the service provider. The service provider is notified automatically when the payment is received, it may require some time for the process to complete: wait for its answer instead of asking it to check again.
 You must follow this process.
 
 """
@@ -62,7 +78,7 @@ assistant_config = {
                 "properties": {
                     "recipientID": {
                         "type": "string",
-                        "description": "Id or name of the recipient, it is case sensitive so please be carefull otherwise it will not work."
+                        "description": "ID of the recipient. If the recipient is unknown, the message is not sent and the known IDs are returned."
                     },
                     "message": {
                         "type": "string",
@@ -101,6 +117,44 @@ assistant_config = {
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "PerformPayments",
+            "description": "function to pay several invoices at once, in a single transaction when possible. Prefer it to PerformPayment when several invoices have to be paid. The function returns the result of each payment",
+            "strict": True,
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "batch": {
+                        "type": "array",
+                        "description": "payments to perform",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "recipient_address": {
+                                    "type": "string",
+                                    "description": "payment address of the receiver of the payment. It must be provided by the service provider."
+                                },
+                                "amount_to_pay": {
+                                    "type": "number",
+                                    "description": "amount to pay for the service. it should be the numerical value of the required payment"
+                                },
+                                "paymentRefence": {
+                                    "type": "string",
+                                    "description": "payment reference that should be provided by the service provider."
+                                }
+                            },
+                            "additionalProperties": False,
+                            "required": ["recipient_address", "amount_to_pay", "paymentRefence"]
+                        }
+                    }
+                },
+                "additionalProperties": False,
+                "required": ["batch"]
+            }
+        }
+    },
     ]
 }
 
@@ -110,57 +164,182 @@ def SendMessage(recipientID, message):
     """
     SendMessage
     -----------
-    Sends a message asynchronously to another entity by pushing it into the corresponding Redis message queue.
+    Sends a message asynchronously to another agent by pushing it into its Redis message queue, found in the agent directory.
+    A message to an unknown agent goes to the dead-letter queue and the error is returned at once to the AI.
 
     Parameters
     ----------
     recipientID : str
-        The ID or name of the recipient. Be careful with letter casing as IDs are case-sensitive.
+        The ID of the recipient, resolved in the agent directory regardless of its letter casing.
     message : str
         The message to be transmitted to the recipient.
 
     Returns
     -------
     str
-        A confirmation string indicating that the message was successfully sent.
+        A confirmation string, or an error listing the known agents if the recipient is unknown.
     """
-    r.lpush(f'{recipientID}_queue', f"From {ia_ID} : "+ message)
+    entry = AD.Deliver(r, recipientID, ME.PackMessage(ia_ID, message, SM.CurrentConversation()))
+    if entry is None:
+        log_to_redis(ia_ID, f"undeliverable message to {recipientID} : {message}")
+        return AD.DeliveryReport(recipientID, None, AD.KnownAgents(r))
     # logs 
-    log_to_redis(ia_ID, f"to {recipientID} : {message}")
-    return  f"Message Sent to {recipientID}"
+    log_to_redis(ia_ID, f"to {entry['id']} : {message}")
+    return AD.DeliveryReport(recipientID, entry)
 
 
 
 
-# AUTOGEN : AI instantiation - Instance will be created on the OpenAI server. in the current implementation, it is deleted as the program terminates. 
-gpt_assistant = GPTAssistantAgent(
-    name = "AI Assistant",
-    llm_config = {"config_list": [{"model": ia_model, "temperature": 0.7, "api_key": key}] }, 
-    assistant_config = assistant_config,#{"tools": [{"type": "code_interpreter"}]}
-    instructions = context_identity + context_communication +  context_negotiation,
-    
-)
+def PaidReferenceKey(paymentRefence):
+    """
+    PaidReferenceKey
+    ----------------
+    Returns the key claimed in Redis before paying a payment reference, so it is paid once by the AI or by the protocol handler.
+    """
+    return f"paid_reference:{paymentRefence}"
 
 
-# AUTOGEN : Configuration of the UserProxy agent that will interact with the GPTAssistantAgent instance
-user_proxy = UserProxyAgent(
-    name = "user_proxy",
-    code_execution_config = {"use_docker": False},
-    human_input_mode = "NEVER", 
-    max_consecutive_auto_reply = 0 
-   
-)
-# Registering defined functions for the AI Agent
-gpt_assistant.register_function(
-    function_map = {
-        "SendMessage" : SendMessage,
-        "PerformPayment" : WM.PerformPayment
-    }
-)
+def AlreadyPaid(paymentRefence):
+    return {'paymentReference': paymentRefence, 'txHash': None,
+            'message': f"the payment reference {paymentRefence} was already paid, do not pay it again."}
+
+
+# Function / tool used by the AI to pay an invoice, also used for the invoices paid without querying the AI
+def PerformPaymentOnce(recipient_address, amount_to_pay, paymentRefence):
+    """
+    PerformPaymentOnce
+    ------------------
+    Pays an invoice with `WM.PerformPayment`, unless its payment reference was already paid by the AI or by the protocol handler.
+
+    Parameters
+    ----------
+    recipient_address : str
+        The Ethereum address of the payment recipient.
+    amount_to_pay : float
+        The amount to be paid in ETH.
+    paymentRefence : str
+        The payment reference of the invoice.
+
+    Returns
+    -------
+    str
+        The result of the payment, or an indication that the payment reference was already paid.
+    """
+    paidKey = PaidReferenceKey(paymentRefence)
+    if not r.set(paidKey, ia_ID, nx = True, ex = PAID_REFERENCE_TTL):
+        return f"the payment reference {paymentRefence} was already paid, do not pay it again."
+    result = WM.PerformPayment(recipient_address, amount_to_pay, paymentRefence)
+    if result != "transaction is confirmed":
+        # the payment can be tried again
+        r.delete(paidKey)
+    return result
+
+
+# Function / tool used by the AI to pay several invoices at once
+def PerformPaymentsOnce(batch):
+    """
+    PerformPaymentsOnce
+    -------------------
+    Pays several invoices with `WM.PerformPayments`. As with `PerformPaymentOnce`, each payment reference is claimed first:
+    the references already paid by the AI or by the protocol handler are skipped, and the claim of a failed payment is released.
+
+    Parameters
+    ----------
+    batch : list of dict
+        Payments to perform: recipient_address, amount_to_pay and paymentRefence.
+
+    Returns
+    -------
+    list of dict
+        One result per payment, in the same order, see `WM.PerformPayments`.
+    """
+    results, claimed = [], []
+    for payment in batch:
+        reference = payment.get('paymentRefence')
+        if reference is not None and not r.set(PaidReferenceKey(reference), ia_ID, nx = True, ex = PAID_REFERENCE_TTL):
+            results.append(AlreadyPaid(reference))
+            continue
+        claimed.append(len(results))
+        results.append(None)
+    if claimed:
+        for index, result in zip(claimed, WM.PerformPayments([batch[index] for index in claimed])):
+            results[index] = result
+            if result['message'] != "transaction is confirmed" and result['paymentReference'] is not None:
+                # the payment can be tried again
+                r.delete(PaidReferenceKey(result['paymentReference']))
+    return results
 
 
 # Initialize Redis connexion to access message channels 
-r = redis.Redis(host='localhost', port = 6379, db = 0)
+r = redis.Redis(host='localhost', port = 6379, db = int(os.getenv("REDIS_DB", "0")))
+# depth and age of the oldest message of the agent queue, read when the metrics are exported
+MT.WatchQueue(r, f'{ia_ID}_queue')
+
+# AUTOGEN : AI instantiation - Instance is created on the OpenAI server and registered in Redis, it is reused by the next starts of the agent.
+# It is created on first use, or by the warm-up started with the agent, not when the module is imported.
+llm_config = {"config_list": [{"model": ia_model, "temperature": 0.7, "api_key": key}] }
+instructions = context_identity + context_communication +  context_negotiation
+gpt_assistant = LI.Resource("assistant", lambda: RG.GetAssistant(r, "AI Assistant", llm_config, instructions, assistant_config))
+
+# Functions that can be called by the AI Agent
+# their calls are recorded to replay the cached responses, see `ResponseCache`, timed and traced
+function_map = LI.Resource("tools", lambda: RC.Recorded(MT.TimedTools(TR.TracedTools({
+    "SendMessage" : SendMessage,
+    "PerformPayment" : PerformPaymentOnce,
+    "PerformPayments" : PerformPaymentsOnce
+}))))
+
+
+def CreateSession(conversationId):
+    """
+    CreateSession
+    -------------
+    Creates the agents handling a single conversation. The session reuses the assistant created on the OpenAI server
+    and gets its own conversation thread.
+
+    Parameters
+    ----------
+    conversationId : str
+        ID of the conversation handled by the session.
+
+    Returns
+    -------
+    SM.AgentSession
+        The session with its GPTAssistantAgent and UserProxyAgent.
+    """
+    # imported on first use, autogen takes seconds to import
+    from autogen import UserProxyAgent
+    from autogen.agentchat.contrib.gpt_assistant_agent import GPTAssistantAgent
+    assistant = GPTAssistantAgent(
+        name = "AI Assistant",
+        llm_config = llm_config,
+        assistant_config = {**assistant_config, "assistant_id": gpt_assistant.get().assistant_id},
+        instructions = instructions,
+    )
+    # Registering defined functions for the AI Agent
+    assistant.register_function(function_map = function_map.get())
+
+    # AUTOGEN : Configuration of the UserProxy agent that will interact with the GPTAssistantAgent instance
+    user_proxy = UserProxyAgent(
+        name = "user_proxy",
+        code_execution_config = {"use_docker": False},
+        human_input_mode = "NEVER", 
+        max_consecutive_auto_reply = 0 
+    )
+    return SM.AgentSession(conversationId, assistant, user_proxy, cache = responseCache, tools = function_map.get())
+
+
+# Sessions are created on the first message of a conversation and evicted when idle or in excess
+sessions = SM.SessionManager(
+    CreateSession,
+    maxSessions = int(os.getenv("AGENT_MAX_SESSIONS", "100")),
+    idleTTL = float(os.getenv("AGENT_SESSION_TTL", "1800")),
+    warmSessions = int(os.getenv("AGENT_WARM_SESSIONS", "2"))
+)
+
+
+# Cache of the AI responses to repeated prompts, shared between the processes of the agent with RESPONSE_CACHE_REDIS=1
+responseCache = RC.ResponseCache(ia_ID, ia_model, instructions, r if RC.REDIS_TIER else None)
 # Log message to build a conversation history and monitor it on a web interface 
 def log_to_redis(agent, message):
     """
@@ -179,12 +358,10 @@ def log_to_redis(agent, message):
     -------
     None
     """
-    timestamp = datetime.now().isoformat()
-    log_entry = {'timestamp': timestamp, 'agent': agent, 'message': message}
-    r.lpush('conversation_logs', str(log_entry))
+    CL.AppendLog(r, agent, message, SM.CurrentConversation())
 
 # Main function to send a prompt to the AI and get the generated response
-def query_openai(prompt):
+def query_openai(prompt, session, keep = True, cache = True):
     """
     query_openai
     ------------
@@ -194,20 +371,24 @@ def query_openai(prompt):
     ----------
     prompt : str
         The message or prompt to send to the AI assistant.
+    session : SM.AgentSession
+        The session of the conversation the prompt belongs to.
+    keep : bool, optional
+        False for reminder prompts, which are not kept in the summary when the history is compacted.
+    cache : bool, optional
+        False to always query the AI instead of reusing a cached response.
 
     Returns
     -------
     str
         The AI-generated response text, stripped of leading/trailing spaces.
     """
-    response = user_proxy.initiate_chat(gpt_assistant, message = prompt, clear_history = False)
-    chat_history = response.chat_history[-1]['content']
-    return chat_history.strip()
+    return session.ask(prompt, keep, cache)
 
 
 # Processing logic for response and action based on AI generated text. 
 # check for exception in case of failure to generate response from OpenAI Api
-def MessageProcessing(messageFromAItoProcess):
+def MessageProcessing(messageFromAItoProcess, session):
     """
     MessageProcessing
     -----------------
@@ -217,6 +398,8 @@ def MessageProcessing(messageFromAItoProcess):
     ----------
     messageFromAItoProcess : str
         The message generated by the AI assistant to be processed.
+    session : SM.AgentSession
+        The session of the conversation the message belongs to.
 
     Returns
     -------
@@ -233,70 +416,356 @@ def MessageProcessing(messageFromAItoProcess):
         log_to_redis(ia_ID, messageFromAItoProcess)
         return
 
-    query_openai("if you want to send a message to another AI and not the user , use the SendMessage tool and check that the case sensitive AI ID is correct, please remember this information")
+    query_openai("if you want to send a message to another AI and not the user , use the SendMessage tool and check that the case sensitive AI ID is correct, please remember this information", session, keep = False)
     return 
 
 
-#%% In this section : Scheduler and function to get new message from REDIS    
-@app.route('/poll', methods=['GET'])
+#%% In this section : awaitable tools and processing used by the asyncio runtime
+async def SendMessageAsync(recipientID, message):
+    """
+    SendMessageAsync
+    ----------------
+    Awaitable version of `SendMessage`, used by the asyncio runtime.
+
+    Parameters
+    ----------
+    recipientID : str
+        The ID of the recipient, resolved in the agent directory regardless of its letter casing.
+    message : str
+        The message to be transmitted to the recipient.
+
+    Returns
+    -------
+    str
+        A confirmation string, or an error listing the known agents if the recipient is unknown.
+    """
+    entry = await AD.DeliverAsync(runtime.redis, recipientID, ME.PackMessage(ia_ID, message, SM.CurrentConversation()))
+    if entry is None:
+        await runtime.log(ia_ID, f"undeliverable message to {recipientID} : {message}")
+        return AD.DeliveryReport(recipientID, None, await AD.KnownAgentsAsync(runtime.redis))
+    await runtime.log(ia_ID, f"to {entry['id']} : {message}")
+    return AD.DeliveryReport(recipientID, entry)
+
+
+async def PerformPaymentOnceAsync(recipient_address, amount_to_pay, paymentRefence):
+    """
+    PerformPaymentOnceAsync
+    -----------------------
+    Awaitable version of `PerformPaymentOnce`, used by the asyncio runtime.
+    """
+    paidKey = PaidReferenceKey(paymentRefence)
+    if not await runtime.redis.set(paidKey, ia_ID, nx = True, ex = PAID_REFERENCE_TTL):
+        return f"the payment reference {paymentRefence} was already paid, do not pay it again."
+    result = await WM.PerformPaymentAsync(recipient_address, amount_to_pay, paymentRefence)
+    if result != "transaction is confirmed":
+        await runtime.redis.delete(paidKey)
+    return result
+
+
+async def PerformPaymentsOnceAsync(batch):
+    """
+    PerformPaymentsOnceAsync
+    ------------------------
+    Awaitable version of `PerformPaymentsOnce`, used by the asyncio runtime.
+    """
+    results, claimed = [], []
+    for payment in batch:
+        reference = payment.get('paymentRefence')
+        if reference is not None and not await runtime.redis.set(PaidReferenceKey(reference), ia_ID, nx = True, ex = PAID_REFERENCE_TTL):
+            results.append(AlreadyPaid(reference))
+            continue
+        claimed.append(len(results))
+        results.append(None)
+    if claimed:
+        for index, result in zip(claimed, await WM.PerformPaymentsAsync([batch[index] for index in claimed])):
+            results[index] = result
+            if result['message'] != "transaction is confirmed" and result['paymentReference'] is not None:
+                await runtime.redis.delete(PaidReferenceKey(result['paymentReference']))
+    return results
+
+
+async def MessageProcessingAsync(runtime, session, messageFromAItoProcess):
+    """
+    MessageProcessingAsync
+    ----------------------
+    Awaitable version of `MessageProcessing`, used by the asyncio runtime.
+
+    Parameters
+    ----------
+    runtime : AR.AsyncAgentRuntime
+        The runtime processing the message.
+    session : AR.AsyncSession
+        The session of the conversation the message belongs to.
+    messageFromAItoProcess : str
+        The message generated by the AI assistant to be processed.
+
+    Returns
+    -------
+    None
+    """
+    if  "Exception:" in messageFromAItoProcess: 
+        await runtime.log(ia_ID, messageFromAItoProcess)
+        return
+
+    if f"to {user_ID}".lower() in messageFromAItoProcess.lower(): 
+        await runtime.log(ia_ID, messageFromAItoProcess)
+        return
+
+    await runtime.ask("if you want to send a message to another AI and not the user , use the SendMessage tool and check that the case sensitive AI ID is correct, please remember this information", session, keep = False)
+
+
+#%% In this section : protocol messages handled without querying the AI
+def SendProtocolMessage(recipientID, messageType, payload, message):
+    """
+    SendProtocolMessage
+    -------------------
+    Sends a protocol message of the current conversation to another entity, see `ME.PackMessage`. As with `SendMessage`,
+    the recipient is resolved in the agent directory, and a message to an unknown agent goes to the dead-letter queue.
+    """
+    entry = AD.Deliver(r, recipientID, ME.PackMessage(ia_ID, message, SM.CurrentConversation(), messageType, payload))
+    if entry is None:
+        log_to_redis(ia_ID, f"undeliverable message to {recipientID} : {message}")
+        return
+    log_to_redis(ia_ID, f"to {entry['id']} : {message}")
+
+
+def HandleInvoiceIssued(envelope, session):
+    """
+    HandleInvoiceIssued
+    -------------------
+    Pays an invoice issued for an autonomous payment by a known provider, within the automatic payment limit, and informs
+    the provider with a protocol message. The AI is informed with a note sent with its next prompt.
+    Other invoices are handled by the AI.
+
+    Parameters
+    ----------
+    envelope : dict
+        The received envelope, its payload being {invoiceId, paymentReference, paymentAddress, amount, currency}.
+    session : SM.AgentSession or AR.AsyncSession
+        The session of the conversation.
+
+    Returns
+    -------
+    bool
+        True if the invoice was handled.
+    """
+    invoice = envelope['payload']
+    if (envelope['sender'] not in AUTO_PAY_PROVIDERS or not str(invoice.get('currency', '')).upper().startswith('ETH')
+            or float(invoice.get('amount', 0)) > MAX_AUTO_PAYMENT or not invoice.get('paymentReference')):
+        return False
+
+    result = PerformPaymentOnce(invoice['paymentAddress'], float(invoice['amount']), invoice['paymentReference'])
+    log_to_redis(ia_ID, f"Internal Message: automatic payment of the invoice ID {invoice['invoiceId']} : {result}")
+    session.history.note(f"Internal note: the invoice ID {invoice['invoiceId']} of {invoice['amount']} {invoice['currency']} from {envelope['sender']} "
+                         f"with payment reference: {invoice['paymentReference']} was paid automatically, result: {result}. Do not pay it again.")
+    SendProtocolMessage(envelope['sender'], ME.PAYMENT_SENT,
+                        {'invoiceId': invoice['invoiceId'], 'paymentReference': invoice['paymentReference'], 'result': result},
+                        f"Payment of the invoice ID {invoice['invoiceId']} with payment reference {invoice['paymentReference']}: {result}")
+    return True
+
+
+dispatcher = PRD.ProtocolDispatcher()
+dispatcher.register(ME.INVOICE_ISSUED, HandleInvoiceIssued)
+
+
+#%% In this section : Consumers and function to get new message from REDIS
+def HandleMessage(newMessage):
+    """
+    HandleMessage
+    -------------
+    Processes a message received from the Redis queue by querying the AI assistant and handling its response.
+
+    Parameters
+    ----------
+    newMessage : str
+        The decoded message popped from the agent queue.
+
+    Returns
+    -------
+    None
+    """
+    print("new message received")
+    envelope = ME.UnpackMessage(newMessage)
+    ST.RecordQueueWait(envelope)
+    session = sessions.get(envelope['conversationId'])
+    # turns of a conversation are processed in order, other conversations are processed in parallel by the other workers
+    # the handling continues the trace of the sender
+    with TR.MessageSpan(ia_ID, envelope), session.lock:
+        SM.SetCurrentConversation(envelope['conversationId'], envelope['sender'])
+        if dispatcher.dispatch(envelope, session):
+            # routine protocol step, handled without querying the AI
+            return
+        # response
+        response_text = query_openai(ME.FormatPrompt(envelope), session)
+        MessageProcessing(response_text, session)
+
+
+@app.route('/poll', methods = ['GET'])
 def poll_responses():
     """
     poll_responses
     --------------
-    Polls the Redis queue for new messages and processes any received messages by querying the AI assistant.
+    Manual fallback to the queue consumers: processes one message from the Redis queue, if any.
 
     Returns
     -------
     Response : Flask Response object
         A JSON object indicating whether a message was processed or if no new messages were found.
-    """    
-    if r.llen(f'{ia_ID}_queue') > 0:
-        # new message received
-        print("new message received")
-        newMessage = r.rpop(f'{ia_ID}_queue').decode('utf-8')
-        # response
-        response_text = query_openai(newMessage)
-        MessageProcessing(response_text)
+    """
+    if QM.ProcessOne(r, f'{ia_ID}_queue', HandleMessage):
         # response is handled through function calls
         return jsonify({'response': "Message processed"})
-    
+
     return jsonify({'response': "No new messages"})
 
-    
-def poll():
+
+@app.route('/queue', methods = ['GET'])
+def queue_stats():
     """
-    poll
-    ----
-    Periodically polls the Redis queue for new messages by calling the `poll_responses` function.
+    queue_stats
+    -----------
+    Returns the number of waiting and in-flight messages of the agent queue.
 
     Returns
     -------
-    None
+    Response : Flask Response object
+        A JSON object with the queue depth, the in-flight count and the number of registered workers.
+    """
+    return jsonify(QM.QueueStats(r, f'{ia_ID}_queue'))
+
+
+@app.route('/sessions', methods = ['GET'])
+def sessions_stats():
+    """
+    sessions_stats
+    --------------
+    Returns the number of open, created and evicted conversation sessions, and the tokens saved by history compaction per conversation.
+
+    Returns
+    -------
+    Response : Flask Response object
+        A JSON object with the session counters.
+    """
+    return jsonify(runtime.stats() if runtime is not None else sessions.stats())
+
+
+@app.route('/cache', methods = ['GET'])
+def cache_stats():
+    """
+    cache_stats
+    -----------
+    Returns the hit, miss and store counters of the cache of the AI responses.
+
+    Returns
+    -------
+    Response : Flask Response object
+        A JSON object with the cache counters and the hit rate.
+    """
+    return jsonify(responseCache.stats())
+
+
+@app.route('/ready', methods = ['GET'])
+def ready():
     """
-    with app.app_context():
-        poll_responses()
+    ready
+    -----
+    Readiness probe: tells if the agent has created its resources (assistant, tools, consumers...) and reaches Redis.
 
+    Returns
+    -------
+    Response : Flask Response object
+        A JSON object with the status of each resource, with the status code 200 if the agent is ready, 503 otherwise.
+    """
+    status = LI.Readiness(r)
+    return jsonify(status), 200 if status['ready'] else 503
 
-scheduler = BackgroundScheduler()
-scheduler.add_job(poll, 'interval', seconds = 3)  # Poll every 1 seconds
-scheduler.start()
+
+# Number of consumer threads blocked on the agent queue, they wake up as soon as a message is pushed
+workers = int(os.getenv("AGENT_WORKERS", "4"))
+runtime = None
+heartbeat = None
+
+
+def StartAsyncRuntime():
+    """
+    StartAsyncRuntime
+    -----------------
+    Creates and starts the asyncio runtime: the LLM runs and the tools are awaited, no thread is held while waiting.
+
+    Returns
+    -------
+    threading.Thread
+        The thread running the event loop of the runtime.
+    """
+    global runtime
+    runtime = AR.AsyncAgentRuntime(
+        ia_ID,
+        gpt_assistant.get().assistant_id,
+        MT.TimedTools(TR.TracedTools({
+            "SendMessage" : SendMessageAsync,
+            "PerformPayment" : PerformPaymentOnceAsync,
+            "PerformPayments" : PerformPaymentsOnceAsync
+        })),
+        MessageProcessingAsync,
+        apiKey = key,
+        concurrency = int(os.getenv("AGENT_ASYNC_CONCURRENCY", "1000")),
+        maxSessions = int(os.getenv("AGENT_MAX_SESSIONS", "10000")),
+        idleTTL = float(os.getenv("AGENT_SESSION_TTL", "1800")),
+        redisUrl = f"redis://localhost:6379/{os.getenv('REDIS_DB', '0')}",
+        dispatcher = dispatcher,
+        cache = responseCache,
+        warmThreads = int(os.getenv("AGENT_WARM_SESSIONS", "2"))
+    )
+    return AR.StartInBackground(runtime)
+
+
+def Start():
+    """
+    Start
+    -----
+    Starts the agent: registers it in the agent directory, and creates its resources then starts the consumers of its
+    queue in the background, so the Flask application answers at once. Nothing is started when the module is only imported.
+
+    Returns
+    -------
+    None
+    """
+    global heartbeat, consumers, warmer, confirmer
+    # the queue of the agent is registered in the agent directory while the agent is running
+    heartbeat = AD.Register(r, ia_ID)
+    # records the receipts of the payments sent by the AI wallet, once walletManager is imported
+    confirmer = LI.Resource("payment confirmer", lambda: WM.StartConfirmer())
+    if os.getenv("AGENT_RUNTIME", "threads") == "async":
+        # the runtime needs the ID of the assistant
+        consumers = LI.Resource("async runtime", StartAsyncRuntime)
+    else:
+        # sessions are created ahead of the first message of a conversation
+        warmer = sessions.prewarm()
+        consumers = LI.Resource("consumers", lambda: QM.StartConsumers(r, f'{ia_ID}_queue', HandleMessage, workers = workers))
+    # the messages wait in the queue until the consumers are started, once the assistant is created
+    LI.WarmUp([gpt_assistant, function_map, consumers, confirmer])
+    # Registering the assistant deletion function at exit.
+    atexit.register(delete_assistant)
 #%%
 # Function to delete assistant from the OpenAI Server   
 def delete_assistant():
     """
     delete_assistant
     ----------------
-    Deletes the GPTAssistantAgent instance from the OpenAI server when the program terminates.
+    Deletes the conversation threads from the OpenAI server when the program terminates, and marks the agent offline
+    in the agent directory. The GPTAssistantAgent instance is kept for the next start, unless ASSISTANT_DELETE_ON_EXIT=1.
 
     Returns
     -------
     None
     """
-    if gpt_assistant is not None:
-        gpt_assistant.delete_assistant()
+    AD.Unregister(r, ia_ID, heartbeat)
+    sessions.close_all()
+    # an assistant not created yet is not created to be deleted
+    if gpt_assistant.ready and RG.DELETE_ON_EXIT:
+        RG.DeleteAssistant(r, gpt_assistant.get(), llm_config, instructions, assistant_config)
         print("Assistant deleted.")
-# Registering the assistant deletion function at exit.
-atexit.register(delete_assistant)
 
 if __name__ == '__main__':
+    Start()
     app.run(port = 5000)
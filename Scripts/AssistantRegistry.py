@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+
+# Redis hash of the IDs of the assistants created on the OpenAI server, by agent name and configuration
+REGISTRY_KEY = "assistant_registry"
+# Set to 1 to delete the assistant from the OpenAI server when the agent stops, it is otherwise reused by the next start
+DELETE_ON_EXIT = os.getenv("ASSISTANT_DELETE_ON_EXIT", "0") == "1"
+
+
+def AssistantHash(llm_config, instructions, assistant_config):
+    """
+    AssistantHash
+    -------------
+    Returns the hash of the configuration of an assistant: its model, instructions and tools.
+    A change in any of them creates a new assistant instead of reusing the registered one.
+    """
+    models = [config.get('model') for config in llm_config.get('config_list', [])]
+    configuration = json.dumps([models, instructions, assistant_config], sort_keys = True)
+    return hashlib.sha256(configuration.encode('utf-8')).hexdigest()[:16]
+
+
+def RegistryField(name, llm_config, instructions, assistant_config):
+    """
+    RegistryField
+    -------------
+    Returns the field of the registry holding the ID of an assistant.
+    """
+    return f"{name}:{AssistantHash(llm_config, instructions, assistant_config)}"
+
+
+def GetAssistant(redisConnexion, name, llm_config, instructions, assistant_config):
+    """
+    GetAssistant
+    ------------
+    Returns the GPTAssistantAgent of an agent, reusing the assistant registered in Redis for the same configuration
+    instead of creating a new one on the OpenAI server at each start. The assistant is created and registered
+    if there is none, or if the registered one was deleted from the server.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server.
+    name : str
+        Name of the assistant.
+    llm_config : dict
+        Configuration of the model, see GPTAssistantAgent.
+    instructions : str
+        Instructions of the assistant.
+    assistant_config : dict
+        Tools of the assistant, see GPTAssistantAgent.
+
+    Returns
+    -------
+    GPTAssistantAgent
+        The assistant agent, its ID being registered.
+    """
+    # imported on first use, autogen takes seconds to import
+    from autogen.agentchat.contrib.gpt_assistant_agent import GPTAssistantAgent
+    field = RegistryField(name, llm_config, instructions, assistant_config)
+    assistantId = redisConnexion.hget(REGISTRY_KEY, field)
+    if assistantId is not None:
+        try:
+            return GPTAssistantAgent(
+                name = name,
+                llm_config = llm_config,
+                assistant_config = {**assistant_config, "assistant_id": assistantId.decode('utf-8')},
+                instructions = instructions,
+            )
+        except Exception as e:
+            print(f"Registered assistant {assistantId.decode('utf-8')} not available, a new one is created: {e}")
+            redisConnexion.hdel(REGISTRY_KEY, field)
+
+    assistant = GPTAssistantAgent(
+        name = name,
+        llm_config = llm_config,
+        assistant_config = assistant_config,
+        instructions = instructions,
+    )
+    if not redisConnexion.hsetnx(REGISTRY_KEY, field, assistant.assistant_id):
+        # registered concurrently by another process, its assistant is used and ours is deleted
+        registeredId = redisConnexion.hget(REGISTRY_KEY, field).decode('utf-8')
+        if registeredId != assistant.assistant_id:
+            assistant.delete_assistant()
+            return GetAssistant(redisConnexion, name, llm_config, instructions, assistant_config)
+    print(f"Assistant {assistant.assistant_id} registered for {name}")
+    return assistant
+
+
+def DeleteAssistant(redisConnexion, assistant, llm_config, instructions, assistant_config):
+    """
+    DeleteAssistant
+    ---------------
+    Deletes an assistant from the OpenAI server and from the registry.
+    """
+    field = RegistryField(assistant.name, llm_config, instructions, assistant_config)
+    registeredId = redisConnexion.hget(REGISTRY_KEY, field)
+    if registeredId is not None and registeredId.decode('utf-8') == assistant.assistant_id:
+        redisConnexion.hdel(REGISTRY_KEY, field)
+    assistant.delete_assistant()
@@ -0,0 +1,355 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+import redis.asyncio as aioredis
+import AgentDirectory as AD
+import ConversationLog as CL
+import HistoryManager as HM
+import MessageEnvelope as ME
+import Metrics as MT
+import QueueManager as QM
+import ResponseCache as RC
+import SessionManager as SM
+import StageTimings as ST
+import Tracing as TR
+
+
+class AsyncSession:
+    """
+    AsyncSession
+    ------------
+    Conversation handled by the asyncio runtime. It only holds the ID of its OpenAI thread, created on the first turn.
+
+    Parameters
+    ----------
+    conversationId : str
+        ID of the conversation handled by the session.
+    """
+    def __init__(self, conversationId):
+        self.conversationId = conversationId
+        self.threadId = None
+        # turns of a conversation are processed one at a time
+        self.lock = asyncio.Lock()
+        self.lastUsed = time.monotonic()
+        self.history = HM.HistoryManager()
+
+
+class AsyncAgentRuntime:
+    """
+    AsyncAgentRuntime
+    -----------------
+    asyncio based agent loop. Messages of the agent queue are consumed with async Redis and each one is processed
+    in its own task, the assistant runs and the tools being awaited. Waiting for the LLM, for an invoice status or
+    for a transaction receipt does not hold a thread, so a single process can drive thousands of conversations.
+    Delivery is at-least-once, with the same processing lists and heartbeats as `QueueManager`.
+
+    Parameters
+    ----------
+    agentId : str
+        ID of the agent, its queue is '{agentId}_queue'.
+    assistantId : str
+        ID of the assistant on the OpenAI server.
+    tools : dict
+        Coroutine functions that can be called by the AI, by name.
+    processResponse : coroutine function
+        Called with (runtime, session, response text) after each turn of the AI.
+    apiKey : str
+        OpenAI API key.
+    concurrency : int, optional
+        Maximum number of messages processed at the same time. Defaults to 1000.
+    consumers : int, optional
+        Number of tasks blocked on the queue. Defaults to 4.
+    maxSessions : int, optional
+        Maximum number of conversations kept open. Defaults to 10000.
+    idleTTL : float, optional
+        Time (in seconds) after which an idle conversation is closed. Defaults to 1800.
+    redisUrl : str, optional
+        URL of the Redis server. Defaults to 'redis://localhost:6379/0'.
+    dispatcher : ProtocolDispatcher, optional
+        Handles the protocol messages without querying the assistant when possible.
+    cache : ResponseCache, optional
+        Cache of the AI responses. Defaults to None.
+    warmThreads : int, optional
+        Number of OpenAI threads created ahead of the conversations, so the first turn does not wait for it. Defaults to 0.
+    """
+    def __init__(self, agentId, assistantId, tools, processResponse, apiKey, concurrency = 1000, consumers = 4,
+                 maxSessions = 10000, idleTTL = 1800, redisUrl = "redis://localhost:6379/0", dispatcher = None, cache = None,
+                 warmThreads = 0):
+        self.agentId = agentId
+        self.assistantId = assistantId
+        self.tools = tools
+        self.processResponse = processResponse
+        self.concurrency = concurrency
+        self.consumers = consumers
+        self.maxSessions = maxSessions
+        self.idleTTL = idleTTL
+        self.redisUrl = redisUrl
+        self.dispatcher = dispatcher
+        self.cache = cache
+        self.warmThreads = warmThreads
+        # IDs of the threads created ahead, refilled by `_prewarm`
+        self.threadPool = []
+        self.queueName = f"{agentId}_queue"
+        # unique per start of the process, see `QueueManager.START_ID`
+        self.workerId = f"{QM.ProcessId()}-async"
+        # imported with the runtime only, the thread runtime does not need it
+        from openai import AsyncOpenAI
+        self.client = AsyncOpenAI(api_key = apiKey)
+        self.sessions = OrderedDict()
+        # created in the event loop by `run`
+        self.redis = None
+        self.semaphore = None
+        self.refill = None
+        # references to the running tasks, so they are not garbage collected
+        self.tasks = set()
+
+    def spawn(self, coroutine):
+        """
+        Runs a coroutine in a background task of the runtime.
+        """
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def log(self, agent, message):
+        """
+        Logs a message of the current conversation into the Redis log streams, see `ConversationLog`.
+        """
+        await CL.AppendLogAsync(self.redis, agent, message, SM.CurrentConversation())
+
+    def stats(self):
+        """
+        Returns the number of open sessions, the tokens saved by history compaction and the history statistics of each open conversation.
+        """
+        history = {conversationId: session.history.stats() for conversationId, session in self.sessions.items()}
+        return {'open': len(self.sessions), 'maxSessions': self.maxSessions, 'idleTTL': self.idleTTL, 'warm': len(self.threadPool),
+                'tokensSaved': sum(stats['tokensSaved'] for stats in history.values()), 'history': history}
+
+    def session(self, conversationId):
+        """
+        Returns the session of a conversation, creating it if needed. Idle and exceeding sessions are closed.
+        """
+        session = self.sessions.get(conversationId)
+        if session is None:
+            session = AsyncSession(conversationId)
+            self.sessions[conversationId] = session
+        self.sessions.move_to_end(conversationId)
+        session.lastUsed = time.monotonic()
+
+        now = time.monotonic()
+        for oldId, oldest in list(self.sessions.items()):
+            if len(self.sessions) <= self.maxSessions and now - oldest.lastUsed < self.idleTTL:
+                break
+            if oldest.lock.locked():
+                # a turn is in progress
+                continue
+            del self.sessions[oldId]
+            if oldest.threadId is not None:
+                self.spawn(self._deleteThread(oldest.threadId))
+        return session
+
+    async def _deleteThread(self, threadId):
+        try:
+            await self.client.beta.threads.delete(threadId)
+        except Exception as e:
+            print(f"Error while deleting thread {threadId}: {e}")
+
+    @TR.Traced("query_openai")
+    async def ask(self, prompt, session, keep = True, cache = True):
+        """
+        Sends a prompt to the assistant in the thread of the session, runs the requested tools concurrently
+        and returns the generated response, stripped of leading/trailing spaces.
+        The history is compacted first and the response cache is used as in `SessionManager.AgentSession.ask`.
+        """
+        start = time.perf_counter()
+        key = None
+        if self.cache is not None:
+            key, entry = await asyncio.to_thread(self.cache.lookup, prompt, session.history, keep, cache)
+            if entry is not None:
+                for call in entry['calls']:
+                    await self.tools[call['name']](**call['arguments'])
+                text = self.cache.hit(prompt, entry, session.history, keep)
+                TR.SetAttributes(cached = True)
+                MT.QUERY_SECONDS.observe(time.perf_counter() - start, cached = "true")
+                return text
+
+        if session.history.needs_compaction():
+            session.history.compact()
+            if session.threadId is not None:
+                self.spawn(self._deleteThread(session.threadId))
+                session.threadId = None
+        # the time spent in the tools is recorded in their own stages
+        with ST.Stage(ST.LLM_CALL):
+            if session.threadId is None:
+                session.threadId = await self._newThread()
+
+            await self.client.beta.threads.messages.create(thread_id = session.threadId, role = "user", content = session.history.prepare(prompt))
+            # the tool tasks share the calls list of this task
+            calls = RC.StartRecording()
+            try:
+                run = await self.client.beta.threads.runs.create_and_poll(thread_id = session.threadId, assistant_id = self.assistantId)
+                while run.status == "requires_action":
+                    toolCalls = run.required_action.submit_tool_outputs.tool_calls
+                    outputs = await asyncio.gather(*[self._callTool(toolCall) for toolCall in toolCalls])
+                    run = await self.client.beta.threads.runs.submit_tool_outputs_and_poll(
+                        thread_id = session.threadId, run_id = run.id, tool_outputs = outputs)
+            finally:
+                RC.StopRecording()
+            if run.usage is not None:
+                MT.RecordTokens(run.usage.prompt_tokens, run.usage.completion_tokens)
+
+            if run.status != "completed":
+                MT.QUERY_SECONDS.observe(time.perf_counter() - start, cached = "false")
+                return f"Exception: assistant run ended with status {run.status}"
+            messages = await self.client.beta.threads.messages.list(thread_id = session.threadId, order = "desc", limit = 1)
+        text = "\n".join(part.text.value for part in messages.data[0].content if part.type == "text").strip()
+        session.history.record(prompt, text, keep)
+        if key is not None:
+            await asyncio.to_thread(self.cache.store, key, text, calls, SM.CurrentSender(), keep)
+        MT.QUERY_SECONDS.observe(time.perf_counter() - start, cached = "false")
+        return text
+
+    async def _newThread(self):
+        """
+        Returns the ID of a new OpenAI thread, taken from the warm threads when possible.
+        """
+        if self.threadPool:
+            self.refill.set()
+            return self.threadPool.pop()
+        return (await self.client.beta.threads.create()).id
+
+    async def _prewarm(self):
+        """
+        Keeps `warmThreads` threads created ahead of the conversations.
+        """
+        while True:
+            self.refill.clear()
+            while len(self.threadPool) < self.warmThreads:
+                try:
+                    self.threadPool.append((await self.client.beta.threads.create()).id)
+                except Exception as e:
+                    print(f"Error while creating a warm thread: {e}")
+                    await asyncio.sleep(5)
+            await self.refill.wait()
+
+    async def _callTool(self, toolCall):
+        """
+        Awaits the tool requested by the assistant and returns its output for the run.
+        """
+        function = self.tools.get(toolCall.function.name)
+        if function is None:
+            RC.RecordCall(toolCall.function.name, {})
+            output = f"Error: unknown function {toolCall.function.name}"
+        else:
+            try:
+                arguments = json.loads(toolCall.function.arguments)
+                RC.RecordCall(toolCall.function.name, arguments)
+                output = await function(**arguments)
+            except Exception as e:
+                output = f"Error: {e}"
+        return {"tool_call_id": toolCall.id, "output": str(output)}
+
+    async def _handle(self, rawMessage):
+        envelope = ME.UnpackMessage(rawMessage)
+        ST.RecordQueueWait(envelope)
+        session = self.session(envelope['conversationId'])
+        # the handling continues the trace of the sender
+        with TR.MessageSpan(self.agentId, envelope):
+            async with session.lock:
+                # the conversation is bound to the task context, it is read by the tools
+                SM.SetCurrentConversation(envelope['conversationId'], envelope['sender'])
+                if self.dispatcher is not None and await self.dispatcher.dispatch_async(envelope, session):
+                    return
+                response_text = await self.ask(ME.FormatPrompt(envelope), session)
+                await self.processResponse(self, session, response_text)
+
+    async def _process(self, item):
+        try:
+            await self._handle(item.decode('utf-8'))
+        except Exception as e:
+            # a failing message is acknowledged anyway, re-delivering it would fail again; it is kept in the dead-letter queue
+            print(f"Error while processing message from {self.queueName}: {e}")
+            await AD.DeadLetterAsync(self.redis, item.decode('utf-8'), AD.HANDLER_ERROR, self.queueName, repr(e))
+        finally:
+            await self.redis.lrem(QM.ProcessingKey(self.queueName, self.workerId), 1, item)
+            self.semaphore.release()
+
+    async def _consume(self):
+        processingKey = QM.ProcessingKey(self.queueName, self.workerId)
+        while True:
+            # do not pop more messages than can be processed
+            await self.semaphore.acquire()
+            try:
+                item = await self.redis.brpoplpush(self.queueName, processingKey, timeout = QM.BLOCK_TIMEOUT)
+            except Exception as e:
+                self.semaphore.release()
+                print(f"Redis connexion error on {self.queueName}: {e}")
+                await asyncio.sleep(1)
+                continue
+            if item is None:
+                self.semaphore.release()
+                continue
+            self.spawn(self._process(item))
+
+    async def _heartbeat(self):
+        while True:
+            try:
+                await self.redis.set(QM.HeartbeatKey(self.queueName, self.workerId), 1, ex = QM.HEARTBEAT_TTL)
+            except Exception as e:
+                print(f"Redis connexion error on {self.queueName} heartbeat: {e}")
+            await asyncio.sleep(QM.HEARTBEAT_TTL / 3)
+
+    async def _recover(self):
+        """
+        Re-delivers the in-flight messages of dead workers, see `QueueManager.RecoverStaleMessages`.
+        """
+        requeue = self.redis.register_script(QM.REQUEUE_SCRIPT)
+        for workerId in await self.redis.smembers(QM.WorkersKey(self.queueName)):
+            workerId = workerId.decode('utf-8')
+            if await self.redis.exists(QM.HeartbeatKey(self.queueName, workerId)):
+                continue
+            recovered = await requeue(keys = [QM.ProcessingKey(self.queueName, workerId), self.queueName])
+            await self.redis.srem(QM.WorkersKey(self.queueName), workerId)
+            if recovered:
+                print(f"{recovered} in-flight message(s) re-delivered in {self.queueName}")
+
+    async def run(self):
+        """
+        Runs the agent loop until cancelled.
+        """
+        # connexions are pooled, a blocked consumer holds one of them and the tasks wait for a free one
+        pool = aioredis.BlockingConnectionPool.from_url(self.redisUrl, max_connections = self.consumers + 50)
+        self.redis = aioredis.Redis(connection_pool = pool)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.refill = asyncio.Event()
+
+        await self.redis.sadd(QM.WorkersKey(self.queueName), self.workerId)
+        await self.redis.set(QM.HeartbeatKey(self.queueName, self.workerId), 1, ex = QM.HEARTBEAT_TTL)
+        await self._recover()
+
+        tasks = [self._heartbeat(), self._prewarm()] + [self._consume() for _ in range(max(1, self.consumers))]
+        await asyncio.gather(*tasks)
+
+
+def StartInBackground(runtime):
+    """
+    StartInBackground
+    -----------------
+    Runs an `AsyncAgentRuntime` in its own event loop, in a daemon thread, next to the Flask application.
+
+    Parameters
+    ----------
+    runtime : AsyncAgentRuntime
+        The runtime to run.
+
+    Returns
+    -------
+    threading.Thread
+        The thread running the event loop.
+    """
+    loopThread = threading.Thread(target = asyncio.run, args = (runtime.run(),), name = f"{runtime.queueName}-asyncio", daemon = True)
+    loopThread.start()
+    return loopThread
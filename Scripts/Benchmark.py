@@ -0,0 +1,159 @@
+"""
+Offline end-to-end benchmark of the haiku purchase: negotiation, invoice, payment and delivery.
+AssistantAgent and ServiceProviderAgent run as in production, against the local stand-ins of BenchmarkStubs.py
+(scripted fake LLM, fake rnapi server, fake node) and a local Redis server, with a new throwaway wallet.
+Conversations are started by pushing a user message in the AssistantAgent queue, at most `concurrency` at a time,
+and end when the haiku is forwarded to the user.
+
+The durations of the stages recorded by the agents (see StageTimings.py) are reported as p50 / p95 / p99, with the
+duration of the conversations and the number of conversations per second. The agents run with the runtime set by
+AGENT_RUNTIME, and the latencies of the stand-ins are set with OPENAI_STUB_LATENCY, RNAPI_STUB_LATENCY and CHAIN_STUB_LATENCY.
+
+Usage : python Benchmark.py [conversations] [concurrency]
+"""
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+import uuid
+import redis
+from eth_account import Account
+import ConversationLog as CL
+import MessageEnvelope as ME
+import StageTimings as ST
+from BenchmarkStubs import CLIENT_ID, USER_ID, DELIVERED
+
+STUBS_PORT = 5056
+# Ports of the Flask applications of the agents
+AGENT_PORTS = {"ServiceProviderAgent.py": 5001, "AssistantAgent.py": 5000}
+# Time (in seconds) after which the conversations still running are reported as not completed
+TIMEOUT = float(os.getenv("BENCHMARK_TIMEOUT", "300"))
+STAGES = [ST.QUEUE_WAIT, ST.LLM_CALL, ST.INVOICE_CREATE, ST.STATUS_CHECK, ST.PAYMENT]
+
+
+def Percentile(samples, p):
+    """
+    Returns the p-th percentile of sorted samples (nearest rank).
+    """
+    return samples[max(0, min(len(samples) - 1, math.ceil(p / 100 * len(samples)) - 1))]
+
+
+def WaitFor(url, timeout = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout = 1)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"{url} did not answer within {timeout} seconds")
+
+
+def Start(script, env, logDir, *args):
+    log = open(os.path.join(logDir, script.replace(".py", ".log")), "w")
+    return subprocess.Popen([sys.executable, script, *args], cwd = os.path.dirname(os.path.abspath(__file__)),
+                            env = env, stdout = log, stderr = subprocess.STDOUT)
+
+
+def Environment(timingsKey, redisDb = None):
+    """
+    Returns the environment of the stand-ins and of the agents, using the Redis database `redisDb` if given (REDIS_DB).
+    """
+    wallet = Account.create()
+    env = dict(os.environ)
+    env.update({
+        'OPENAI_BASE_URL': f"http://localhost:{STUBS_PORT}/v1",
+        'OPENAI_API_KEY': "benchmark",
+        'RNAPI_URL': f"http://localhost:{STUBS_PORT}",
+        'infura_url_key': f"http://localhost:{STUBS_PORT}/rpc",
+        'PRIVATEKEYMETAMASK': wallet.key.hex(),
+        'WalletPaymentMetamask': wallet.address,
+        'paymentReceiverAddress': Account.create().address,
+        'STAGE_TIMINGS_KEY': timingsKey,
+    })
+    if redisDb is not None:
+        env['REDIS_DB'] = str(redisDb)
+    # the watcher and the confirmer do not add their default interval to each conversation
+    env.setdefault('INVOICE_WATCH_INTERVAL', "0.2")
+    env.setdefault('PAYMENT_CONFIRM_INTERVAL', "0.2")
+    return env
+
+
+def RunConversations(r, conversations, concurrency, runId):
+    """
+    Starts the conversations and waits for their end. Returns the duration of each completed conversation.
+    """
+    cursor = CL.ReadLogs(r, limit = 1)['cursor']
+    waiting = [f"benchmark-{runId}-{n}" for n in range(conversations)]
+    running = {}
+    durations = []
+    deadline = time.monotonic() + TIMEOUT
+    while (waiting or running) and time.monotonic() < deadline:
+        while waiting and len(running) < concurrency:
+            conversationId = waiting.pop(0)
+            running[conversationId] = time.perf_counter()
+            r.lpush(f'{CLIENT_ID}_queue', ME.PackMessage(USER_ID, "Please buy me a haiku.", conversationId))
+        result = CL.ReadLogs(r, since = cursor, limit = CL.MAX_READ, block = 1000)
+        cursor = result['cursor']
+        for log in result['logs']:
+            conversationId = log.get('conversationId')
+            if log['agent'] == CLIENT_ID and DELIVERED in log['message'] and conversationId in running:
+                durations.append(time.perf_counter() - running.pop(conversationId))
+    if running or waiting:
+        print(f"{len(running) + len(waiting)} conversation(s) not completed within {TIMEOUT} seconds")
+    return durations
+
+
+def Report(r, timingsKey, durations, elapsed):
+    # let the agents flush their last timings
+    time.sleep(2 * ST.FLUSH_INTERVAL)
+    samples = {stage: [] for stage in STAGES}
+    for item in r.lrange(timingsKey, 0, -1):
+        stage, seconds = json.loads(item)
+        samples.setdefault(stage, []).append(seconds)
+    samples['conversation'] = durations
+
+    print(f"{'stage':<16}{'count':>8}{'p50 (ms)':>12}{'p95 (ms)':>12}{'p99 (ms)':>12}")
+    for stage, values in samples.items():
+        values.sort()
+        if not values:
+            print(f"{stage:<16}{0:>8}")
+            continue
+        print(f"{stage:<16}{len(values):>8}" + "".join(f"{Percentile(values, p) * 1000:>12.1f}" for p in (50, 95, 99)))
+    print(f"{len(durations)} conversation(s) in {elapsed:.1f} s: {len(durations) / elapsed:.2f} conversations per second")
+
+
+if __name__ == "__main__":
+    conversations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    runId = uuid.uuid4().hex[:8]
+    timingsKey = f"benchmark:{runId}:timings"
+    logDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_logs")
+    os.makedirs(logDir, exist_ok = True)
+
+    r = redis.Redis(host='localhost', port = 6379, db = int(os.getenv("REDIS_DB", "0")))
+    r.ping()
+    env = Environment(timingsKey)
+    processes = [Start("BenchmarkStubs.py", env, logDir, str(STUBS_PORT))]
+    try:
+        WaitFor(f"http://localhost:{STUBS_PORT}/stub/stats")
+        for script, port in AGENT_PORTS.items():
+            processes.append(Start(script, env, logDir))
+            # the agents create their assistant in the background, they are ready to handle messages once /ready answers
+            WaitFor(f"http://localhost:{port}/ready")
+        # startup calls are not part of the measure
+        r.delete(timingsKey)
+
+        print(f"Benchmark {runId}: {conversations} conversation(s), {concurrency} at a time, "
+              f"{env.get('AGENT_RUNTIME', 'threads')} runtime, logs in {logDir}")
+        start = time.perf_counter()
+        durations = RunConversations(r, conversations, concurrency, runId)
+        Report(r, timingsKey, durations, time.perf_counter() - start)
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+        r.delete(timingsKey)
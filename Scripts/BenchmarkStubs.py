@@ -0,0 +1,218 @@
+"""
+Local stand-ins of the external services, for the offline benchmark (see Benchmark.py). A single server answers:
+- the OpenAI Assistants API (see OpenAIStub.py), the replies following a scripted haiku negotiation, tool calls included,
+- the rnapi invoice API (/invoices...), the invoices being paid once a transaction carrying their payment reference is sent,
+- the JSON-RPC API of an Ethereum node (/rpc), every transaction being mined at once.
+
+The agents are pointed at it with OPENAI_BASE_URL=http://localhost:5056/v1, RNAPI_URL=http://localhost:5056 and
+infura_url_key=http://localhost:5056/rpc. The latencies of the stand-ins are set in milliseconds with OPENAI_STUB_LATENCY,
+RNAPI_STUB_LATENCY and CHAIN_STUB_LATENCY.
+
+Usage : python BenchmarkStubs.py [port]
+"""
+import hashlib
+import os
+import re
+import secrets
+import sys
+import threading
+import time
+from flask import jsonify, request
+import OpenAIStub
+from OpenAIStub import app
+
+RNAPI_LATENCY = float(os.getenv("RNAPI_STUB_LATENCY", "0")) / 1000
+CHAIN_LATENCY = float(os.getenv("CHAIN_STUB_LATENCY", "0")) / 1000
+
+CLIENT_ID = "AssistantAgent"
+PROVIDER_ID = "HaikuServiceProvider"
+USER_ID = "haikuLover"
+# Names of the assistants, as created by the agents
+PROVIDER_NAME = "Haiku Service Provider"
+PRICE = 0.001
+HAIKU = "An old silent pond / A frog jumps into the pond / Splash! Silence again."
+# Marker of the last message of a conversation, read by the benchmark
+DELIVERED = "here is your haiku"
+
+
+#%% In this section : scripted haiku negotiation
+def HaikuScript(assistantName, prompt):
+    """
+    HaikuScript
+    -----------
+    Script of the fake LLM, see `OpenAIStub.CannedReply`. Each reply depends on the last message of the prompt only:
+    the client asks for the price, accepts the offer and forwards the haiku to the user; the provider gives its price,
+    sends the invoice for an autonomous payment, and delivers the haiku once the InvoiceWatcher confirms the payment.
+    The invoice is paid by the protocol handler of the client, without querying the AI.
+    """
+    # notes and summaries may be prefixed to the prompt, the message is after the last 'From'
+    message = prompt.rsplit("From ", 1)[-1]
+    sender = message.split(" : ", 1)[0]
+    text = message.lower()
+    if assistantName == PROVIDER_NAME:
+        return ProviderTurn(sender, text, message)
+    return ClientTurn(sender, text)
+
+
+def ClientTurn(sender, text):
+    if sender == PROVIDER_ID and "haiku:" in text:
+        return f"to {USER_ID} {DELIVERED}: {HAIKU}"
+    if sender == PROVIDER_ID and "payment reference" in text:
+        return f"to {USER_ID} the invoice of {PROVIDER_ID} is paid automatically."
+    if sender == PROVIDER_ID and "price" in text:
+        return _send(PROVIDER_ID, f"I accept your offer. Email address: test.email@gmail.com, preferred currency: ETH-sepolia, "
+                                  f"wallet address: {os.getenv('WalletPaymentMetamask')}. Please send me the payment reference "
+                                  f"and the payment recipient address.",
+                     f"to {USER_ID} I accepted the offer of {PRICE} ETH-sepolia.")
+    if sender == USER_ID:
+        return _send(PROVIDER_ID, "Hello, I would like a haiku. What is your price?",
+                     f"to {USER_ID} I asked {PROVIDER_ID} for the price of a haiku.")
+    return f"to {USER_ID} noted."
+
+
+def ProviderTurn(sender, text, message):
+    if sender == "InvoiceWatcher":
+        return _send(CLIENT_ID, f"Thank you for your payment, here is your haiku: {HAIKU}", "Internal Message: haiku delivered.")
+    if "accept" in text:
+        return _invoice(sender, re.search(r"0x[0-9a-fA-F]{40}", message).group(0))
+    if "price" in text:
+        return _send(sender, f"The price of a haiku is {PRICE} ETH-sepolia.", "Internal Message: price sent.")
+    return "Internal Message: nothing to do."
+
+
+def _send(recipientID, message, reply):
+    yield "SendMessage", {'recipientID': recipientID, 'message': message}
+    return reply
+
+
+def _invoice(recipientID, wallet):
+    output = yield "SendInvoice", {'clientInfo_Email': "test.email@gmail.com", 'clientInfo_identity_address': wallet,
+                                   'currency': "ETH-sepolia", 'price': PRICE, 'serviceName': "AI Haiku Service", 'autoPayment': True}
+    yield "SendMessage", {'recipientID': recipientID, 'message': output}
+    return "Internal Message: invoice sent."
+
+
+OpenAIStub.script = HaikuScript
+
+
+#%% In this section : rnapi invoice API
+lock = threading.Lock()
+# invoice ID -> {'status', 'paymentReference'}
+invoices = {}
+# payment reference (lowercase hex) -> invoice ID, for the invoices waiting for their payment
+openReferences = {}
+
+
+def CreateInvoice(body):
+    invoice = {'id': "01" + secrets.token_hex(32), 'paymentReference': secrets.token_hex(8)}
+    with lock:
+        invoices[invoice['id']] = {'status': "open", 'paymentReference': invoice['paymentReference']}
+        openReferences[invoice['paymentReference']] = invoice['id']
+    return invoice
+
+
+@app.route('/invoices', methods = ['POST'])
+def create_invoice():
+    body = request.get_json(force = True)
+    if not body.get('paymentAddress') or not body.get('expectedAmount'):
+        return jsonify({'error': "paymentAddress and expectedAmount are required"}), 400
+    time.sleep(RNAPI_LATENCY)
+    if body.get('async') is True:
+        return jsonify({**CreateInvoice(body), 'status': "pending"}), 202
+    return jsonify(CreateInvoice(body)), 201
+
+
+@app.route('/invoices/batch', methods = ['POST'])
+def create_invoices():
+    body = request.get_json(force = True)
+    time.sleep(RNAPI_LATENCY)
+    status = 202 if body.get('async') is True else 201
+    return jsonify({'results': [{'index': index, 'status': status, **CreateInvoice(invoice)} for index, invoice in enumerate(body['invoices'])]})
+
+
+@app.route('/invoices/<invoiceId>', methods = ['GET'])
+def invoice_status(invoiceId):
+    time.sleep(RNAPI_LATENCY)
+    with lock:
+        invoice = invoices.get(invoiceId)
+    if invoice is None:
+        return jsonify({'error': f"invoice {invoiceId} not found"}), 404
+    return jsonify({'status': invoice['status']})
+
+
+@app.route('/invoices/status', methods = ['POST'])
+def invoice_statuses():
+    ids = request.get_json(force = True)['ids']
+    time.sleep(RNAPI_LATENCY)
+    with lock:
+        statuses = {ID: {'status': invoices[ID]['status']} if ID in invoices else {'status': "error", 'error': "not found"} for ID in ids}
+    return jsonify({'statuses': statuses})
+
+
+#%% In this section : JSON-RPC API of the node
+BLOCK = {
+    "number": "0x1", "hash": "0x" + "11" * 32, "parentHash": "0x" + "00" * 32, "timestamp": "0x1",
+    "gasLimit": "0x1c9c380", "gasUsed": "0x0", "baseFeePerGas": "0x3b9aca00", "transactions": []
+}
+RESPONSES = {
+    "eth_chainId": "0xaa36a7",
+    "net_version": "11155111",
+    "eth_blockNumber": "0x1",
+    "eth_getTransactionCount": "0x0",
+    "eth_estimateGas": "0xa410",
+    "eth_gasPrice": "0x3b9aca00",
+    "eth_maxPriorityFeePerGas": "0x3b9aca00",
+    "eth_getBlockByNumber": BLOCK,
+    "eth_getLogs": [],
+}
+# tx hash -> receipt
+receipts = {}
+
+
+def SendRawTransaction(rawTransaction):
+    """
+    Mines a transaction at once, and marks as paid the invoices whose payment reference it carries.
+    """
+    raw = rawTransaction.lower().removeprefix("0x")
+    txHash = "0x" + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    with lock:
+        for reference in [reference for reference in openReferences if reference in raw]:
+            invoices[openReferences.pop(reference)]['status'] = "paid"
+        receipts[txHash] = {
+            "transactionHash": txHash, "transactionIndex": "0x0", "blockHash": BLOCK["hash"], "blockNumber": BLOCK["number"],
+            "from": "0x" + "00" * 20, "to": "0x" + "00" * 20, "cumulativeGasUsed": "0xa410", "gasUsed": "0xa410",
+            "effectiveGasPrice": "0x3b9aca00", "contractAddress": None, "logs": [], "logsBloom": "0x" + "00" * 256,
+            "status": "0x1", "type": "0x2"
+        }
+    return txHash
+
+
+def Answer(call):
+    method, params = call['method'], call.get('params', [])
+    if method == "eth_sendRawTransaction":
+        result = SendRawTransaction(params[0])
+    elif method == "eth_getTransactionReceipt":
+        with lock:
+            result = receipts.get(params[0])
+    elif method == "eth_getTransactionByHash":
+        with lock:
+            receipt = receipts.get(params[0])
+        result = None if receipt is None else {"hash": params[0], "blockNumber": receipt["blockNumber"], "blockHash": receipt["blockHash"]}
+    elif method in RESPONSES:
+        result = RESPONSES[method]
+    else:
+        return {"jsonrpc": "2.0", "id": call.get('id'), "error": {"code": -32601, "message": f"method {method} not supported by the stub"}}
+    return {"jsonrpc": "2.0", "id": call.get('id'), "result": result}
+
+
+@app.route('/rpc', methods = ['POST'])
+def rpc():
+    body = request.get_json(force = True)
+    time.sleep(CHAIN_LATENCY)
+    if isinstance(body, list):
+        return jsonify([Answer(call) for call in body])
+    return jsonify(Answer(body))
+
+
+if __name__ == '__main__':
+    app.run(port = int(sys.argv[1]) if len(sys.argv) > 1 else 5056, threaded = True)
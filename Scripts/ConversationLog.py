@@ -0,0 +1,156 @@
+import os
+from datetime import datetime
+import Tracing as TR
+
+# Redis stream of all the logs, read by the web interface
+LOG_STREAM = "conversation_logs:stream"
+# Maximum number of entries kept in the stream of all the logs, the oldest ones are trimmed
+MAX_LEN = int(os.getenv("CONVERSATION_LOG_MAXLEN", "10000"))
+# Maximum number of entries kept in the stream of a conversation
+CONVERSATION_MAX_LEN = int(os.getenv("CONVERSATION_LOG_CONVERSATION_MAXLEN", "1000"))
+# Time (in seconds) after which the stream of an inactive conversation is deleted
+CONVERSATION_TTL = int(os.getenv("CONVERSATION_LOG_TTL", str(7 * 24 * 3600)))
+# Maximum number of entries returned by a read
+MAX_READ = 1000
+
+
+def ConversationStream(conversationId):
+    """
+    ConversationStream
+    ------------------
+    Returns the key of the Redis stream holding the logs of a conversation.
+    """
+    return f"conversation_logs:{conversationId}"
+
+
+def LogEntry(agent, message, conversationId = None):
+    """
+    LogEntry
+    --------
+    Returns the fields of a log entry, with the trace and span IDs of the current span if any.
+    """
+    entry = {'timestamp': datetime.now().isoformat(), 'agent': agent, 'message': message}
+    if conversationId is not None:
+        entry['conversationId'] = conversationId
+    span = TR.CurrentSpan()
+    if span is not None:
+        entry['traceId'] = span.traceId
+        entry['spanId'] = span.spanId
+    return entry
+
+
+def _append(pipe, entry):
+    # the trimming is approximate, which keeps XADD O(1)
+    pipe.xadd(LOG_STREAM, entry, maxlen = MAX_LEN, approximate = True)
+    if 'conversationId' in entry:
+        pipe.xadd(ConversationStream(entry['conversationId']), entry, maxlen = CONVERSATION_MAX_LEN, approximate = True)
+        pipe.expire(ConversationStream(entry['conversationId']), CONVERSATION_TTL)
+
+
+def AppendLog(redisConnexion, agent, message, conversationId = None):
+    """
+    AppendLog
+    ---------
+    Appends a log entry to the stream of all the logs and to the stream of its conversation.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server.
+    agent : str
+        The agent's ID or name logging the message.
+    message : str
+        The message content to be logged.
+    conversationId : str, optional
+        Conversation the message belongs to.
+
+    Returns
+    -------
+    None
+    """
+    pipe = redisConnexion.pipeline(transaction = False)
+    _append(pipe, LogEntry(agent, message, conversationId))
+    pipe.execute()
+
+
+async def AppendLogAsync(redisConnexion, agent, message, conversationId = None):
+    """
+    AppendLogAsync
+    --------------
+    Awaitable version of `AppendLog`, with an asynchronous Redis connexion.
+    """
+    pipe = redisConnexion.pipeline(transaction = False)
+    _append(pipe, LogEntry(agent, message, conversationId))
+    await pipe.execute()
+
+
+def _decode(entryId, fields):
+    entry = {key.decode('utf-8'): value.decode('utf-8') for key, value in fields.items()}
+    entry['id'] = entryId.decode('utf-8')
+    return entry
+
+
+def ReadLogs(redisConnexion, since = None, limit = 100, conversationId = None, block = None):
+    """
+    ReadLogs
+    --------
+    Reads the log entries following a cursor, oldest first. Without cursor, the last `limit` entries are returned.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server.
+    since : str, optional
+        Cursor returned by a previous read, only the entries added after it are returned.
+    limit : int, optional
+        Maximum number of entries returned, at most 1000. Defaults to 100.
+    conversationId : str, optional
+        Only returns the logs of this conversation.
+    block : int, optional
+        Time (in milliseconds) to wait for new entries after the cursor when there is none yet. Requires `since`.
+
+    Returns
+    -------
+    dict
+        {'logs': list of entries {'id', 'timestamp', 'agent', 'message', 'conversationId', 'traceId', 'spanId'}, 'cursor': cursor of the next read}
+    """
+    stream = ConversationStream(conversationId) if conversationId else LOG_STREAM
+    limit = max(1, min(int(limit), MAX_READ))
+    if since:
+        # XREAD rather than an exclusive XRANGE to stay compatible with Redis < 6.2
+        result = redisConnexion.xread({stream: since}, count = limit, block = block)
+        entries = result[0][1] if result else []
+    else:
+        entries = list(reversed(redisConnexion.xrevrange(stream, count = limit)))
+    logs = [_decode(entryId, fields) for entryId, fields in entries]
+    return {'logs': logs, 'cursor': logs[-1]['id'] if logs else (since or '0-0')}
+
+
+def ClearLogs(redisConnexion):
+    """
+    ClearLogs
+    ---------
+    Deletes the stream of all the logs and the streams of the conversations. The other keys of the Redis database
+    (agent directory, assistant registry, nonces, paid references, watched invoices...) are kept.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server.
+
+    Returns
+    -------
+    int
+        Number of streams deleted.
+    """
+    deleted = 0
+    batch = []
+    # SCAN rather than KEYS, so the Redis server is not blocked by a large database; the keys of the prefix are only the log streams
+    for key in redisConnexion.scan_iter(match = ConversationStream("*"), count = 500):
+        batch.append(key)
+        if len(batch) == 500:
+            deleted += redisConnexion.delete(*batch)
+            batch = []
+    if batch:
+        deleted += redisConnexion.delete(*batch)
+    return deleted
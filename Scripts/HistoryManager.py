@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import re
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    # without tiktoken, the tokens are estimated from the length of the text
+    _encoding = None
+
+# Estimated number of tokens of the conversation thread above which the history is compacted
+TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "6000"))
+# Number of the last turns kept verbatim in the summary of a compacted history
+KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "4"))
+
+# Facts pinned in the summary of a compacted history, by label. Only the last values of each fact are kept.
+FACT_PATTERNS = {
+    'price': re.compile(r"\b\d+(?:\.\d+)?\s*(?:ETH(?:-sepolia)?|USDC|USD|DAI)\b", re.IGNORECASE),
+    'invoice ID': re.compile(r"(?:ID of the invoice is|invoice ID\s*:?)\s+([A-Za-z0-9]{16,})", re.IGNORECASE),
+    'payment reference': re.compile(r"payment reference[^:]{0,30}:\s*(0x[0-9a-fA-F]+|[0-9a-fA-F]{16})", re.IGNORECASE),
+    'address': re.compile(r"\b0x[0-9a-fA-F]{40}\b"),
+    'payment link': re.compile(r"https?://\S+"),
+}
+# Number of values kept per fact
+FACT_VALUES = 3
+
+
+def CountTokens(text):
+    """
+    CountTokens
+    -----------
+    Returns the number of tokens of a text, estimated as 4 characters per token when tiktoken is not installed.
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+def ExtractFacts(text):
+    """
+    ExtractFacts
+    ------------
+    Returns the facts found in a text, as (label, value) pairs.
+    """
+    facts = []
+    for label, pattern in FACT_PATTERNS.items():
+        for match in pattern.finditer(text):
+            facts.append((label, match.group(1) if pattern.groups else match.group(0)))
+    return facts
+
+
+class HistoryManager:
+    """
+    HistoryManager
+    --------------
+    Tracks the estimated token count of the conversation thread of a session. The whole thread is sent to the model
+    at each turn, so once it exceeds `budget` the session is compacted: its thread is replaced by a summary holding
+    the pinned facts of the negotiation (price, invoice ID, payment reference, addresses, payment link) and the last
+    turns, sent with the next prompt.
+    The tokens saved are the tokens the uncompacted thread would have sent in addition, summed over the turns.
+
+    Parameters
+    ----------
+    budget : int, optional
+        Estimated number of tokens above which the history is compacted. Defaults to 6000.
+    keepTurns : int, optional
+        Number of the last turns kept verbatim in the summary. Defaults to 4.
+    """
+    def __init__(self, budget = TOKEN_BUDGET, keepTurns = KEEP_TURNS):
+        self.budget = budget
+        self.keepTurns = keepTurns
+        self.turns = []
+        self.facts = {}
+        self.pendingSummary = None
+        self.pendingNotes = []
+        # estimated tokens of the current thread, and of the thread without compaction
+        self.historyTokens = 0
+        self.uncompactedTokens = 0
+        self.tokensSaved = 0
+        self.compactions = 0
+        # turns recorded since the last compaction, a history is not compacted twice in a row
+        self.newTurns = 0
+
+    def prepare(self, prompt):
+        """
+        Returns the prompt to send, prefixed with the summary of the compacted history on the first turn after a compaction,
+        and with the notes added since the last turn.
+        """
+        prefix = ([self.pendingSummary] if self.pendingSummary is not None else []) + self.pendingNotes
+        self.pendingSummary = None
+        self.pendingNotes = []
+        return "\n\n".join(prefix + [prompt])
+
+    def note(self, text):
+        """
+        Adds a note sent to the AI with the next prompt, e.g. a step handled without querying it. Its facts are pinned.
+        """
+        self.pendingNotes.append(text)
+        self.historyTokens += CountTokens(text)
+        self.uncompactedTokens += CountTokens(text)
+        for label, value in ExtractFacts(text):
+            self._pin(label, value)
+
+    def _pin(self, label, value):
+        values = self.facts.setdefault(label, [])
+        if value in values:
+            values.remove(value)
+        values.append(value)
+        del values[:-FACT_VALUES]
+
+    def record(self, prompt, response, keep = True):
+        """
+        Records a turn, with the prompt as given to `prepare`. Reminder turns (`keep` False) are counted but not kept in the summary.
+        """
+        tokens = CountTokens(prompt) + CountTokens(response)
+        self.newTurns += 1
+        self.historyTokens += tokens
+        self.uncompactedTokens += tokens
+        self.tokensSaved += self.uncompactedTokens - self.historyTokens
+        for label, value in ExtractFacts(f"{prompt}\n{response}"):
+            self._pin(label, value)
+        if keep:
+            self.turns.append((prompt, response))
+            del self.turns[:-self.keepTurns]
+
+    def fingerprint(self):
+        """
+        Returns a digest of the state of the history sent with the next prompt: the pinned facts, the last turns,
+        and the pending summary and notes. Used to key the cached responses, see `ResponseCache`.
+        """
+        state = [self.facts, self.turns, self.pendingSummary, self.pendingNotes]
+        return hashlib.sha256(json.dumps(state).encode('utf-8')).hexdigest()
+
+    def needs_compaction(self):
+        """
+        Returns True if the estimated tokens of the thread exceed the budget.
+        """
+        return self.historyTokens > self.budget and self.newTurns > 0
+
+    def summary(self):
+        """
+        Returns the summary of the history: the pinned facts and the last turns.
+        """
+        lines = ["Summary of the conversation so far, the previous messages are not available anymore."]
+        if self.facts:
+            lines.append("Facts to remember:")
+            lines += [f"- {label}: {', '.join(values)}" for label, values in self.facts.items()]
+        if self.turns:
+            lines.append("Last messages:")
+            for prompt, response in self.turns:
+                lines += [f"> {prompt}", f"< {response}"]
+        return "\n".join(lines)
+
+    def compact(self):
+        """
+        Compacts the history: the summary is sent with the next prompt, in a new thread. The caller drops the current thread.
+        """
+        self.pendingSummary = self.summary()
+        # the summary is the only content of the new thread
+        self.historyTokens = CountTokens(self.pendingSummary)
+        self.newTurns = 0
+        self.compactions += 1
+
+    def stats(self):
+        """
+        Returns the estimated tokens of the thread, the tokens saved and the number of compactions.
+        """
+        return {'historyTokens': self.historyTokens, 'uncompactedTokens': self.uncompactedTokens,
+                'tokensSaved': self.tokensSaved, 'compactions': self.compactions}
@@ -1,8 +1,18 @@
 import requests
+from requests.adapters import HTTPAdapter
+from tenacity import AsyncRetrying, Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+import aiohttp
+import asyncio
+import contextlib
 import json
 import uuid
 import os
 import time
+import threading
+import Metrics as MT
+import SessionManager as SM
+import StageTimings as ST
+import Tracing as TR
 
 # Request Network API key from environement variable 
 API_KEY = os.getenv("RequestNetwork_API_KEY")
@@ -11,8 +21,8 @@ API_KEY = os.getenv("RequestNetwork_API_KEY")
 paymentReceiverAddress= os.getenv("paymentReceiverAddress")
 
 # Base URL used for the request network POST / GET methods 
-# Require to start the Node server
-BASE_URL = "http://localhost:3000/"
+# Require to start the Node server, or another server serving the same API with RNAPI_URL (e.g. the benchmark stubs)
+BASE_URL = os.getenv("RNAPI_URL", "http://localhost:3000").rstrip("/") + "/"
 
 # Invoice creation access point
 InvoiceEndpoint = f"{BASE_URL}invoices"
@@ -23,6 +33,209 @@ HEADERS = {
     "Authorization": f"{API_KEY}"
 }
 
+# Timeouts (in seconds) of the calls to the API. Invoice creation waits for the on-chain confirmation, hence the long read timeout
+CONNECT_TIMEOUT = float(os.getenv("RNAPI_CONNECT_TIMEOUT", "3"))
+READ_TIMEOUT = float(os.getenv("RNAPI_READ_TIMEOUT", "120"))
+# Maximum number of attempts of a call, retries are spaced by a jittered exponential delay
+MAX_ATTEMPTS = int(os.getenv("RNAPI_MAX_ATTEMPTS", "4"))
+# Number of keep-alive connexions kept open to the API
+POOL_SIZE = int(os.getenv("RNAPI_POOL_SIZE", "32"))
+# Maximum number of invoice IDs sent in a single batch status request, must not exceed STATUS_BATCH_MAX of the server
+STATUS_BATCH_SIZE = int(os.getenv("RNAPI_STATUS_BATCH_SIZE", "500"))
+# Maximum number of invoices sent in a single batch creation request, must not exceed CREATE_BATCH_MAX of the server
+CREATE_BATCH_SIZE = int(os.getenv("RNAPI_CREATE_BATCH_SIZE", "100"))
+# If set to 1, invoices are created without waiting for their on-chain confirmation, which is tracked by the server
+ASYNC_CREATION = os.getenv("INVOICE_ASYNC_CREATION", "0") == "1"
+# Server responses worth retrying
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+#%% In this section : pooled HTTP clients of the API, synchronous and awaitable, with the same retries and latency metrics
+_session = None
+_session_lock = threading.Lock()
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+class RetryableStatus(Exception):
+    """
+    Raised for a server response worth retrying, holds the response.
+    """
+    def __init__(self, response):
+        super().__init__(f"Server responded with status code {response.status_code}")
+        self.response = response
+
+
+class ApiResponse:
+    """
+    Response of an awaitable call to the API, read before its connexion is given back to the pool.
+    Has the `status_code` and `json()` of a `requests.Response`, so both clients share the handling of responses.
+    """
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def GetSession():
+    """
+    GetSession
+    ----------
+    Returns the HTTP session shared by all the calls to the API, creating it on first use.
+    Connexions are kept alive and pooled, so a call does not open a new TCP connexion.
+
+    Returns
+    -------
+    requests.Session
+        The shared session.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update(HEADERS)
+            _session = session
+    return _session
+
+
+def _IsRetryable(idempotent, error):
+    """
+    _IsRetryable
+    ------------
+    Tells if a failed call can be retried. Status checks are idempotent and are retried on any connexion error,
+    timeout or retryable status. Invoice creation is only retried when the request could not reach the server,
+    to avoid creating the same invoice twice. Errors of both `requests` and `aiohttp` are handled.
+    """
+    if idempotent:
+        return isinstance(error, (requests.ConnectionError, requests.Timeout, aiohttp.ClientConnectionError, asyncio.TimeoutError, RetryableStatus))
+    if isinstance(error, (requests.ConnectTimeout, aiohttp.ClientConnectorError)):
+        # aiohttp.ClientConnectorError: connexion refused / DNS failure, nothing was sent
+        return True
+    if isinstance(error, requests.ConnectionError):
+        # connexion refused / DNS failure: nothing was sent
+        return "NewConnectionError" in repr(error) or "NameResolutionError" in repr(error)
+    return False
+
+
+def _RecordLatency(endpoint, elapsed, failed):
+    MT.RNAPI_CLIENT_SECONDS.observe(elapsed, endpoint = endpoint, outcome = "error" if failed else "ok")
+    with _metrics_lock:
+        metric = _metrics.setdefault(endpoint, {'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0})
+        metric['count'] += 1
+        metric['errors'] += int(failed)
+        metric['total'] += elapsed
+        metric['max'] = max(metric['max'], elapsed)
+
+
+def GetApiMetrics():
+    """
+    GetApiMetrics
+    -------------
+    Returns the latency metrics of the calls to the API, per endpoint. Each attempt of a call is counted.
+
+    Returns
+    -------
+    dict
+        {endpoint: {'count': int, 'errors': int, 'avg': seconds, 'max': seconds}}
+    """
+    with _metrics_lock:
+        return {endpoint: {'count': metric['count'], 'errors': metric['errors'],
+                           'avg': metric['total'] / metric['count'], 'max': metric['max']}
+                for endpoint, metric in _metrics.items()}
+
+
+def RnapiSpan(method, url, endpoint):
+    """
+    RnapiSpan
+    ---------
+    Returns the span of a call to the API, see `Tracing.Span`.
+    """
+    return TR.Span(f"rnapi {endpoint}", kind = "client", attributes = {'http.method': method, 'http.url': url})
+
+
+def _RetryPolicy(idempotent):
+    """
+    Returns the arguments of the `tenacity.Retrying` / `tenacity.AsyncRetrying` of a call.
+    """
+    return {
+        'stop': stop_after_attempt(MAX_ATTEMPTS),
+        'wait': wait_random_exponential(multiplier = 0.2, max = 5),
+        'retry': retry_if_exception(lambda error: _IsRetryable(idempotent, error)),
+        'reraise': True
+    }
+
+
+@contextlib.contextmanager
+def _Attempt(method, url, endpoint, idempotent):
+    """
+    _Attempt
+    --------
+    Records the span and the latency of an attempt of a call. The attempt sets the response in the yielded dict;
+    a retryable response of an idempotent call raises `RetryableStatus`, for the retry policy.
+    """
+    start = time.perf_counter()
+    attempt = {'response': None}
+    # each attempt is a span, its context is sent to the server
+    with RnapiSpan(method, url, endpoint) as span:
+        try:
+            yield attempt
+        except Exception:
+            _RecordLatency(endpoint, time.perf_counter() - start, True)
+            raise
+        span.attributes['http.status_code'] = attempt['response'].status_code
+    _RecordLatency(endpoint, time.perf_counter() - start, attempt['response'].status_code >= 500)
+    if idempotent and attempt['response'].status_code in RETRYABLE_STATUS:
+        raise RetryableStatus(attempt['response'])
+
+
+def _Request(method, url, endpoint, idempotent = None, **kwargs):
+    """
+    _Request
+    --------
+    Sends a call to the API with the shared session, the configured timeouts and the retry policy.
+
+    Parameters
+    ----------
+    method : str
+        HTTP method, 'GET' or 'POST'.
+    url : str
+        URL of the call.
+    endpoint : str
+        Name of the endpoint the latency is recorded under, e.g. 'GET /invoices/:id'.
+    idempotent : bool, optional
+        If the call can safely be sent twice. Defaults to True for GET calls only.
+    **kwargs
+        Additional arguments of `requests.Session.request`.
+
+    Returns
+    -------
+    requests.Response
+        The last response of the server.
+
+    Raises
+    ------
+    requests.RequestException
+        If the server could not be reached after all the attempts.
+    """
+    if idempotent is None:
+        idempotent = method == "GET"
+
+    def attempt():
+        with _Attempt(method, url, endpoint, idempotent) as result:
+            result['response'] = GetSession().request(method, url, timeout = (CONNECT_TIMEOUT, READ_TIMEOUT), headers = TR.Headers(), **kwargs)
+        return result['response']
+
+    try:
+        return Retrying(**_RetryPolicy(idempotent))(attempt)
+    except RetryableStatus as e:
+        return e.response
+#%%
+
 
 def GeneratePayload(clientInfo, currency, price, serviceName = None): 
     """
@@ -101,7 +314,33 @@ def GeneratePayload(clientInfo, currency, price, serviceName = None):
     return invoice_payload
 
      
-def Send_invoice(invoice_payload):
+def CreationOptions(callbackQueue = None):
+    """
+    CreationOptions
+    ---------------
+    Returns the creation options added to an invoice payload. With asynchronous creation, the server replies as soon as
+    the invoice ID and payment reference are known and notifies the callback queue, if any, of the confirmation.
+
+    Parameters
+    ----------
+    callbackQueue : str, optional
+        Redis queue notified of the confirmation, for the current conversation.
+
+    Returns
+    -------
+    dict
+        Options to merge into the payload, empty if asynchronous creation is disabled.
+    """
+    if not ASYNC_CREATION:
+        return {}
+    options = {"async": True}
+    if callbackQueue is not None:
+        options["callbackQueue"] = callbackQueue
+        options["callbackConversationId"] = SM.CurrentConversation()
+    return options
+
+
+def Send_invoice(invoice_payload, callbackQueue = None):
     """
     Send_invoice
     ------------
@@ -111,6 +350,8 @@ def Send_invoice(invoice_payload):
     ----------
     invoice_payload : dict
         A dictionary containing the payload of the invoice. It must follow the format required by the Request Network API.
+    callbackQueue : str, optional
+        Redis queue notified of the confirmation when invoices are created asynchronously (INVOICE_ASYNC_CREATION=1).
     
     Returns
     -------
@@ -129,10 +370,20 @@ def Send_invoice(invoice_payload):
     # Post request for  Off-Chain Invoice Creation 
 
     print(invoice_payload)
-    response = requests.post(InvoiceEndpoint, headers=HEADERS, data=json.dumps(invoice_payload))
-        
+    try:
+        response = _Request("POST", InvoiceEndpoint, "POST /invoices", data = json.dumps({**invoice_payload, **CreationOptions(callbackQueue)}))
+    except requests.RequestException as e:
+        print(f"Error during the creation of the invoice: {e}")
+        return None, None, None
+    return _CreatedInvoice(response)
 
-    if response.status_code == 201:
+
+def _CreatedInvoice(response):
+    """
+    Returns (payment URL, invoice ID, payment reference) from the response of an invoice creation, (None, None, None) on error.
+    """
+    # 202: created asynchronously, the confirmation is pending
+    if response.status_code in (201, 202):
         response_data = response.json()
         requestId=response_data.get("id")
         paymentReference=response_data.get("paymentReference")
@@ -145,7 +396,8 @@ def Send_invoice(invoice_payload):
         return None,None,None #f"Error during the creation of the invoice, please check the inputs. Error was : {response.content}"
 
 
-def GenerateAndSendInvoice(clientInfo_Email, clientInfo_identity_address, currency, price, serviceName, autoPayment):
+@ST.Timed(ST.INVOICE_CREATE)
+def GenerateAndSendInvoice(clientInfo_Email, clientInfo_identity_address, currency, price, serviceName, autoPayment, onCreated = None, callbackQueue = None):
     """
     GenerateAndSendInvoice
     ----------------------
@@ -168,6 +420,11 @@ def GenerateAndSendInvoice(clientInfo_Email, clientInfo_identity_address, curren
     autoPayment : bool
         If True, the function will generate and return a payment reference for automated payment by AI.
         If False, it will return a URL for manual payment.
+    onCreated : callable, optional
+        Called with the invoice ID and the payment reference once the invoice is created, e.g. to watch its payment.
+        Not exposed to the AI.
+    callbackQueue : str, optional
+        Redis queue notified of the confirmation when invoices are created asynchronously. Not exposed to the AI.
 
     Returns
     -------
@@ -193,11 +450,116 @@ def GenerateAndSendInvoice(clientInfo_Email, clientInfo_identity_address, curren
     )
     print(result)
     """
+    clientInfo, errorMsg = CheckInvoiceInputs(clientInfo_Email, clientInfo_identity_address, currency, price)
+    if errorMsg is not None:
+        return errorMsg
+    
+    print("Generating Invoice payload...")
+    invoice_payload = GeneratePayload(clientInfo, currency, price, serviceName)
+    print("Sending Invoice...")
+    payLink, requestId, paymentReference = Send_invoice(invoice_payload, callbackQueue)
+    if payLink is not None and onCreated is not None:
+        onCreated(requestId, paymentReference)
+    
+    return InvoiceResultMessage(payLink, requestId, paymentReference, autoPayment)
+
+
+@ST.Timed(ST.INVOICE_CREATE)
+def GenerateAndSendInvoices(list_of_specs, onCreated = None):
+    """
+    GenerateAndSendInvoices
+    -----------------------
+    Generates and sends several invoices with batch requests, the server creating them concurrently.
+    Used for batch billing runs, a failure only affects its own invoice.
+
+    Parameters
+    ----------
+    list_of_specs : list of dict
+        Invoices to create, each one with the parameters of `GenerateAndSendInvoice`: clientInfo_Email,
+        clientInfo_identity_address, currency, price, serviceName (optional) and autoPayment (optional, default False).
+    onCreated : callable, optional
+        Called with the invoice ID and the payment reference of each created invoice.
+
+    Returns
+    -------
+    list of dict
+        One result per spec, in the same order: {'index', 'id', 'paymentReference', 'message', 'error'}.
+        'id' and 'paymentReference' are None and 'error' is set when the invoice could not be created.
+
+    Example
+    -------
+    results = GenerateAndSendInvoices([
+        {"clientInfo_Email": "client@example.com", "clientInfo_identity_address": "0x...", "currency": "ETH-sepolia", "price": 0.001, "serviceName": "Haiku"},
+        {"clientInfo_Email": "other@example.com", "clientInfo_identity_address": "0x...", "currency": "ETH-sepolia", "price": 0.002, "serviceName": "Haiku"},
+    ])
+    """
+    results = [{'index': index, 'id': None, 'paymentReference': None, 'message': None, 'error': None} for index in range(len(list_of_specs))]
+
+    # invalid specs are not sent
+    pending = []
+    for index, spec in enumerate(list_of_specs):
+        clientInfo, errorMsg = CheckInvoiceInputs(spec.get("clientInfo_Email"), spec.get("clientInfo_identity_address"), spec.get("currency"), spec.get("price"))
+        if errorMsg is not None:
+            results[index]['error'] = errorMsg
+            continue
+        pending.append((index, {**GeneratePayload(clientInfo, spec["currency"], spec["price"], spec.get("serviceName")), **CreationOptions()}))
+
+    for start in range(0, len(pending), CREATE_BATCH_SIZE):
+        batch = pending[start:start + CREATE_BATCH_SIZE]
+        body = {"invoices": [payload for _, payload in batch], "async": ASYNC_CREATION}
+        try:
+            response = _Request("POST", f"{InvoiceEndpoint}/batch", "POST /invoices/batch", data = json.dumps(body))
+        except requests.RequestException as e:
+            response = None
+            errorMsg = f"Error during the creation of the invoices: {e}"
+        if response is not None and response.status_code != 200:
+            errorMsg = f"Error during the creation of the invoices. Server responded with status code {response.status_code}."
+        if response is None or response.status_code != 200:
+            print(errorMsg)
+            for index, _ in batch:
+                results[index]['error'] = errorMsg
+            continue
+
+        for itemResult in response.json().get("results", []):
+            index = batch[itemResult["index"]][0]
+            if itemResult.get("status") not in (201, 202):
+                results[index]['error'] = itemResult.get("error", "Unknown error")
+                continue
+            results[index]['id'] = itemResult["id"]
+            results[index]['paymentReference'] = itemResult["paymentReference"]
+            results[index]['message'] = InvoiceResultMessage('https://invoicing.request.network/', itemResult["id"], itemResult["paymentReference"], list_of_specs[index].get("autoPayment", False))
+            if onCreated is not None:
+                onCreated(itemResult["id"], itemResult["paymentReference"])
+    return results
+
+
+def CheckInvoiceInputs(clientInfo_Email, clientInfo_identity_address, currency, price):
+    """
+    CheckInvoiceInputs
+    ------------------
+    Checks the mandatory information required to generate an invoice and builds the client information.
+
+    Parameters
+    ----------
+    clientInfo_Email : str
+        The email address of the client.
+    clientInfo_identity_address : str
+        The buyer identity  / wallet address.
+    currency : str
+        The currency in which the invoice is issued.
+    price : float
+        The amount of the invoice.
+
+    Returns
+    -------
+    tuple
+        (clientInfo, None) if all the information is provided, (None, errorMsg) otherwise.
+    """
     clientInfo = {}
     if clientInfo_Email is None :
         errorMsg = "Email of the client is missing"
         print(errorMsg)
-        return errorMsg
+        return None, errorMsg
         
     else: 
         clientInfo["email"]  =  clientInfo_Email
@@ -205,24 +567,43 @@ def GenerateAndSendInvoice(clientInfo_Email, clientInfo_identity_address, curren
     if clientInfo_identity_address is None :
         errorMsg = "Identity address of the client is missing"
         print(errorMsg)
-        return errorMsg
+        return None, errorMsg
     else: 
         clientInfo["identity-address"]  =  clientInfo_identity_address
 
     if currency is None :
         errorMsg = "Currency information is missing. value is commonly ETH"
         print(errorMsg)
-        return errorMsg
+        return None, errorMsg
     if price is None :
         errorMsg = "A service price in ETH is required"
         print(errorMsg)
-        return errorMsg
-    
-    print("Generating Invoice payload...")
-    invoice_payload = GeneratePayload(clientInfo, currency, price, serviceName)
-    print("Sending Invoice...")
-    payLink, requestId, paymentReference = Send_invoice(invoice_payload)
-    
+        return None, errorMsg
+    return clientInfo, None
+
+
+def InvoiceResultMessage(payLink, requestId, paymentReference, autoPayment):
+    """
+    InvoiceResultMessage
+    --------------------
+    Builds the message returned to the AI once an invoice has been sent.
+
+    Parameters
+    ----------
+    payLink : str or None
+        URL for manual payment, None if the invoice creation failed.
+    requestId : str
+        ID of the invoice.
+    paymentReference : str
+        Payment reference of the invoice.
+    autoPayment : bool
+        If True, the message contains the payment reference, otherwise the URL for manual payment.
+
+    Returns
+    -------
+    str
+        The message detailing the payment reference or the URL, and the invoice ID.
+    """
     if payLink is None: 
         errorMsg = "error in generating invoice, verify your data and try again"
         print(errorMsg)
@@ -236,6 +617,68 @@ def GenerateAndSendInvoice(clientInfo_Email, clientInfo_identity_address, curren
         return returnString
 
 
+@ST.Timed(ST.STATUS_CHECK)
+def GetInvoiceStatus(ID):
+    """
+    GetInvoiceStatus
+    ----------------
+    Returns the raw status of an invoice, without waiting time. Used by the invoice watcher.
+
+    Parameters
+    ----------
+    ID : str
+        The ID of the invoice to check.
+
+    Returns
+    -------
+    str or None
+        'open' or 'paid', None if the status could not be fetched.
+    """
+    try:
+        ServerResponse = _Request("GET", f"{InvoiceEndpoint}/{ID}", "GET /invoices/:id")
+    except requests.RequestException as e:
+        print(f"An error occurred while checking the invoice status: {e}")
+        return None
+    if ServerResponse.status_code != 200:
+        return None
+    return ServerResponse.json().get("status")
+
+
+@ST.Timed(ST.STATUS_CHECK)
+def CheckInvoiceStatuses(ids):
+    """
+    CheckInvoiceStatuses
+    --------------------
+    Returns the raw status of several invoices with batch requests, instead of one request per invoice.
+
+    Parameters
+    ----------
+    ids : list of str
+        The IDs of the invoices to check.
+
+    Returns
+    -------
+    dict
+        {invoice ID: 'pending', 'failed', 'open', 'paid' or None if the status could not be fetched}
+    """
+    statuses = {}
+    for start in range(0, len(ids), STATUS_BATCH_SIZE):
+        batch = ids[start:start + STATUS_BATCH_SIZE]
+        statuses.update(dict.fromkeys(batch))
+        try:
+            ServerResponse = _Request("POST", f"{InvoiceEndpoint}/status", "POST /invoices/status", idempotent = True, data = json.dumps({"ids": batch}))
+        except requests.RequestException as e:
+            print(f"An error occurred while checking the invoice statuses: {e}")
+            continue
+        if ServerResponse.status_code != 200:
+            print(f"Error fetching invoice statuses. Server responded with status code {ServerResponse.status_code}.")
+            continue
+        for ID, result in ServerResponse.json().get("statuses", {}).items():
+            if result.get("status") in ("pending", "failed", "open", "paid"):
+                statuses[ID] = result["status"]
+    return statuses
+
+
 def CheckInvoiceStatus(ID, waitingTime):
     """
     CheckInvoiceStatus
@@ -260,32 +703,194 @@ def CheckInvoiceStatus(ID, waitingTime):
     # Waiting for the specified time
     time.sleep(waitingTime)
 
-    try:
-        # Sending request to get the invoice status
-        ServerResponse = requests.get(f"{InvoiceEndpoint}/{ID}", headers = HEADERS)
-
-        # Check if the request was successful
-        if ServerResponse.status_code == 200:
-            invoice_status_data = ServerResponse.json()
-            invoiceStatus = invoice_status_data.get("status", "Unknown")
-
-            # Returning the status message
-            return (f"Current status of invoice ID {ID} is: {invoiceStatus}. "
-                    "Please wait about 5 seconds before another status check. "
-                    "The operation may take some time. If the status is still 'open' after a few tries, "
-                    "you should ask for updates. If you need to wait, the internal message should contain "
-                    "the waiting time before the next check.")
-        else:
-            # Return an error message in case of a non-200 response
-            errorMsg = f"Error fetching invoice status. Server responded with status code {ServerResponse.status_code}."
+    with ST.Stage(ST.STATUS_CHECK):
+        try:
+            # Sending request to get the invoice status
+            ServerResponse = _Request("GET", f"{InvoiceEndpoint}/{ID}", "GET /invoices/:id")
+        except requests.RequestException as e:
+            # Catch any errors during the request
+            errorMsg = f"An error occurred while checking the invoice status: {e}"
             print(errorMsg)
             return errorMsg
+        return _StatusResult(ID, ServerResponse)
 
-    except requests.RequestException as e:
-        # Catch any errors during the request
-        errorMsg = f"An error occurred while checking the invoice status: {e}"
+
+def _StatusResult(ID, ServerResponse):
+    """
+    Returns the message of a status check from the response of the API.
+    """
+    # Check if the request was successful
+    if ServerResponse.status_code == 200:
+        invoice_status_data = ServerResponse.json()
+        invoiceStatus = invoice_status_data.get("status", "Unknown")
+
+        # Returning the status message
+        return InvoiceStatusMessage(ID, invoiceStatus)
+    else:
+        # Return an error message in case of a non-200 response
+        errorMsg = f"Error fetching invoice status. Server responded with status code {ServerResponse.status_code}."
         print(errorMsg)
         return errorMsg
 
+
+def InvoiceStatusMessage(ID, invoiceStatus):
+    """
+    InvoiceStatusMessage
+    --------------------
+    Builds the message returned to the AI for the status of an invoice.
+
+    Parameters
+    ----------
+    ID : str
+        The ID of the invoice.
+    invoiceStatus : str
+        Status returned by the API, 'open' or 'paid'.
+
+    Returns
+    -------
+    str
+        A message describing the current status of the invoice.
+    """
+    return (f"Current status of invoice ID {ID} is: {invoiceStatus}. "
+            "Please wait about 5 seconds before another status check. "
+            "The operation may take some time. If the status is still 'open' after a few tries, "
+            "you should ask for updates. If you need to wait, the internal message should contain "
+            "the waiting time before the next check.")
+
+
+#%% In this section : awaitable versions of the tools, used by the asyncio agent runtime
+# aiohttp session shared by the coroutines of an event loop
+_async_sessions = {}
+
+
+def _GetAsyncSession():
+    """
+    _GetAsyncSession
+    ----------------
+    Returns the aiohttp session of the running event loop, creating it on first use. Connexions to the API are kept alive and reused.
+    """
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
+    if session is None or session.closed:
+        timeout = aiohttp.ClientTimeout(sock_connect = CONNECT_TIMEOUT, sock_read = READ_TIMEOUT)
+        session = aiohttp.ClientSession(headers = HEADERS, timeout = timeout, connector = aiohttp.TCPConnector(limit = POOL_SIZE))
+        _async_sessions[loop] = session
+    return session
+
+
+async def _RequestAsync(method, url, endpoint, idempotent = None, **kwargs):
+    """
+    _RequestAsync
+    -------------
+    Awaitable version of `_Request`, with the aiohttp session of the event loop and the same retry policy and metrics.
+
+    Returns
+    -------
+    ApiResponse
+        The last response of the server.
+
+    Raises
+    ------
+    aiohttp.ClientError or asyncio.TimeoutError
+        If the server could not be reached after all the attempts.
+    """
+    if idempotent is None:
+        idempotent = method == "GET"
+
+    async def attempt():
+        with _Attempt(method, url, endpoint, idempotent) as result:
+            async with _GetAsyncSession().request(method, url, headers = TR.Headers(), **kwargs) as response:
+                result['response'] = ApiResponse(response.status, await response.read())
+        return result['response']
+
+    try:
+        return await AsyncRetrying(**_RetryPolicy(idempotent))(attempt)
+    except RetryableStatus as e:
+        return e.response
+
+
+async def Send_invoiceAsync(invoice_payload, callbackQueue = None):
+    """
+    Send_invoiceAsync
+    -----------------
+    Awaitable version of `Send_invoice`.
+
+    Parameters
+    ----------
+    invoice_payload : dict
+        A dictionary containing the payload of the invoice.
+    callbackQueue : str, optional
+        Redis queue notified of the confirmation when invoices are created asynchronously.
+
+    Returns
+    -------
+    tuple
+        (payment URL, invoice ID, payment reference) on success, (None, None, None) otherwise.
+    """
+    print(invoice_payload)
+    try:
+        response = await _RequestAsync("POST", InvoiceEndpoint, "POST /invoices", json = {**invoice_payload, **CreationOptions(callbackQueue)})
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Error during the creation of the invoice: {e}")
+        return None, None, None
+    return _CreatedInvoice(response)
+
+
+@ST.Timed(ST.INVOICE_CREATE)
+async def GenerateAndSendInvoiceAsync(clientInfo_Email, clientInfo_identity_address, currency, price, serviceName, autoPayment, onCreated = None, callbackQueue = None):
+    """
+    GenerateAndSendInvoiceAsync
+    ---------------------------
+    Awaitable version of `GenerateAndSendInvoice`, the event loop is not blocked while the invoice is created.
+    `onCreated` may be a coroutine function.
+
+    Returns
+    -------
+    str
+        A message detailing either the payment reference for automated payment or a URL for manual payment.
+    """
+    clientInfo, errorMsg = CheckInvoiceInputs(clientInfo_Email, clientInfo_identity_address, currency, price)
+    if errorMsg is not None:
+        return errorMsg
+
+    invoice_payload = GeneratePayload(clientInfo, currency, price, serviceName)
+    payLink, requestId, paymentReference = await Send_invoiceAsync(invoice_payload, callbackQueue)
+    if payLink is not None and onCreated is not None:
+        result = onCreated(requestId, paymentReference)
+        if asyncio.iscoroutine(result):
+            await result
+    return InvoiceResultMessage(payLink, requestId, paymentReference, autoPayment)
+
+
+async def CheckInvoiceStatusAsync(ID, waitingTime):
+    """
+    CheckInvoiceStatusAsync
+    -----------------------
+    Awaitable version of `CheckInvoiceStatus`. The waiting time does not hold a thread.
+
+    Parameters
+    ----------
+    ID : str
+        The ID of the invoice to check.
+    waitingTime : int
+        The time to wait (in seconds) before checking the status.
+
+    Returns
+    -------
+    str
+        A message describing the current status of the invoice.
+    """
+    await asyncio.sleep(waitingTime)
+
+    with ST.Stage(ST.STATUS_CHECK):
+        try:
+            ServerResponse = await _RequestAsync("GET", f"{InvoiceEndpoint}/{ID}", "GET /invoices/:id")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            errorMsg = f"An error occurred while checking the invoice status: {e}"
+            print(errorMsg)
+            return errorMsg
+        return _StatusResult(ID, ServerResponse)
+
+
 if __name__ == "__main__":
     pass
@@ -0,0 +1,206 @@
+import json
+import os
+import socket
+import threading
+import time
+import redis
+import MessageEnvelope as ME
+import Tracing as TR
+import InvoiceManager as IM
+import AgentDirectory as AD
+import LazyInit as LI
+# imported with web3 on first use, not with the agent
+PD = LI.LazyImport("PaymentDetector")
+
+# ID used as sender of the payment notifications
+WATCHER_ID = "InvoiceWatcher"
+# Redis hash of the watched invoices: invoice ID -> JSON {recipientID, conversationId, clientID, paymentReference, since, traceparent}
+WATCHED_KEY = "watched_invoices"
+# Lease ensuring a single watcher checks the invoices when several agent replicas are running
+LOCK_KEY = "invoice_watcher_lock"
+# Time (in seconds) between two checks of the watched invoices
+WATCH_INTERVAL = float(os.getenv("INVOICE_WATCH_INTERVAL", "3"))
+# Number of invoices checked in a single batch
+BATCH_SIZE = int(os.getenv("INVOICE_WATCH_BATCH_SIZE", "100"))
+# Time (in seconds) after which an unpaid invoice is not watched anymore
+WATCH_TTL = float(os.getenv("INVOICE_WATCH_TTL", str(24 * 3600)))
+
+# Removes an invoice from the watched invoices and notifies its recipient, only once even if several watchers see it paid
+NOTIFY_SCRIPT = """
+if redis.call('HDEL', KEYS[1], ARGV[1]) == 1 then
+    redis.call('LPUSH', KEYS[2], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+def WatchInvoice(redisConnexion, invoiceId, recipientID, conversationId, clientID = None, paymentReference = None):
+    """
+    WatchInvoice
+    ------------
+    Starts watching the payment of an invoice. When the invoice is paid, a notification is pushed in the queue of the recipient.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server.
+    invoiceId : str
+        ID of the invoice (request ID).
+    recipientID : str
+        ID of the agent to notify, usually the service provider that issued the invoice.
+    conversationId : str
+        Conversation the notification belongs to.
+    clientID : str, optional
+        ID of the client who has to pay the invoice, indicated in the notification.
+    paymentReference : str, optional
+        Payment reference of the invoice, looked for by the payment detector when it is enabled.
+
+    Returns
+    -------
+    None
+    """
+    redisConnexion.hset(WATCHED_KEY, invoiceId, WatchEntry(recipientID, conversationId, clientID, paymentReference))
+    if PD.DETECTOR_ENABLED and paymentReference:
+        PD.WatchReference(redisConnexion, paymentReference)
+
+
+def WatchEntry(recipientID, conversationId, clientID = None, paymentReference = None):
+    """
+    WatchEntry
+    ----------
+    Returns the JSON value stored in the watched invoices hash, see `WatchInvoice`. The payment notification
+    continues the trace of the creation of the invoice.
+    """
+    return json.dumps({'recipientID': recipientID, 'conversationId': conversationId, 'clientID': clientID,
+                       'paymentReference': paymentReference, 'since': time.time(), 'traceparent': TR.Traceparent()})
+
+
+def PaymentNotification(invoiceId, watch):
+    """
+    PaymentNotification
+    -------------------
+    Builds the message pushed in the queue of the recipient when an invoice is paid.
+
+    Parameters
+    ----------
+    invoiceId : str
+        ID of the paid invoice.
+    watch : dict
+        Watch information of the invoice.
+
+    Returns
+    -------
+    str
+        The packed message.
+    """
+    message = f"Payment confirmed: the invoice ID {invoiceId} is paid."
+    if watch.get('clientID'):
+        message += f" You can now deliver the service to {watch['clientID']}."
+    return ME.PackMessage(WATCHER_ID, message, watch['conversationId'], ME.INVOICE_PAID, {'invoiceId': invoiceId, 'clientID': watch.get('clientID')},
+                          traceparent = watch.get('traceparent'))
+
+
+def CheckWatchedInvoices(redisConnexion, checkStatuses = IM.CheckInvoiceStatuses, batchSize = BATCH_SIZE):
+    """
+    CheckWatchedInvoices
+    --------------------
+    Checks the watched invoices in batches and notifies the recipients of the paid ones, in the queue registered in
+    the agent directory. Expired watches are dropped, and a paid invoice whose recipient is not in the directory stays
+    watched until its recipient registers.
+    When the payment detector is enabled, an invoice with a payment reference is only checked once a payment
+    of this reference was detected on chain, the other ones being a local lookup.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server.
+    checkStatuses : callable, optional
+        Function returning the status of a list of invoice IDs, as a dict.
+    batchSize : int, optional
+        Number of invoices checked in a single batch.
+
+    Returns
+    -------
+    int
+        Number of notified payments.
+    """
+    notify = redisConnexion.register_script(NOTIFY_SCRIPT)
+    watched = {invoiceId.decode('utf-8'): json.loads(watch) for invoiceId, watch in redisConnexion.hgetall(WATCHED_KEY).items()}
+    now = time.time()
+    expired = [invoiceId for invoiceId, watch in watched.items() if now - watch['since'] > WATCH_TTL]
+    if expired:
+        redisConnexion.hdel(WATCHED_KEY, *expired)
+
+    invoiceIds = [invoiceId for invoiceId in watched if invoiceId not in expired]
+    if PD.DETECTOR_ENABLED:
+        PD.UnwatchReferences(redisConnexion, [watched[invoiceId]['paymentReference'] for invoiceId in expired if watched[invoiceId].get('paymentReference')])
+        detected = PD.GetPayments(redisConnexion, [watched[invoiceId]['paymentReference'] for invoiceId in invoiceIds if watched[invoiceId].get('paymentReference')])
+        invoiceIds = [invoiceId for invoiceId in invoiceIds if not watched[invoiceId].get('paymentReference') or watched[invoiceId]['paymentReference'] in detected]
+
+    notified = 0
+    done = []
+    recipients = {}
+    for start in range(0, len(invoiceIds), batchSize):
+        statuses = checkStatuses(invoiceIds[start:start + batchSize])
+        for invoiceId, status in statuses.items():
+            if status == 'failed':
+                # the creation failed, the recipient is notified by the creation callback
+                redisConnexion.hdel(WATCHED_KEY, invoiceId)
+                done.append(invoiceId)
+            if status != 'paid':
+                continue
+            watch = watched[invoiceId]
+            if watch['recipientID'] not in recipients:
+                recipients[watch['recipientID']] = AD.Resolve(redisConnexion, watch['recipientID'])
+            entry = recipients[watch['recipientID']]
+            if entry is None:
+                print(f"Invoice {invoiceId} is paid but {watch['recipientID']} is not a known agent, it is notified once registered")
+                continue
+            notified += notify(keys = [WATCHED_KEY, entry['queue']],
+                               args = [invoiceId, PaymentNotification(invoiceId, watch)])
+            done.append(invoiceId)
+    if PD.DETECTOR_ENABLED:
+        PD.UnwatchReferences(redisConnexion, [watched[invoiceId]['paymentReference'] for invoiceId in done if watched[invoiceId].get('paymentReference')])
+    return notified
+
+
+def _watch(redisConnexion, stopEvent, interval):
+    watcherId = f"{socket.gethostname()}-{os.getpid()}"
+    while not stopEvent.is_set():
+        try:
+            # the lease expires with the interval, a single watcher checks the invoices per interval
+            if redisConnexion.set(LOCK_KEY, watcherId, nx = True, ex = max(1, int(interval))):
+                CheckWatchedInvoices(redisConnexion)
+        except redis.ConnectionError as e:
+            print(f"Redis connexion error in invoice watcher: {e}")
+        except Exception as e:
+            print(f"Error in invoice watcher: {e}")
+        stopEvent.wait(interval)
+
+
+def StartWatcher(redisConnexion, interval = WATCH_INTERVAL):
+    """
+    StartWatcher
+    ------------
+    Starts the background thread checking the watched invoices.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server.
+    interval : float, optional
+        Time (in seconds) between two checks.
+
+    Returns
+    -------
+    threading.Event
+        Event to set in order to stop the watcher.
+    """
+    stopEvent = threading.Event()
+    threading.Thread(target = _watch, args = (redisConnexion, stopEvent, interval), name = "invoice-watcher", daemon = True).start()
+    return stopEvent
+
+
+if __name__ == "__main__":
+    # the watcher can also run as a standalone process
+    StartWatcher(redis.Redis(host='localhost', port = 6379, db = int(os.getenv("REDIS_DB", "0")))).wait()
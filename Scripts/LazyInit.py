@@ -0,0 +1,171 @@
+import importlib
+import threading
+import time
+import Metrics as MT
+
+# Time the module was imported, about the start of the process
+STARTED_AT = time.time()
+
+# Resources of the process, reported by `Readiness`
+_resources = []
+_resources_lock = threading.Lock()
+
+
+class LazyModule:
+    """
+    LazyModule
+    ----------
+    Module imported on the first access to one of its attributes, so a heavy module (e.g. one importing web3)
+    is not imported with the agent but when it is first used, or by the warm-up.
+
+    Parameters
+    ----------
+    name : str
+        Name of the module, e.g. 'walletManager'.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    start = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    MT.INIT_SECONDS.set(time.perf_counter() - start, resource = f"import {self._name}")
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+
+def LazyImport(name):
+    """
+    LazyImport
+    ----------
+    Returns a `LazyModule`, to be used instead of `import name`.
+    """
+    return LazyModule(name)
+
+
+class Resource:
+    """
+    Resource
+    --------
+    Resource of an agent created on its first use (e.g. the assistant on the OpenAI server), instead of when the
+    agent is imported. Concurrent first uses wait for the same creation, and a failed creation is tried again
+    at the next use.
+
+    Parameters
+    ----------
+    name : str
+        Name of the resource, reported by `Readiness`.
+    factory : callable
+        Function called without argument creating the resource.
+    """
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.value = None
+        self.ready = False
+        self.seconds = None
+        self.error = None
+        self.lock = threading.Lock()
+        with _resources_lock:
+            _resources.append(self)
+
+    def get(self):
+        """
+        Returns the resource, creating it if needed.
+        """
+        if self.ready:
+            return self.value
+        with self.lock:
+            if not self.ready:
+                start = time.perf_counter()
+                try:
+                    self.value = self.factory()
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                self.seconds = time.perf_counter() - start
+                self.error = None
+                self.ready = True
+                MT.INIT_SECONDS.set(self.seconds, resource = self.name)
+        return self.value
+
+    def status(self):
+        return {'ready': self.ready, 'seconds': self.seconds, 'error': self.error}
+
+
+def WarmUp(resources, retryDelay = 5):
+    """
+    WarmUp
+    ------
+    Creates resources in order in a daemon thread, so the agent is ready before its first message without
+    delaying its start. A failed creation is tried again after `retryDelay` seconds.
+
+    Parameters
+    ----------
+    resources : list of Resource
+        The resources to create.
+    retryDelay : float, optional
+        Time (in seconds) between two attempts.
+
+    Returns
+    -------
+    threading.Event
+        Event to set to stop the warm-up.
+    """
+    stopEvent = threading.Event()
+
+    def warm():
+        for resource in resources:
+            while not stopEvent.is_set():
+                try:
+                    resource.get()
+                    break
+                except Exception as e:
+                    print(f"Error while creating the resource {resource.name}: {e}")
+                    stopEvent.wait(retryDelay)
+        if not stopEvent.is_set():
+            MT.INIT_SECONDS.set(time.time() - STARTED_AT, resource = "ready")
+            print(f"Ready in {time.time() - STARTED_AT:.2f} s")
+
+    threading.Thread(target = warm, name = "warm-up", daemon = True).start()
+    return stopEvent
+
+
+def Readiness(redisConnexion = None):
+    """
+    Readiness
+    ---------
+    Tells if the process is ready to handle messages: all its resources are created and the Redis server answers.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis, optional
+        Connexion to the Redis server, pinged if given.
+
+    Returns
+    -------
+    dict
+        {'ready': bool, 'uptime': seconds since the start, 'redis': bool, 'resources': {name: {'ready', 'seconds', 'error'}}}
+    """
+    with _resources_lock:
+        resources = {resource.name: resource.status() for resource in _resources}
+    redisUp = True
+    if redisConnexion is not None:
+        try:
+            redisUp = bool(redisConnexion.ping())
+        except Exception:
+            redisUp = False
+    return {
+        'ready': redisUp and all(status['ready'] for status in resources.values()),
+        'uptime': time.time() - STARTED_AT,
+        'redis': redisUp,
+        'resources': resources
+    }
@@ -0,0 +1,106 @@
+import json
+import time
+import Tracing as TR
+
+# Conversation used for messages which do not carry a conversation ID (e.g. pushed by hand in a queue)
+DEFAULT_CONVERSATION = "default"
+
+# Types of the protocol messages, handled without querying the AI when possible (see `ProtocolDispatcher`)
+# invoice created for an automated payment, payload {invoiceId, paymentReference, paymentAddress, amount, currency}
+INVOICE_ISSUED = "invoice_issued"
+# payment of an invoice performed by the client, payload {invoiceId, paymentReference, result}
+PAYMENT_SENT = "payment_sent"
+# invoice paid, sent by the InvoiceWatcher, payload {invoiceId, clientID}
+INVOICE_PAID = "invoice_paid"
+# asynchronous creation of an invoice confirmed / failed, sent by the rnapi server, payload {invoiceId[, error]}
+INVOICE_CONFIRMED = "invoice_confirmed"
+INVOICE_FAILED = "invoice_failed"
+
+
+def PackMessage(sender, message, conversationId, messageType = None, payload = None, traceparent = None):
+    """
+    PackMessage
+    -----------
+    Builds the message pushed in an agent queue. The message is wrapped in a JSON envelope carrying
+    the sender and the conversation it belongs to, so the recipient can route it to the right session,
+    the time it was sent (`sentAt`, epoch seconds), used to measure the time spent in the queue, and the `traceparent`
+    of the sending span, continued by the recipient (see `Tracing`).
+    Protocol messages also carry their type and a structured payload, the message being their readable version.
+
+    Parameters
+    ----------
+    sender : str
+        ID of the sender of the message.
+    message : str
+        The message content.
+    conversationId : str
+        ID of the conversation the message belongs to.
+    messageType : str, optional
+        Type of a protocol message, e.g. `INVOICE_ISSUED`.
+    payload : dict, optional
+        Structured content of a protocol message.
+    traceparent : str, optional
+        Trace context of the message. Defaults to the current span.
+
+    Returns
+    -------
+    str
+        The JSON encoded envelope.
+    """
+    envelope = {'conversationId': conversationId, 'sender': sender, 'message': message, 'sentAt': time.time()}
+    traceparent = traceparent or TR.Traceparent()
+    if traceparent is not None:
+        envelope['traceparent'] = traceparent
+    if messageType is not None:
+        envelope['type'] = messageType
+        envelope['payload'] = payload or {}
+    return json.dumps(envelope)
+
+
+def UnpackMessage(rawMessage):
+    """
+    UnpackMessage
+    -------------
+    Decodes a message popped from an agent queue. Plain text messages are accepted and attached to the default conversation.
+
+    Parameters
+    ----------
+    rawMessage : str
+        The message as stored in the Redis queue.
+
+    Returns
+    -------
+    dict
+        {'conversationId': str, 'sender': str or None, 'message': str}, and 'type' / 'payload' for protocol messages
+    """
+    try:
+        envelope = json.loads(rawMessage)
+    except ValueError:
+        envelope = None
+    if not isinstance(envelope, dict) or 'message' not in envelope:
+        return {'conversationId': DEFAULT_CONVERSATION, 'sender': None, 'message': rawMessage}
+
+    envelope.setdefault('conversationId', DEFAULT_CONVERSATION)
+    envelope.setdefault('sender', None)
+    return envelope
+
+
+def FormatPrompt(envelope):
+    """
+    FormatPrompt
+    ------------
+    Returns the prompt given to the AI for a received envelope, the sender ID being indicated after 'From'.
+
+    Parameters
+    ----------
+    envelope : dict
+        Envelope returned by `UnpackMessage`.
+
+    Returns
+    -------
+    str
+        The prompt, for instance 'From AssistantAgent : what is the price of a haiku?'.
+    """
+    if envelope['sender'] is None:
+        return envelope['message']
+    return f"From {envelope['sender']} : {envelope['message']}"
@@ -0,0 +1,325 @@
+import asyncio
+import bisect
+import functools
+import math
+import threading
+import time
+import QueueManager as QM
+
+# Upper bounds (in seconds) of the histogram buckets, from a cached AI response to an on-chain confirmation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _FormatValue(value):
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _Escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _FormatLabels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_Escape(value)}"' for name, value in labels) + "}"
+
+
+class Metric:
+    """
+    Metric
+    ------
+    Base of the metrics: a value per combination of label values, updated under a lock so the metric can be
+    shared by the worker threads of an agent.
+
+    Parameters
+    ----------
+    name : str
+        Name of the metric, e.g. 'agent_tool_seconds'.
+    documentation : str
+        Help text of the metric.
+    labelNames : tuple of str, optional
+        Names of the labels of the metric.
+    registry : Registry, optional
+        Registry rendering the metric. Defaults to `REGISTRY`.
+    """
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelNames = (), registry = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelNames = tuple(labelNames)
+        self.values = {}
+        self.lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelNames):
+            raise ValueError(f"{self.name} expects the labels {self.labelNames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelNames)
+
+    def samples(self):
+        """
+        Returns the samples of the metric as (name suffix, labels, value).
+        """
+        with self.lock:
+            return [("", tuple(zip(self.labelNames, key)), value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_FormatLabels(labels)} {_FormatValue(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """
+    Counter
+    -------
+    Metric only going up, e.g. a number of tokens.
+    """
+    kind = "counter"
+
+    def inc(self, amount = 1, **labels):
+        if amount < 0:
+            raise ValueError(f"{self.name} is a counter, it cannot be decreased")
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Gauge
+    -----
+    Metric going up and down, e.g. the depth of a queue.
+    """
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    """
+    Histogram
+    ---------
+    Distribution of durations, counted in cumulative buckets with their sum, from which percentiles are computed
+    by the Prometheus server.
+
+    Parameters
+    ----------
+    buckets : tuple of float, optional
+        Upper bounds of the buckets, in increasing order. Defaults to `DEFAULT_BUCKETS`.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelNames = (), buckets = DEFAULT_BUCKETS, registry = None):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelNames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            # [count per bucket, the last one for the values above all the bounds, sum]
+            state = self.values.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0])
+            state[0][index] += 1
+            state[1] += value
+
+    def time(self, **labels):
+        """
+        Returns a context manager observing the duration of its block.
+        """
+        return _Timer(self, labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+        for key, counts, total in items:
+            labels = tuple(zip(self.labelNames, key))
+            cumulated = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulated += count
+                samples.append(("_bucket", labels + (("le", _FormatValue(float(bound))),), cumulated))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, cumulated))
+        return samples
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Registry:
+    """
+    Registry
+    --------
+    Metrics of a process, rendered in the Prometheus text format. Collectors are called before each rendering,
+    to set the gauges read from elsewhere (e.g. the depth of a Redis queue).
+    """
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            if any(registered.name == metric.name for registered in self.metrics):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self.metrics.append(metric)
+
+    def collector(self, function):
+        """
+        Registers a function called without argument before each rendering.
+        """
+        with self.lock:
+            self.collectors.append(function)
+        return function
+
+    def render(self):
+        with self.lock:
+            metrics, collectors = list(self.metrics), list(self.collectors)
+        for collect in collectors:
+            try:
+                collect()
+            except Exception as e:
+                # the other metrics are still exported
+                print(f"Error while collecting the metrics: {e}")
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+
+#%% In this section : metrics of the agents
+STAGE_SECONDS = Histogram("agent_stage_seconds", "Duration of the stages of a conversation, see StageTimings.", ("stage",))
+QUERY_SECONDS = Histogram("agent_query_seconds", "Latency of the queries to the AI (query_openai), cache hits included.", ("cached",))
+TOOL_SECONDS = Histogram("agent_tool_seconds", "Execution time of the tools called by the AI.", ("tool",))
+LLM_TOKENS = Counter("agent_llm_tokens_total", "Tokens used by the AI runs, estimated when the API does not report them.", ("kind",))
+QUEUE_DEPTH = Gauge("agent_queue_depth", "Messages waiting in an agent queue.", ("queue",))
+QUEUE_INFLIGHT = Gauge("agent_queue_inflight", "Messages of an agent queue being processed by its workers.", ("queue",))
+QUEUE_OLDEST_AGE = Gauge("agent_queue_oldest_message_age_seconds", "Age of the oldest message waiting in an agent queue.", ("queue",))
+RNAPI_CLIENT_SECONDS = Histogram("rnapi_client_request_seconds", "Latency of the calls to the rnapi server, per attempt.", ("endpoint", "outcome"))
+DEAD_LETTERS = Counter("agent_dead_letters_total", "Messages moved to the dead-letter queue, see AgentDirectory.", ("reason",))
+INIT_SECONDS = Gauge("agent_init_seconds", "Time taken to create the resources of an agent, and to be ready from the start of the process, see LazyInit.", ("resource",))
+HTTP_SECONDS = Histogram("http_request_seconds", "Latency of the requests served by the Flask application.", ("method", "route", "status"))
+#%%
+
+
+def TimedTools(functionMap):
+    """
+    TimedTools
+    ----------
+    Returns the functions of a function map, or coroutine functions, wrapped so their execution time is observed
+    in `TOOL_SECONDS` under their name.
+    """
+    def wrap(name, function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def timedAsync(**arguments):
+                with TOOL_SECONDS.time(tool = name):
+                    return await function(**arguments)
+            return timedAsync
+
+        @functools.wraps(function)
+        def timed(**arguments):
+            with TOOL_SECONDS.time(tool = name):
+                return function(**arguments)
+        return timed
+    return {name: wrap(name, function) for name, function in functionMap.items()}
+
+
+def RecordTokens(promptTokens, completionTokens):
+    """
+    RecordTokens
+    ------------
+    Adds the tokens of an AI run to `LLM_TOKENS`.
+    """
+    LLM_TOKENS.inc(promptTokens, kind = "prompt")
+    LLM_TOKENS.inc(completionTokens, kind = "completion")
+
+
+def WatchQueue(redisConnexion, queueName):
+    """
+    WatchQueue
+    ----------
+    Exports the depth, the in-flight count and the age of the oldest message of a queue, read at each rendering.
+    """
+    @REGISTRY.collector
+    def collect():
+        stats = QM.QueueStats(redisConnexion, queueName)
+        QUEUE_DEPTH.set(stats['depth'], queue = queueName)
+        QUEUE_INFLIGHT.set(stats['inflight'], queue = queueName)
+        QUEUE_OLDEST_AGE.set(stats['oldestAge'] or 0.0, queue = queueName)
+
+
+def Render():
+    """
+    Render
+    ------
+    Returns the metrics of the process in the Prometheus text format.
+    """
+    return REGISTRY.render()
+
+
+def InstrumentFlask(app):
+    """
+    InstrumentFlask
+    ---------------
+    Observes the latency of the requests served by a Flask application in `HTTP_SECONDS`, and adds the `/metrics`
+    route exporting the metrics of the process.
+
+    Parameters
+    ----------
+    app : flask.Flask
+        The application to instrument.
+
+    Returns
+    -------
+    flask.Flask
+        The same application.
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_timer():
+        g.metricsStart = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        start = g.pop('metricsStart', None)
+        if start is not None:
+            # the route template, not the path, so the IDs in the paths do not create a series each
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            HTTP_SECONDS.observe(time.perf_counter() - start, method = request.method, route = route, status = response.status_code)
+        return response
+
+    @app.route('/metrics', methods = ['GET'])
+    def metrics():
+        """
+        metrics
+        -------
+        Returns the metrics of the process in the Prometheus text format.
+        """
+        return Response(Render(), content_type = CONTENT_TYPE)
+
+    return app
@@ -0,0 +1,79 @@
+import threading
+
+# Allocates the next nonce of an address: a released nonce (lowest first) is reused before a new one is taken,
+# so a transaction that could not be sent does not leave a gap blocking the following ones
+ALLOCATE_SCRIPT = """
+local released = redis.call('ZRANGE', KEYS[2], 0, 0)
+if #released > 0 then
+    redis.call('ZREM', KEYS[2], released[1])
+    return tonumber(released[1])
+end
+return redis.call('INCR', KEYS[1]) - 1
+"""
+
+# Sets the next nonce of an address from the chain and forgets the released nonces already used on chain
+RESYNC_SCRIPT = """
+redis.call('SET', KEYS[1], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', '(' .. ARGV[1])
+return tonumber(ARGV[1])
+"""
+
+
+class NonceManager:
+    """
+    NonceManager
+    ------------
+    Local nonce allocator of a wallet. Nonces are allocated in Redis with an atomic script, so concurrent payments
+    from the same wallet, in threads, asyncio tasks or several agent replicas, never get the same nonce and do not
+    have to query the chain before each transaction.
+    The next nonce is initialised from the pending transaction count of the chain, and resynced from it when a
+    transaction is rejected because of its nonce.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server.
+    address : str
+        Address of the wallet.
+    getTransactionCount : callable
+        Function returning the pending transaction count of the wallet on the chain.
+    """
+    def __init__(self, redisConnexion, address, getTransactionCount):
+        self.redis = redisConnexion
+        self.address = address
+        self.getTransactionCount = getTransactionCount
+        self.key = f"nonce:{address}"
+        self.releasedKey = f"nonce:{address}:released"
+        self.allocateScript = redisConnexion.register_script(ALLOCATE_SCRIPT)
+        self.resyncScript = redisConnexion.register_script(RESYNC_SCRIPT)
+        # only one thread of the process resyncs at a time
+        self.lock = threading.Lock()
+        self.initialised = False
+
+    def allocate(self):
+        """
+        Returns the next nonce of the wallet, initialising the allocator from the chain on first use.
+        """
+        if not self.initialised:
+            with self.lock:
+                if not self.initialised:
+                    # another replica may have initialised it already
+                    self.redis.set(self.key, self.getTransactionCount(), nx = True)
+                    self.initialised = True
+        return self.allocateScript(keys = [self.key, self.releasedKey])
+
+    def release(self, nonce):
+        """
+        Gives back a nonce whose transaction was not sent, it is allocated again to the next transaction.
+        """
+        self.redis.zadd(self.releasedKey, {nonce: nonce})
+
+    def resync(self):
+        """
+        Sets the next nonce from the pending transaction count of the chain. Called when a transaction is
+        rejected because of its nonce (e.g. a transaction was sent from the wallet by another tool).
+        """
+        with self.lock:
+            nonce = self.resyncScript(keys = [self.key, self.releasedKey], args = [self.getTransactionCount()])
+            self.initialised = True
+        return nonce
@@ -0,0 +1,226 @@
+"""
+Local stub of the OpenAI Assistants API, answering the calls made by the agents (assistants, threads, messages, runs)
+without querying a model. Every run completes at once with a canned reply, so the start of the agents and the reuse
+of the registered assistants can be checked without an OpenAI account.
+The agents are pointed at the stub with OPENAI_BASE_URL=http://localhost:5055/v1 (and any OPENAI_API_KEY).
+
+The reply is set with OPENAI_STUB_REPLY, '{prompt}' being replaced by the last user message, and delayed by
+OPENAI_STUB_LATENCY milliseconds. The `/stub/stats` route returns the number of objects created and deleted.
+The replies can be scripted, tool calls included, by replacing `script` (see `CannedReply`), as done by BenchmarkStubs.py.
+
+Usage : python OpenAIStub.py [port]
+"""
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from flask import Flask, jsonify, request
+
+app = Flask(__name__)
+
+REPLY = os.getenv("OPENAI_STUB_REPLY", "Internal Message: {prompt}")
+LATENCY = float(os.getenv("OPENAI_STUB_LATENCY", "0")) / 1000
+
+lock = threading.Lock()
+_ids = itertools.count(1)
+assistants = {}
+threads = {}
+runs = {}
+# scripted replies of the runs waiting for tool outputs, by run ID
+pending = {}
+counters = {'assistantsCreated': 0, 'assistantsDeleted': 0, 'threadsCreated': 0, 'threadsDeleted': 0, 'runs': 0}
+
+
+def NewId(prefix):
+    return f"{prefix}_stub{next(_ids):08d}"
+
+
+def ListOf(items, hasMore = False):
+    return jsonify({'object': "list", 'data': items, 'first_id': items[0]['id'] if items else None,
+                    'last_id': items[-1]['id'] if items else None, 'has_more': hasMore})
+
+
+def NotFound(kind, objectId):
+    return jsonify({'error': {'message': f"No {kind} found with id '{objectId}'.", 'type': "invalid_request_error"}}), 404
+
+
+def Message(threadId, role, text, runId = None, assistantId = None):
+    return {'id': NewId("msg"), 'object': "thread.message", 'created_at': int(time.time()), 'thread_id': threadId,
+            'role': role, 'content': [{'type': "text", 'text': {'value': text, 'annotations': []}}],
+            'assistant_id': assistantId, 'run_id': runId, 'attachments': [], 'file_ids': [], 'metadata': {}, 'status': "completed"}
+
+
+def CannedReply(assistantName, prompt):
+    """
+    Default script of the stub. A script is called with the name of the assistant and the last user message, and returns
+    either the text of the reply, or a generator yielding the tool calls as (name, arguments), receiving their outputs
+    and returning the text of the reply.
+    """
+    return REPLY.replace("{prompt}", prompt)
+
+
+script = CannedReply
+
+
+def _advance(run, reply, output = None):
+    """
+    Runs a scripted reply until its next tool call, or until its end. Must be called with the lock held.
+    """
+    try:
+        name, arguments = reply.send(output)
+    except StopIteration as end:
+        pending.pop(run['id'], None)
+        _complete(run, end.value)
+        return
+    pending[run['id']] = reply
+    toolCall = {'id': NewId("call"), 'type': "function", 'function': {'name': name, 'arguments': json.dumps(arguments)}}
+    run['status'] = "requires_action"
+    run['required_action'] = {'type': "submit_tool_outputs", 'submit_tool_outputs': {'tool_calls': [toolCall]}}
+
+
+def _complete(run, text):
+    threads[run['thread_id']].append(Message(run['thread_id'], "assistant", text, run['id'], run['assistant_id']))
+    run['status'] = "completed"
+    run['required_action'] = None
+
+
+@app.route('/v1/assistants', methods = ['POST'])
+def create_assistant():
+    body = request.get_json(force = True)
+    assistant = {'id': NewId("asst"), 'object': "assistant", 'created_at': int(time.time()), 'name': body.get('name'),
+                 'description': body.get('description'), 'model': body.get('model'), 'instructions': body.get('instructions'),
+                 'tools': body.get('tools', []), 'file_ids': [], 'tool_resources': {}, 'metadata': body.get('metadata', {})}
+    with lock:
+        assistants[assistant['id']] = assistant
+        counters['assistantsCreated'] += 1
+    return jsonify(assistant)
+
+
+@app.route('/v1/assistants', methods = ['GET'])
+def list_assistants():
+    with lock:
+        return ListOf(list(assistants.values()))
+
+
+@app.route('/v1/assistants/<assistantId>', methods = ['GET', 'POST'])
+def retrieve_assistant(assistantId):
+    with lock:
+        assistant = assistants.get(assistantId)
+        if assistant is None:
+            return NotFound("assistant", assistantId)
+        if request.method == 'POST':
+            assistant.update(request.get_json(force = True))
+        return jsonify(assistant)
+
+
+@app.route('/v1/assistants/<assistantId>', methods = ['DELETE'])
+def delete_assistant(assistantId):
+    with lock:
+        if assistants.pop(assistantId, None) is None:
+            return NotFound("assistant", assistantId)
+        counters['assistantsDeleted'] += 1
+    return jsonify({'id': assistantId, 'object': "assistant.deleted", 'deleted': True})
+
+
+@app.route('/v1/threads', methods = ['POST'])
+def create_thread():
+    thread = {'id': NewId("thread"), 'object': "thread", 'created_at': int(time.time()), 'metadata': {}, 'tool_resources': None}
+    body = request.get_json(silent = True) or {}
+    with lock:
+        threads[thread['id']] = [Message(thread['id'], item['role'], item['content']) for item in body.get('messages', [])]
+        counters['threadsCreated'] += 1
+    return jsonify(thread)
+
+
+@app.route('/v1/threads/<threadId>', methods = ['DELETE'])
+def delete_thread(threadId):
+    with lock:
+        if threads.pop(threadId, None) is None:
+            return NotFound("thread", threadId)
+        counters['threadsDeleted'] += 1
+    return jsonify({'id': threadId, 'object': "thread.deleted", 'deleted': True})
+
+
+@app.route('/v1/threads/<threadId>/messages', methods = ['POST'])
+def create_message(threadId):
+    body = request.get_json(force = True)
+    content = body['content'] if isinstance(body['content'], str) else "".join(part.get('text', "") for part in body['content'])
+    with lock:
+        if threadId not in threads:
+            return NotFound("thread", threadId)
+        message = Message(threadId, body.get('role', "user"), content)
+        threads[threadId].append(message)
+    return jsonify(message)
+
+
+@app.route('/v1/threads/<threadId>/messages', methods = ['GET'])
+def list_messages(threadId):
+    with lock:
+        if threadId not in threads:
+            return NotFound("thread", threadId)
+        messages = list(threads[threadId])
+    if request.args.get('order', "desc") == "desc":
+        messages.reverse()
+    # cursor pagination, followed by the list iterators of the SDK
+    after = request.args.get('after')
+    if after is not None:
+        ids = [message['id'] for message in messages]
+        messages = messages[ids.index(after) + 1:] if after in ids else []
+    limit = int(request.args.get('limit', 20))
+    return ListOf(messages[:limit], len(messages) > limit)
+
+
+@app.route('/v1/threads/<threadId>/runs', methods = ['POST'])
+def create_run(threadId):
+    body = request.get_json(force = True)
+    time.sleep(LATENCY)
+    with lock:
+        if threadId not in threads:
+            return NotFound("thread", threadId)
+        prompts = [message for message in threads[threadId] if message['role'] == "user"]
+        prompt = prompts[-1]['content'][0]['text']['value'] if prompts else ""
+        assistant = assistants.get(body['assistant_id'], {})
+        run = {'id': NewId("run"), 'object': "thread.run", 'created_at': int(time.time()), 'thread_id': threadId,
+               'assistant_id': body['assistant_id'], 'status': "completed", 'required_action': None, 'last_error': None,
+               'model': assistant.get('model'), 'instructions': "", 'tools': [], 'metadata': {}}
+        runs[run['id']] = run
+        counters['runs'] += 1
+        reply = script(assistant.get('name'), prompt)
+        if isinstance(reply, str):
+            _complete(run, reply)
+        else:
+            _advance(run, reply)
+        return jsonify(run)
+
+
+@app.route('/v1/threads/<threadId>/runs/<runId>/submit_tool_outputs', methods = ['POST'])
+def submit_tool_outputs(threadId, runId):
+    outputs = request.get_json(force = True).get('tool_outputs', [])
+    time.sleep(LATENCY)
+    with lock:
+        run = runs.get(runId)
+        if run is None or runId not in pending:
+            return NotFound("run waiting for tool outputs", runId)
+        _advance(run, pending[runId], outputs[0]['output'] if outputs else "")
+        return jsonify(run)
+
+
+@app.route('/v1/threads/<threadId>/runs/<runId>', methods = ['GET'])
+def retrieve_run(threadId, runId):
+    with lock:
+        run = runs.get(runId)
+        if run is None:
+            return NotFound("run", runId)
+        return jsonify(run)
+
+
+@app.route('/stub/stats', methods = ['GET'])
+def stub_stats():
+    with lock:
+        return jsonify(dict(counters, assistants = len(assistants), threads = len(threads)))
+
+
+if __name__ == '__main__':
+    app.run(port = int(sys.argv[1]) if len(sys.argv) > 1 else 5055, threaded = True)
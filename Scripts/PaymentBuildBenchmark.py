@@ -0,0 +1,94 @@
+"""
+Micro-benchmark of the build of a payment transaction, before and after the prepared payment context of walletManager.
+The node is a stub answering instantly and counting the RPCs, so the measured time is the local build time:
+with a real node, each RPC adds a network round trip.
+
+Usage : python PaymentBuildBenchmark.py [iterations]
+"""
+import sys
+import time
+from eth_account import Account
+from web3 import Web3
+from web3.providers import BaseProvider
+from web3.utils import log_topic_to_bytes
+import walletManager as WM
+
+
+class CountingProvider(BaseProvider):
+    """
+    Stub node answering the RPCs used to build a transaction, and counting them.
+    """
+    RESPONSES = {
+        "eth_chainId": "0xaa36a7",
+        "eth_getTransactionCount": "0x5",
+        "eth_estimateGas": "0xa410",
+        "eth_gasPrice": "0x3b9aca00",
+        "eth_maxPriorityFeePerGas": "0x3b9aca00",
+        "eth_getBlockByNumber": {
+            "number": "0x1", "hash": "0x" + "11" * 32, "parentHash": "0x" + "00" * 32, "timestamp": "0x1",
+            "gasLimit": "0x1c9c380", "gasUsed": "0x0", "baseFeePerGas": "0x3b9aca00", "transactions": []
+        },
+    }
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def make_request(self, method, params):
+        self.calls += 1
+        return {"jsonrpc": "2.0", "id": 1, "result": self.RESPONSES[method]}
+
+
+def BuildBefore(web3, sender, recipient, paymentReference):
+    """
+    Previous build of `PerformPayment`: contract instance created and ABI parsed for each payment, nonce, gas and fees queried from the node.
+    """
+    contract_instance = web3.eth.contract(address = WM.contract_address, abi = WM.ABI_json)
+    return contract_instance.functions.transferWithReferenceAndFee(
+        recipient,
+        log_topic_to_bytes(paymentReference),
+        0,
+        WM.fee_address
+    ).build_transaction({
+            'from': sender,
+            'value': web3.to_wei(0.001, 'ether'),
+            'nonce': web3.eth.get_transaction_count(sender),
+            'chainId': 11155111,
+        })
+
+
+def BuildAfter(context, nonce, recipient, paymentReference):
+    """
+    Build with the prepared payment context, the nonce being allocated locally.
+    """
+    return context.build_transaction(
+        "transferWithReferenceAndFee",
+        [recipient, log_topic_to_bytes(paymentReference), 0, WM.fee_address],
+        Web3.to_wei(0.001, 'ether'),
+        nonce,
+        gasKey = ("transferWithReferenceAndFee", recipient.lower())
+    )
+
+
+def Measure(name, provider, build, iterations):
+    provider.calls = 0
+    start = time.perf_counter()
+    for i in range(iterations):
+        build(i)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<8} {elapsed / iterations * 1000:8.3f} ms / payment   {provider.calls / iterations:5.2f} RPC / payment")
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    sender = Account.create().address
+    recipient = Account.create().address
+    paymentReference = "0x" + "ab" * 8
+
+    provider = CountingProvider()
+    web3 = Web3(provider)
+    context = WM.PaymentContext(web3, WM.contract_address, WM.ABI_json, sender)
+
+    print(f"Build of {iterations} payment transactions")
+    Measure("before", provider, lambda i: BuildBefore(web3, sender, recipient, paymentReference), iterations)
+    Measure("after", provider, lambda i: BuildAfter(context, i, recipient, paymentReference), iterations)
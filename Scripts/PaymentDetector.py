@@ -0,0 +1,270 @@
+import json
+import os
+import socket
+import threading
+import redis
+from eth_abi import decode as abi_decode
+from web3 import Web3
+from web3.utils import log_topic_to_bytes
+import walletManager as WM
+
+# If set to 1, the payments are detected from the logs of the payment contract and the invoice watcher only checks
+# with the rnapi server the invoices whose payment reference was seen on chain
+DETECTOR_ENABLED = os.getenv("PAYMENT_DETECTOR", "0") == "1"
+# Last block scanned by the detector
+CHECKPOINT_KEY = "payment_detector_checkpoint"
+# Redis hash of the watched payment references: reference topic -> payment reference
+REFERENCES_KEY = "payment_detector_references"
+# Redis hash of the detected payments: payment reference -> JSON {amount, feeAmount, payments: {txHash:logIndex -> payment}}
+PAYMENTS_KEY = "payments_by_reference"
+# Lease ensuring a single detector scans the logs when several agent replicas are running
+LOCK_KEY = "payment_detector_lock"
+# Maximum number of blocks of a single eth_getLogs request, halved when the node rejects a range
+CHUNK_SIZE = int(os.getenv("PAYMENT_DETECTOR_CHUNK_SIZE", "2000"))
+# Maximum number of reference topics of a single eth_getLogs request
+TOPICS_PER_REQUEST = int(os.getenv("PAYMENT_DETECTOR_TOPICS_PER_REQUEST", "500"))
+# Number of blocks a payment must be buried under before being indexed
+CONFIRMATIONS = int(os.getenv("PAYMENT_DETECTOR_CONFIRMATIONS", "2"))
+# Time (in seconds) between two scans, about a block
+SCAN_INTERVAL = float(os.getenv("PAYMENT_DETECTOR_INTERVAL", "12"))
+
+# Topic of the TransferWithReferenceAndFee event of the payment contract, see walletManager.ABI_json
+EVENT_TOPIC = Web3.to_hex(Web3.keccak(text = "TransferWithReferenceAndFee(address,uint256,bytes,uint256,address)"))
+
+
+def _hex(value):
+    """
+    Returns a topic, hash or data field of a log as an hexadecimal string, whether it comes from a node or from a fixture.
+    """
+    return value if isinstance(value, str) else Web3.to_hex(value)
+
+
+def ReferenceTopic(paymentReference):
+    """
+    ReferenceTopic
+    --------------
+    Returns the topic of a payment reference. The reference is an indexed `bytes` parameter of the event,
+    so its topic is the keccak hash of the bytes sent in the payment (see `walletManager.SubmitPayment`).
+
+    Parameters
+    ----------
+    paymentReference : str
+        Payment reference of an invoice.
+
+    Returns
+    -------
+    str
+        The topic, as an hexadecimal string.
+    """
+    return Web3.to_hex(Web3.keccak(log_topic_to_bytes(paymentReference)))
+
+
+def WatchReference(redisConnexion, paymentReference):
+    """
+    WatchReference
+    --------------
+    Adds a payment reference to the references looked for by the detector.
+    """
+    redisConnexion.hset(REFERENCES_KEY, ReferenceTopic(paymentReference), paymentReference)
+
+
+async def WatchReferenceAsync(redisConnexion, paymentReference):
+    """
+    WatchReferenceAsync
+    -------------------
+    Awaitable version of `WatchReference`, with an asynchronous Redis connexion.
+    """
+    await redisConnexion.hset(REFERENCES_KEY, ReferenceTopic(paymentReference), paymentReference)
+
+
+def UnwatchReferences(redisConnexion, paymentReferences):
+    """
+    UnwatchReferences
+    -----------------
+    Removes payment references from the references looked for by the detector, and their detected payments.
+    """
+    if paymentReferences:
+        pipe = redisConnexion.pipeline()
+        pipe.hdel(REFERENCES_KEY, *[ReferenceTopic(paymentReference) for paymentReference in paymentReferences])
+        pipe.hdel(PAYMENTS_KEY, *paymentReferences)
+        pipe.execute()
+
+
+def GetPayments(redisConnexion, paymentReferences):
+    """
+    GetPayments
+    -----------
+    Returns the detected payments of a list of payment references, with a single local lookup.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server.
+    paymentReferences : list of str
+        Payment references of the invoices.
+
+    Returns
+    -------
+    dict
+        Payment reference -> {'amount', 'feeAmount', 'payments'} for the references with at least one payment,
+        amounts being in wei.
+    """
+    if not paymentReferences:
+        return {}
+    entries = redisConnexion.hmget(PAYMENTS_KEY, paymentReferences)
+    return {paymentReference: json.loads(entry) for paymentReference, entry in zip(paymentReferences, entries) if entry is not None}
+
+
+def IndexLog(redisConnexion, log, references):
+    """
+    IndexLog
+    --------
+    Adds a TransferWithReferenceAndFee log to the payment index. A log already indexed is ignored, so a block range can be scanned again.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server.
+    log : dict
+        The log, as returned by eth_getLogs.
+    references : dict
+        Watched reference topics -> payment references.
+
+    Returns
+    -------
+    bool
+        True if the log is a new payment of a watched reference.
+    """
+    topics = [_hex(topic) for topic in log['topics']]
+    if len(topics) < 2 or topics[0] != EVENT_TOPIC or topics[1] not in references:
+        return False
+    paymentReference = references[topics[1]]
+    to, amount, feeAmount, feeAddress = abi_decode(['address', 'uint256', 'uint256', 'address'], bytes.fromhex(_hex(log['data'])[2:]))
+    blockNumber = log['blockNumber'] if isinstance(log['blockNumber'], int) else int(log['blockNumber'], 16)
+    logIndex = log['logIndex'] if isinstance(log['logIndex'], int) else int(log['logIndex'], 16)
+    paymentId = f"{_hex(log['transactionHash'])}:{logIndex}"
+
+    entry = redisConnexion.hget(PAYMENTS_KEY, paymentReference)
+    entry = json.loads(entry) if entry is not None else {'amount': 0, 'feeAmount': 0, 'payments': {}}
+    if paymentId in entry['payments']:
+        return False
+    entry['payments'][paymentId] = {'to': to, 'amount': amount, 'feeAmount': feeAmount, 'feeAddress': feeAddress, 'blockNumber': blockNumber}
+    entry['amount'] += amount
+    entry['feeAmount'] += feeAmount
+    redisConnexion.hset(PAYMENTS_KEY, paymentReference, json.dumps(entry))
+    return True
+
+
+def ScanPayments(redisConnexion, getLogs, latestBlock, contractAddress = WM.contract_address, chunkSize = CHUNK_SIZE):
+    """
+    ScanPayments
+    ------------
+    Scans the logs of the payment contract from the last checkpoint up to `latestBlock`, in block range chunks,
+    and indexes the payments of the watched references. The checkpoint is saved after each chunk.
+    On the first scan, only the last chunk before `latestBlock` is scanned.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server.
+    getLogs : callable
+        Function called with the filter parameters of eth_getLogs and returning the logs, e.g. `web3.eth.get_logs`
+        or a function replaying recorded logs, see `FixtureLogs`.
+    latestBlock : int
+        Last block to scan.
+    contractAddress : str, optional
+        Address of the payment contract.
+    chunkSize : int, optional
+        Maximum number of blocks of a request.
+
+    Returns
+    -------
+    int
+        Number of new payments indexed.
+    """
+    references = {topic.decode('utf-8'): paymentReference.decode('utf-8') for topic, paymentReference in redisConnexion.hgetall(REFERENCES_KEY).items()}
+    checkpoint = redisConnexion.get(CHECKPOINT_KEY)
+    fromBlock = int(checkpoint) + 1 if checkpoint is not None else max(0, latestBlock - chunkSize + 1)
+    topics = list(references)
+    found = 0
+    while fromBlock <= latestBlock:
+        toBlock = min(fromBlock + chunkSize - 1, latestBlock)
+        try:
+            logs = []
+            for start in range(0, len(topics), TOPICS_PER_REQUEST):
+                logs += getLogs({'fromBlock': fromBlock, 'toBlock': toBlock, 'address': contractAddress,
+                                 'topics': [EVENT_TOPIC, topics[start:start + TOPICS_PER_REQUEST]]})
+        except Exception as e:
+            if chunkSize == 1:
+                raise
+            # the node limits the range or the number of results of a request
+            chunkSize = max(1, chunkSize // 2)
+            print(f"eth_getLogs failed on blocks {fromBlock}-{toBlock}, chunk size reduced to {chunkSize}: {e}")
+            continue
+        found += sum(IndexLog(redisConnexion, log, references) for log in logs)
+        redisConnexion.set(CHECKPOINT_KEY, toBlock)
+        fromBlock = toBlock + 1
+    return found
+
+
+def FixtureLogs(path):
+    """
+    FixtureLogs
+    -----------
+    Returns a `getLogs` function replaying the logs recorded in a JSON file (a list of eth_getLogs results),
+    filtered by block range and topics like a node would do. Used to run the detector without a node.
+    """
+    with open(path) as fixture:
+        recorded = json.load(fixture)
+
+    def getLogs(filterParams):
+        eventTopic, referenceTopics = filterParams['topics']
+        return [log for log in recorded
+                if filterParams['fromBlock'] <= int(log['blockNumber'], 16) <= filterParams['toBlock']
+                and log['address'].lower() == filterParams['address'].lower()
+                and log['topics'][0] == eventTopic and log['topics'][1] in referenceTopics]
+    return getLogs
+
+
+def _detect(redisConnexion, web3, stopEvent, interval):
+    detectorId = f"{socket.gethostname()}-{os.getpid()}"
+    while not stopEvent.is_set():
+        try:
+            # the lease expires with the interval, a single detector scans the logs per interval
+            if redisConnexion.set(LOCK_KEY, detectorId, nx = True, ex = max(1, int(interval))):
+                ScanPayments(redisConnexion, web3.eth.get_logs, web3.eth.block_number - CONFIRMATIONS)
+        except redis.ConnectionError as e:
+            print(f"Redis connexion error in payment detector: {e}")
+        except Exception as e:
+            print(f"Error in payment detector: {e}")
+        stopEvent.wait(interval)
+
+
+def StartDetector(redisConnexion, web3 = WM.web3Connex, interval = SCAN_INTERVAL):
+    """
+    StartDetector
+    -------------
+    Starts the background thread scanning the logs of the payment contract.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server.
+    web3 : Web3, optional
+        Connexion to the node, e.g. a local dev chain.
+    interval : float, optional
+        Time (in seconds) between two scans.
+
+    Returns
+    -------
+    threading.Event
+        Event to set in order to stop the detector.
+    """
+    stopEvent = threading.Event()
+    threading.Thread(target = _detect, args = (redisConnexion, web3, stopEvent, interval), name = "payment-detector", daemon = True).start()
+    return stopEvent
+
+
+if __name__ == "__main__":
+    # the detector can also run as a standalone process
+    StartDetector(redis.Redis(host='localhost', port = 6379, db = int(os.getenv("REDIS_DB", "0")))).wait()
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+
+
+class ProtocolDispatcher:
+    """
+    ProtocolDispatcher
+    ------------------
+    Rule-based handling of the protocol messages, i.e. the envelopes carrying a `type` and a structured `payload`
+    (see `MessageEnvelope`). Routine steps are handled directly by the registered handlers, the LLM is only
+    queried for the other messages and for the protocol messages a handler declines.
+
+    A handler is called with (envelope, session) and returns True if the message was handled, False to let the AI process it.
+    """
+    def __init__(self):
+        self.handlers = {}
+        self.lock = threading.Lock()
+        self.handled = {}
+        self.declined = {}
+
+    def register(self, messageType, handler):
+        """
+        Registers the handler of a message type.
+        """
+        self.handlers[messageType] = handler
+
+    def _count(self, messageType, handled):
+        with self.lock:
+            counters = self.handled if handled else self.declined
+            counters[messageType] = counters.get(messageType, 0) + 1
+
+    def dispatch(self, envelope, session):
+        """
+        Handles a message with the handler of its type. Returns True if the message was handled and the AI must not be queried.
+        """
+        handler = self.handlers.get(envelope.get('type'))
+        if handler is None:
+            return False
+        handled = bool(handler(envelope, session))
+        self._count(envelope['type'], handled)
+        return handled
+
+    async def dispatch_async(self, envelope, session):
+        """
+        Awaitable version of `dispatch`, the handler being run in a worker thread.
+        """
+        handler = self.handlers.get(envelope.get('type'))
+        if handler is None:
+            return False
+        handled = bool(await asyncio.to_thread(handler, envelope, session))
+        self._count(envelope['type'], handled)
+        return handled
+
+    def stats(self):
+        """
+        Returns the number of handled and declined messages per type.
+        """
+        with self.lock:
+            return {'handled': dict(self.handled), 'declined': dict(self.declined)}
@@ -0,0 +1,303 @@
+import os
+import socket
+import threading
+import time
+import uuid
+import redis
+import MessageEnvelope as ME
+import AgentDirectory as AD
+
+# Default time (in seconds) a consumer stays blocked on an empty queue before checking if it should stop
+BLOCK_TIMEOUT = 5
+# Lifetime (in seconds) of a worker heartbeat. A worker without heartbeat is considered dead and its in-flight messages are re-delivered
+HEARTBEAT_TTL = 30
+# ID of this start of the process. After a container restart the hostname and the PID (usually 1) are the same, the workers
+# of the new process must not take over the IDs, and the heartbeats, of the crashed process whose messages are re-delivered
+START_ID = uuid.uuid4().hex[:8]
+
+# Moves back all the messages of a processing list at the consuming end of the queue, oldest message first.
+# Processing lists are filled with LPUSH, so the oldest message is the last element.
+REQUEUE_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[1], 0, -1)
+for i = 1, #items do
+    redis.call('RPUSH', KEYS[2], items[i])
+end
+redis.call('DEL', KEYS[1])
+return #items
+"""
+
+
+# Keys used by the workers of a queue: their processing list, their heartbeat and the set of registered workers
+def ProcessingKey(queueName, workerId):
+    return f"{queueName}:processing:{workerId}"
+
+
+def ProcessId():
+    """
+    ProcessId
+    ---------
+    Returns the prefix of the IDs of the workers of this process: hostname, PID and `START_ID`.
+    """
+    return f"{socket.gethostname()}-{os.getpid()}-{START_ID}"
+
+
+def HeartbeatKey(queueName, workerId):
+    return f"{queueName}:worker:{workerId}"
+
+
+def WorkersKey(queueName):
+    return f"{queueName}:workers"
+
+
+def RecoverStaleMessages(redisConnexion, queueName):
+    """
+    RecoverStaleMessages
+    --------------------
+    Re-delivers the in-flight messages of dead workers. A worker is dead when its heartbeat expired,
+    for instance because its process crashed during an LLM call. Its processing list is moved back in the queue.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server hosting the queue.
+    queueName : str
+        Name of the Redis list consumed by the workers.
+
+    Returns
+    -------
+    int
+        Number of messages moved back in the queue.
+    """
+    requeue = redisConnexion.register_script(REQUEUE_SCRIPT)
+    recovered = 0
+    for workerId in redisConnexion.smembers(WorkersKey(queueName)):
+        workerId = workerId.decode('utf-8')
+        if redisConnexion.exists(HeartbeatKey(queueName, workerId)):
+            continue
+        recovered += requeue(keys = [ProcessingKey(queueName, workerId), queueName])
+        redisConnexion.srem(WorkersKey(queueName), workerId)
+    if recovered:
+        print(f"{recovered} in-flight message(s) re-delivered in {queueName}")
+    return recovered
+
+
+def QueueStats(redisConnexion, queueName):
+    """
+    QueueStats
+    ----------
+    Returns the depth of a queue, the age of its oldest waiting message and the number of messages being processed by its workers.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server hosting the queue.
+    queueName : str
+        Name of the Redis list consumed by the workers.
+
+    Returns
+    -------
+    dict
+        {'queue': name of the queue, 'depth': waiting messages, 'oldestAge': seconds since the oldest waiting message was sent
+        (None if the queue is empty or the message carries no send time), 'inflight': messages being processed, 'workers': registered workers}
+    """
+    workerIds = [workerId.decode('utf-8') for workerId in redisConnexion.smembers(WorkersKey(queueName))]
+    pipe = redisConnexion.pipeline(transaction = False)
+    # the oldest message is at the consuming end of the queue
+    pipe.lindex(queueName, -1)
+    pipe.llen(queueName)
+    for workerId in workerIds:
+        pipe.llen(ProcessingKey(queueName, workerId))
+    oldest, *lengths = pipe.execute()
+    sentAt = ME.UnpackMessage(oldest).get('sentAt') if oldest is not None else None
+    oldestAge = max(0.0, time.time() - sentAt) if sentAt is not None else None
+    return {'queue': queueName, 'depth': lengths[0], 'oldestAge': oldestAge, 'inflight': sum(lengths[1:]), 'workers': len(workerIds)}
+
+
+def _heartbeat(redisConnexion, queueName, workerIds, stopEvent):
+    """
+    _heartbeat
+    ----------
+    Keeps the heartbeat of the workers of this process alive, even while a worker is blocked in a long LLM call.
+    """
+    while not stopEvent.is_set():
+        try:
+            pipe = redisConnexion.pipeline(transaction = False)
+            for workerId in workerIds:
+                pipe.set(HeartbeatKey(queueName, workerId), 1, ex = HEARTBEAT_TTL)
+            pipe.execute()
+        except redis.ConnectionError as e:
+            print(f"Redis connexion error on {queueName} heartbeat: {e}")
+        stopEvent.wait(HEARTBEAT_TTL / 3)
+
+
+def _unregister(redisConnexion, queueName, workerIds):
+    """
+    _unregister
+    -----------
+    Removes workers whose processing list is empty from the registered workers, with their heartbeat.
+    """
+    pipe = redisConnexion.pipeline(transaction = False)
+    for workerId in workerIds:
+        pipe.srem(WorkersKey(queueName), workerId)
+        pipe.delete(HeartbeatKey(queueName, workerId))
+    pipe.execute()
+
+
+def _handle(redisConnexion, queueName, processingKey, item, handler):
+    """
+    _handle
+    -------
+    Hands a message of a processing list to the handler and acknowledges it.
+    """
+    try:
+        handler(item.decode('utf-8'))
+    except Exception as e:
+        # a failing message is acknowledged anyway, re-delivering it would fail again; it is kept in the dead-letter queue
+        print(f"Error while processing message from {queueName}: {e}")
+        AD.DeadLetter(redisConnexion, item.decode('utf-8'), AD.HANDLER_ERROR, queueName, repr(e))
+    finally:
+        redisConnexion.lrem(processingKey, 1, item)
+
+
+def _consume(redisConnexion, queueName, workerId, handler, stopEvent, blockTimeout):
+    """
+    _consume
+    --------
+    Worker loop of a queue consumer. Blocks on the Redis queue until a message arrives, atomically moves it
+    into the processing list of the worker, hands it to the handler and acknowledges it once processed.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server hosting the queue.
+    queueName : str
+        Name of the Redis list to consume (messages are pushed with LPUSH and consumed from the right side).
+    workerId : str
+        Unique ID of the worker, used to name its processing list.
+    handler : callable
+        Function called with the decoded message.
+    stopEvent : threading.Event
+        Event used to stop the worker.
+    blockTimeout : int
+        Maximum time (in seconds) to block on an empty queue.
+
+    Returns
+    -------
+    None
+    """
+    processingKey = ProcessingKey(queueName, workerId)
+    while not stopEvent.is_set():
+        try:
+            # BRPOPLPUSH rather than BLMOVE to stay compatible with Redis < 6.2
+            item = redisConnexion.brpoplpush(queueName, processingKey, timeout = blockTimeout)
+        except redis.ConnectionError as e:
+            print(f"Redis connexion error on {queueName}: {e}")
+            time.sleep(1)
+            continue
+
+        if item is None:
+            continue
+        _handle(redisConnexion, queueName, processingKey, item, handler)
+
+
+def ProcessOne(redisConnexion, queueName, handler):
+    """
+    ProcessOne
+    ----------
+    Processes at most one message of the queue without blocking, with the same acknowledgement and dead-letter queue
+    as the consumers. Used as a manual fallback to the consumer threads: the call is a worker of its own, its heartbeat
+    is kept alive while the message is processed and it is unregistered once done.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server hosting the queue.
+    queueName : str
+        Name of the Redis list to consume.
+    handler : callable
+        Function called with the decoded message.
+
+    Returns
+    -------
+    bool
+        True if a message was processed, False if the queue was empty.
+    """
+    # concurrent calls do not share a processing list
+    workerId = f"{ProcessId()}-manual-{uuid.uuid4().hex[:8]}"
+    processingKey = ProcessingKey(queueName, workerId)
+    # registered before the message is moved in its processing list, so it is re-delivered if the process crashes
+    pipe = redisConnexion.pipeline(transaction = False)
+    pipe.sadd(WorkersKey(queueName), workerId)
+    pipe.set(HeartbeatKey(queueName, workerId), 1, ex = HEARTBEAT_TTL)
+    pipe.execute()
+
+    item = redisConnexion.rpoplpush(queueName, processingKey)
+    if item is None:
+        _unregister(redisConnexion, queueName, [workerId])
+        return False
+    stopEvent = threading.Event()
+    threading.Thread(target = _heartbeat, args = (redisConnexion, queueName, [workerId], stopEvent),
+                     name = f"{queueName}-heartbeat-{workerId}", daemon = True).start()
+    try:
+        _handle(redisConnexion, queueName, processingKey, item, handler)
+    finally:
+        stopEvent.set()
+        _unregister(redisConnexion, queueName, [workerId])
+    return True
+
+
+def StartConsumers(redisConnexion, queueName, handler, workers = 1, blockTimeout = BLOCK_TIMEOUT):
+    """
+    StartConsumers
+    --------------
+    Starts worker threads consuming a Redis queue with blocking pops. A worker wakes up as soon as a message
+    is pushed in the queue, there is no polling interval.
+    Delivery is at-least-once: each message is kept in a per-worker processing list until the handler returns,
+    and the in-flight messages of dead workers are re-delivered at startup. Several agent replicas can
+    therefore consume the same queue.
+
+    Parameters
+    ----------
+    redisConnexion : redis.Redis
+        Connexion to the Redis server hosting the queue.
+    queueName : str
+        Name of the Redis list to consume, for instance '{ia_ID}_queue'.
+    handler : callable
+        Function called with each decoded message. It is called from the worker threads.
+    workers : int, optional
+        Number of worker threads consuming the queue. Defaults to 1.
+    blockTimeout : int, optional
+        Maximum time (in seconds) a worker blocks on an empty queue before checking the stop event.
+
+    Returns
+    -------
+    threading.Event
+        Event to set in order to stop the consumers.
+    """
+    stopEvent = threading.Event()
+    workerIds = [f"{ProcessId()}-{n}" for n in range(max(1, workers))]
+
+    # register the workers and their heartbeat before recovering, so they are not considered as dead
+    pipe = redisConnexion.pipeline(transaction = False)
+    for workerId in workerIds:
+        pipe.sadd(WorkersKey(queueName), workerId)
+        pipe.set(HeartbeatKey(queueName, workerId), 1, ex = HEARTBEAT_TTL)
+    pipe.execute()
+    RecoverStaleMessages(redisConnexion, queueName)
+
+    threading.Thread(
+        target = _heartbeat,
+        args = (redisConnexion, queueName, workerIds, stopEvent),
+        name = f"{queueName}-heartbeat",
+        daemon = True
+    ).start()
+
+    for workerId in workerIds:
+        worker = threading.Thread(
+            target = _consume,
+            args = (redisConnexion, queueName, workerId, handler, stopEvent, blockTimeout),
+            name = f"{queueName}-consumer-{workerId}",
+            daemon = True
+        )
+        worker.start()
+    return stopEvent
@@ -0,0 +1,210 @@
+import contextvars
+import functools
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Set to 0 to always query the AI
+CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "1") == "1"
+# Maximum number of responses kept in memory, the least recently used ones are dropped
+CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+# Time (in seconds) during which a cached response is reused
+CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+# Set to 1 to share the cached responses between the processes of an agent through Redis
+REDIS_TIER = os.getenv("RESPONSE_CACHE_REDIS", "0") == "1"
+# Tools whose calls are replayed on a cache hit. A turn calling any other tool (e.g. a payment) is never cached.
+REPLAYABLE_TOOLS = ("SendMessage",)
+
+# Tools called during the current turn, recorded for the thread or asyncio task querying the AI
+_calls = contextvars.ContextVar('toolCalls', default = None)
+
+
+def NormalizePrompt(prompt):
+    """
+    NormalizePrompt
+    ---------------
+    Returns the prompt used in the cache key: spaces collapsed, case and final punctuation ignored.
+    """
+    return re.sub(r"\s+", " ", prompt).strip().rstrip("?!. ").casefold()
+
+
+def StartRecording():
+    """
+    StartRecording
+    --------------
+    Starts recording the tools called by the AI in the current thread or asyncio task, and returns the list of the recorded calls.
+    """
+    calls = []
+    _calls.set(calls)
+    return calls
+
+
+def StopRecording():
+    """
+    StopRecording
+    -------------
+    Stops recording the tools called in the current thread or asyncio task.
+    """
+    _calls.set(None)
+
+
+def RecordCall(name, arguments):
+    """
+    RecordCall
+    ----------
+    Records a tool call of the current turn, if the turn is being recorded.
+    """
+    calls = _calls.get()
+    if calls is not None:
+        calls.append({'name': name, 'arguments': arguments})
+
+
+def Recorded(functionMap):
+    """
+    Recorded
+    --------
+    Returns the functions of a function map wrapped so their calls are recorded, see `RecordCall`.
+    """
+    def wrap(name, function):
+        @functools.wraps(function)
+        def recorded(**arguments):
+            RecordCall(name, arguments)
+            return function(**arguments)
+        return recorded
+    return {name: wrap(name, function) for name, function in functionMap.items()}
+
+
+class ResponseCache:
+    """
+    ResponseCache
+    -------------
+    Cache of the AI responses, in front of the model call. A response is keyed on the normalized prompt and on the
+    state of the session history (see `HistoryManager.fingerprint`); reminder prompts do not depend on the history.
+    Responses are kept in an in-memory LRU and, optionally, in Redis to be shared between the processes of the agent.
+
+    Only the turns whose tool calls can be replayed are cached: messages sent back to the sender of the prompt.
+    On a hit these messages are sent again and the exchange is noted in the history, so the AI learns it with its next prompt.
+
+    Parameters
+    ----------
+    agentId : str
+        ID of the agent.
+    model : str
+        Model of the assistant.
+    instructions : str
+        Instructions of the assistant, the cached responses are not reused once they change.
+    redisConnexion : redis.Redis, optional
+        Connexion to the Redis server of the shared tier. Defaults to None (in-memory only).
+    maxEntries : int, optional
+        Maximum number of responses kept in memory. Defaults to 1000.
+    ttl : int, optional
+        Time (in seconds) during which a cached response is reused. Defaults to 3600.
+    enabled : bool, optional
+        False to always query the AI. Defaults to True unless RESPONSE_CACHE=0.
+    """
+    def __init__(self, agentId, model, instructions, redisConnexion = None, maxEntries = CACHE_SIZE, ttl = CACHE_TTL, enabled = CACHE_ENABLED):
+        self.namespace = hashlib.sha256(f"{agentId}\n{model}\n{instructions}".encode('utf-8')).hexdigest()[:16]
+        self.redis = redisConnexion
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+        self.enabled = enabled
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'redisHits': 0, 'misses': 0, 'stored': 0, 'uncacheable': 0, 'bypassed': 0}
+
+    def _count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def key(self, prompt, state = None):
+        """
+        Returns the cache key of a prompt sent in a session state. Without state, the response does not depend on the history.
+        """
+        digest = hashlib.sha256(json.dumps([NormalizePrompt(prompt), state]).encode('utf-8')).hexdigest()
+        return f"response_cache:{self.namespace}:{digest}"
+
+    def lookup(self, prompt, history, keep = True, cache = True):
+        """
+        Returns the key of a prompt and its cached entry {'response', 'calls'}, or None on a miss.
+        The key is None when the cache is not used for this call.
+        """
+        if not (self.enabled and cache):
+            self._count('bypassed')
+            return None, None
+        key = self.key(prompt, history.fingerprint() if keep else None)
+        now = time.monotonic()
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is not None and cached[0] > now:
+                self.entries.move_to_end(key)
+                self.counters['hits'] += 1
+                return key, cached[1]
+            self.entries.pop(key, None)
+
+        if self.redis is not None:
+            try:
+                stored = self.redis.get(key)
+            except Exception as e:
+                print(f"Redis connexion error on the response cache: {e}")
+                stored = None
+            if stored is not None:
+                entry = json.loads(stored)
+                self._remember(key, entry)
+                self._count('redisHits')
+                return key, entry
+        self._count('misses')
+        return key, None
+
+    def _remember(self, key, entry):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, entry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last = False)
+
+    def store(self, key, response, calls, sender, keep = True):
+        """
+        Caches the response of a turn, unless it failed or called a tool that cannot be replayed.
+        The responses to reminder prompts (`keep` False) do not depend on the history, they are only cached without tool call.
+        """
+        if key is None:
+            return
+        replayable = all(call['name'] in REPLAYABLE_TOOLS and call['arguments'].get('recipientID') == sender for call in calls)
+        if "Exception:" in response or not replayable or (calls and not keep):
+            self._count('uncacheable')
+            return
+        entry = {'response': response, 'calls': calls}
+        self._remember(key, entry)
+        self._count('stored')
+        if self.redis is not None:
+            try:
+                self.redis.set(key, json.dumps(entry), ex = self.ttl)
+            except Exception as e:
+                print(f"Redis connexion error on the response cache: {e}")
+
+    def hit(self, prompt, entry, history, keep = True):
+        """
+        Notes a cached exchange in the history, so it is sent to the AI with its next prompt, and returns the cached response.
+        """
+        if keep:
+            lines = ["Previous exchange, answered without you:", f"> {prompt}"]
+            lines += [f"< {call['name']} to {call['arguments']['recipientID']}: {call['arguments']['message']}" for call in entry['calls']]
+            lines.append(f"< {entry['response']}")
+            history.note("\n".join(lines))
+        else:
+            history.note(prompt)
+        return entry['response']
+
+    def stats(self):
+        """
+        Returns the hit, miss and store counters and the hit rate.
+        """
+        with self.lock:
+            stats = dict(self.counters, size = len(self.entries), ttl = self.ttl, enabled = self.enabled)
+        lookups = stats['hits'] + stats['redisHits'] + stats['misses']
+        stats['hitRate'] = (stats['hits'] + stats['redisHits']) / lookups if lookups else 0.0
+        return stats
@@ -1,18 +1,30 @@
 from flask import Flask, jsonify
-from autogen import UserProxyAgent
-from autogen.agentchat.contrib.gpt_assistant_agent import GPTAssistantAgent
 import os
 import redis
-from datetime import datetime
-from apscheduler.schedulers.background import BackgroundScheduler
 import atexit
+import QueueManager as QM # reliable blocking-pop consumers of the agent message queue
+import MessageEnvelope as ME
+import ConversationLog as CL # capped Redis streams of the conversation logs
+import SessionManager as SM # one assistant thread per conversation
+import AsyncAgentRuntime as AR # asyncio agent loop, enabled with AGENT_RUNTIME=async
 import InvoiceManager as IM
-app = Flask(__name__)
+import InvoiceWatcher as IW # notifies the agent when an invoice is paid
+import ProtocolDispatcher as PRD # protocol messages handled without querying the AI
+import ResponseCache as RC # cache of the AI responses to repeated prompts
+import AssistantRegistry as RG # assistants reused across restarts
+import StageTimings as ST # durations of the stages of a conversation, collected by the benchmark
+import Metrics as MT # Prometheus metrics, exported by the /metrics route
+import Tracing as TR # trace context carried by the messages, spans exported with TRACE_DIR / TRACE_COLLECTOR_URL
+import AgentDirectory as AD # queue addresses of the agents, undeliverable messages kept in a dead-letter queue
+import LazyInit as LI # resources created on first use or by the warm-up, reported by the /ready route
+PD = LI.LazyImport("PaymentDetector") # detects the payments from the logs of the payment contract, enabled with PAYMENT_DETECTOR=1, imported with web3 on first use
+app = MT.InstrumentFlask(Flask(__name__))
 # Get OpenAI API key from environement variable
 key = os.getenv("OPENAI_API_KEY")
 
 
 ia_ID = "HaikuServiceProvider"
+TR.SetService(ia_ID)
 ia_model = "gpt-4o"
 
 ia_contact_ID = "AssistantAgent"
@@ -30,8 +42,9 @@ Once an agreement is reached, the payment must be made by first sending a custom
 if this information are not provided, ask each of them until you have it all.
 before generating the invoice, if it is not clear, ask the client if the payment reference should be provided or the url for manual payment. 
 you will send the invoice information so the invoice can be paid.
-once payment is supposed to be done, you must check and confirm the status of the invoice using CheckInvoiceStatus tool until the status is indicated as paid. this is your confirmation of payment. 
-once the payment status is indicated as paid, you can respond with a beautiful haiku to end the trade. 
+once payment is supposed to be done, wait for the message of InvoiceWatcher confirming that the invoice is paid. this is your confirmation of payment. InvoiceWatcher is an internal notification service, never send messages to it.
+only if the client insists that the payment is done and no confirmation was received, you can check the status of the invoice once using CheckInvoiceStatus tool.
+once the payment is confirmed as paid, you can respond with a beautiful haiku to end the trade. 
 Remember the conversation history and adjust your strategy accordingly.
 ATTENTION: Do not generate other invoice before the current one is not processed. if the invoice need to be handled differently, use the tool returned information.
 """
@@ -42,7 +55,7 @@ assistant_config = {
         "function": {
             "name": "CheckInvoiceStatus",
             "strict": True,
-            "description": "get the current status of an invoice according to its ID to be passed in input. the function returns a string explaining the current status. when an invoice is paid, the status will be indicated as such. for instant ouput may look like : 'current status of invoice ID 66c0f71820eb9ce52a59d009 is: paid'. an Open status means the invoice is awaiting payment, in this case call the function with a delay to wait for update.",
+            "description": "get the current status of an invoice according to its ID to be passed in input. the function returns a string explaining the current status. when an invoice is paid, the status will be indicated as such. for instant ouput may look like : 'current status of invoice ID 66c0f71820eb9ce52a59d009 is: paid'. an Open status means the invoice is awaiting payment. paid invoices are notified automatically, do not call this function in a loop.",
             "parameters": {
                 "type": "object",
                 "properties": {
@@ -71,7 +84,7 @@ assistant_config = {
                 "properties": {
                     "recipientID": {
                         "type": "string",
-                        "description": "Id or name of the recipient, it is case sensitive so please be carefull otherwise it will not work."
+                        "description": "ID of the recipient. If the recipient is unknown, the message is not sent and the known IDs are returned."
                     },
                     "message": {
                         "type": "string",
@@ -139,64 +152,176 @@ def SendMessage(recipientID, message):
     """
     SendMessage
     -----------
-    Sends a message asynchronously to another entity by pushing it into the corresponding Redis message queue.
+    Sends a message asynchronously to another agent by pushing it into its Redis message queue, found in the agent directory.
+    A message to an unknown agent goes to the dead-letter queue and the error is returned at once to the AI.
 
     Parameters
     ----------
     recipientID : str
-        The ID or name of the recipient. Be careful with letter casing as IDs are case-sensitive.
+        The ID of the recipient, resolved in the agent directory regardless of its letter casing.
     message : str
         The message to be transmitted to the recipient.
 
     Returns
     -------
     str
-        A confirmation string indicating that the message was successfully sent.
+        A confirmation string, or an error listing the known agents if the recipient is unknown.
     """
-    r.lpush(f'{recipientID}_queue', f"From {ia_ID} : "+ message)
+    entry = AD.Deliver(r, recipientID, ME.PackMessage(ia_ID, message, SM.CurrentConversation()))
+    if entry is None:
+        log_to_redis(ia_ID, f"undeliverable message to {recipientID} : {message}")
+        return AD.DeliveryReport(recipientID, None, AD.KnownAgents(r))
     # logs 
-    log_to_redis(ia_ID,f"to {recipientID} : {message}")
-    return f"Message Sent to {recipientID}"
+    log_to_redis(ia_ID, f"to {entry['id']} : {message}")
+    return AD.DeliveryReport(recipientID, entry)
 
 
-# AUTOGEN : AI instantiation - Instance will be created on the OpenAI server. in the current implementation, it is deleted as the program terminates. 
-gpt_assistant = GPTAssistantAgent(
-    name = "Haiku Service Provider",
-    llm_config = {"config_list": [{"model": ia_model,"temperature": 0.7, "api_key": key}]}, 
-    assistant_config = assistant_config,#{"tools": [{"type": "code_interpreter"}]}
-    instructions = context_identity + context_communication +  context_negotiation
-    
-)
+# Function called once an invoice is created, its payment is then watched in the background
+def WatchInvoice(requestId, paymentReference):
+    """
+    WatchInvoice
+    ------------
+    Watches the payment of an invoice created during the current conversation.
+    A notification is pushed in the agent queue once the invoice is paid, the AI does not need to poll its status.
 
+    Parameters
+    ----------
+    requestId : str
+        ID of the created invoice.
+    paymentReference : str
+        Payment reference of the invoice.
 
-# AUTOGEN : Configuration of the UserProxy agent that will interact with the GPTAssistantAgent instance
-user_proxy = UserProxyAgent(
-    name = "user_proxy",
-    code_execution_config = {"use_docker": False},
-    human_input_mode = "NEVER", 
-    max_consecutive_auto_reply = 0 
-   
-)
-# Registering defined functions for the AI Agent
-gpt_assistant.register_function(
-    function_map = {
-        "SendMessage" : SendMessage,
-        "SendInvoice" : IM.GenerateAndSendInvoice,
-        "CheckInvoiceStatus" :IM.CheckInvoiceStatus
-    }
-)
+    Returns
+    -------
+    None
+    """
+    IW.WatchInvoice(r, requestId, ia_ID, SM.CurrentConversation(), SM.CurrentSender(), paymentReference)
+
+
+def SendProtocolMessage(recipientID, messageType, payload, message):
+    """
+    SendProtocolMessage
+    -------------------
+    Sends a protocol message of the current conversation to another entity, see `ME.PackMessage`. As with `SendMessage`,
+    the recipient is resolved in the agent directory, and a message to an unknown agent goes to the dead-letter queue.
+    """
+    entry = AD.Deliver(r, recipientID, ME.PackMessage(ia_ID, message, SM.CurrentConversation(), messageType, payload))
+    if entry is None:
+        log_to_redis(ia_ID, f"undeliverable message to {recipientID} : {message}")
+        return
+    log_to_redis(ia_ID, f"to {entry['id']} : {message}")
+
+
+def InvoiceIssued(requestId, paymentReference, currency, price):
+    """
+    InvoiceIssued
+    -------------
+    Returns the payload and the readable message of the protocol message sending an invoice to the client.
+    """
+    payload = {'invoiceId': requestId, 'paymentReference': paymentReference, 'paymentAddress': IM.paymentReceiverAddress,
+               'amount': price, 'currency': currency}
+    message = f"Invoice ID {requestId} issued: please pay {price} {currency} to the address {IM.paymentReceiverAddress} with the payment reference {paymentReference}."
+    return payload, message
+
+
+# Function / tool used by the AI to create an invoice
+def SendInvoice(clientInfo_Email, clientInfo_identity_address, currency, price, serviceName, autoPayment):
+    """
+    SendInvoice
+    -----------
+    Creates an invoice with `IM.GenerateAndSendInvoice` and watches its payment. For an autonomous payment, the invoice
+    is also sent to the client as a protocol message, which the client can pay without querying its AI.
+
+    Returns
+    -------
+    str
+        The message of `IM.GenerateAndSendInvoice`.
+    """
+    def onCreated(requestId, paymentReference):
+        WatchInvoice(requestId, paymentReference)
+        if autoPayment and SM.CurrentSender() is not None:
+            payload, message = InvoiceIssued(requestId, paymentReference, currency, price)
+            SendProtocolMessage(SM.CurrentSender(), ME.INVOICE_ISSUED, payload, message)
+    return IM.GenerateAndSendInvoice(clientInfo_Email, clientInfo_identity_address, currency, price, serviceName, autoPayment,
+                                     onCreated = onCreated, callbackQueue = f'{ia_ID}_queue')
 
 
 # Initialize Redis connexion to access message channels 
-r  =  redis.Redis(host='localhost', port = 6379, db = 0)
+r  =  redis.Redis(host='localhost', port = 6379, db = int(os.getenv("REDIS_DB", "0")))
+# depth and age of the oldest message of the agent queue, read when the metrics are exported
+MT.WatchQueue(r, f'{ia_ID}_queue')
+
+# AUTOGEN : AI instantiation - Instance is created on the OpenAI server and registered in Redis, it is reused by the next starts of the agent.
+# It is created on first use, or by the warm-up started with the agent, not when the module is imported.
+llm_config = {"config_list": [{"model": ia_model,"temperature": 0.7, "api_key": key}]}
+instructions = context_identity + context_communication +  context_negotiation
+gpt_assistant = LI.Resource("assistant", lambda: RG.GetAssistant(r, "Haiku Service Provider", llm_config, instructions, assistant_config))
+
+# Functions that can be called by the AI Agent
+# their calls are recorded to replay the cached responses, see `ResponseCache`, timed and traced
+function_map = LI.Resource("tools", lambda: RC.Recorded(MT.TimedTools(TR.TracedTools({
+    "SendMessage" : SendMessage,
+    "SendInvoice" : SendInvoice,
+    "CheckInvoiceStatus" :IM.CheckInvoiceStatus
+}))))
+
+
+def CreateSession(conversationId):
+    """
+    CreateSession
+    -------------
+    Creates the agents handling a single conversation. The session reuses the assistant created on the OpenAI server
+    and gets its own conversation thread.
+
+    Parameters
+    ----------
+    conversationId : str
+        ID of the conversation handled by the session.
+
+    Returns
+    -------
+    SM.AgentSession
+        The session with its GPTAssistantAgent and UserProxyAgent.
+    """
+    # imported on first use, autogen takes seconds to import
+    from autogen import UserProxyAgent
+    from autogen.agentchat.contrib.gpt_assistant_agent import GPTAssistantAgent
+    assistant = GPTAssistantAgent(
+        name = "Haiku Service Provider",
+        llm_config = llm_config,
+        assistant_config = {**assistant_config, "assistant_id": gpt_assistant.get().assistant_id},
+        instructions = instructions,
+    )
+    # Registering defined functions for the AI Agent
+    assistant.register_function(function_map = function_map.get())
+
+    # AUTOGEN : Configuration of the UserProxy agent that will interact with the GPTAssistantAgent instance
+    user_proxy = UserProxyAgent(
+        name = "user_proxy",
+        code_execution_config = {"use_docker": False},
+        human_input_mode = "NEVER", 
+        max_consecutive_auto_reply = 0 
+    )
+    return SM.AgentSession(conversationId, assistant, user_proxy, cache = responseCache, tools = function_map.get())
+
+
+# Sessions are created on the first message of a conversation and evicted when idle or in excess
+sessions = SM.SessionManager(
+    CreateSession,
+    maxSessions = int(os.getenv("AGENT_MAX_SESSIONS", "100")),
+    idleTTL = float(os.getenv("AGENT_SESSION_TTL", "1800")),
+    warmSessions = int(os.getenv("AGENT_WARM_SESSIONS", "2"))
+)
+
+
+# Cache of the AI responses to repeated prompts, shared between the processes of the agent with RESPONSE_CACHE_REDIS=1
+responseCache = RC.ResponseCache(ia_ID, ia_model, instructions, r if RC.REDIS_TIER else None)
 # Log message to build a conversation history and monitor it on a web interface 
 def log_to_redis(agent, message):
-    timestamp = datetime.now().isoformat()
-    log_entry = {'timestamp': timestamp, 'agent': agent, 'message': message}
-    r.lpush('conversation_logs', str(log_entry))
+    CL.AppendLog(r, agent, message, SM.CurrentConversation())
 
 # Main function to send a prompt to the AI and get the generated response
-def query_openai(prompt):
+def query_openai(prompt, session, keep = True, cache = True):
     """
     query_openai
     ------------
@@ -206,19 +331,23 @@ def query_openai(prompt):
     ----------
     prompt : str
         The message or prompt to send to the AI assistant.
+    session : SM.AgentSession
+        The session of the conversation the prompt belongs to.
+    keep : bool, optional
+        False for reminder prompts, which are not kept in the summary when the history is compacted.
+    cache : bool, optional
+        False to always query the AI instead of reusing a cached response.
 
     Returns
     -------
     str
         The AI-generated response text, stripped of leading/trailing spaces.
     """     
-    response = user_proxy.initiate_chat(gpt_assistant, message = prompt, clear_history = False)
-    chat_history = response.chat_history[-1]['content']
-    return chat_history.strip()
+    return session.ask(prompt, keep, cache)
 
 # processing logic for response and action based on AI generated text
 # check for exception in case of failure to generate response from OpenAI Api
-def MessageProcessing(messageFromAItoProcess):
+def MessageProcessing(messageFromAItoProcess, session):
     """
     MessageProcessing
     -----------------
@@ -228,6 +357,8 @@ def MessageProcessing(messageFromAItoProcess):
     ----------
     messageFromAItoProcess : str
         The message generated by the AI assistant to be processed.
+    session : SM.AgentSession
+        The session of the conversation the message belongs to.
 
     Returns
     -------
@@ -235,53 +366,318 @@ def MessageProcessing(messageFromAItoProcess):
     """ 
        
     if (len(messageFromAItoProcess)>=2) and 'Internal Message'.lower() not in messageFromAItoProcess.lower():
-        query_openai("if this message is meant to be sent to another AI, use the SendMessage tool and check that the case sensitive AI ID is correct, else start your sentence with 'Internal Message: '.  please remember this information and send the message again if required")
+        query_openai("if this message is meant to be sent to another AI, use the SendMessage tool and check that the case sensitive AI ID is correct, else start your sentence with 'Internal Message: '.  please remember this information and send the message again if required", session, keep = False)
     return 
 
-#%% In this section : Scheduler and function to get new message from REDIS        
+#%% In this section : awaitable tools and processing used by the asyncio runtime
+async def SendMessageAsync(recipientID, message):
+    """
+    SendMessageAsync
+    ----------------
+    Awaitable version of `SendMessage`, used by the asyncio runtime.
+
+    Parameters
+    ----------
+    recipientID : str
+        The ID of the recipient, resolved in the agent directory regardless of its letter casing.
+    message : str
+        The message to be transmitted to the recipient.
+
+    Returns
+    -------
+    str
+        A confirmation string, or an error listing the known agents if the recipient is unknown.
+    """
+    entry = await AD.DeliverAsync(runtime.redis, recipientID, ME.PackMessage(ia_ID, message, SM.CurrentConversation()))
+    if entry is None:
+        await runtime.log(ia_ID, f"undeliverable message to {recipientID} : {message}")
+        return AD.DeliveryReport(recipientID, None, await AD.KnownAgentsAsync(runtime.redis))
+    await runtime.log(ia_ID, f"to {entry['id']} : {message}")
+    return AD.DeliveryReport(recipientID, entry)
+
+
+async def WatchInvoiceAsync(requestId, paymentReference):
+    """
+    WatchInvoiceAsync
+    -----------------
+    Awaitable version of `WatchInvoice`, used by the asyncio runtime.
+    """
+    watch = IW.WatchEntry(ia_ID, SM.CurrentConversation(), SM.CurrentSender(), paymentReference)
+    await runtime.redis.hset(IW.WATCHED_KEY, requestId, watch)
+    if PD.DETECTOR_ENABLED and paymentReference:
+        await PD.WatchReferenceAsync(runtime.redis, paymentReference)
+
+
+async def SendInvoiceAsync(clientInfo_Email, clientInfo_identity_address, currency, price, serviceName, autoPayment):
+    """
+    SendInvoiceAsync
+    ----------------
+    Awaitable version of `SendInvoice`, used by the asyncio runtime.
+    """
+    async def onCreated(requestId, paymentReference):
+        await WatchInvoiceAsync(requestId, paymentReference)
+        if autoPayment and SM.CurrentSender() is not None:
+            payload, message = InvoiceIssued(requestId, paymentReference, currency, price)
+            entry = await AD.DeliverAsync(runtime.redis, SM.CurrentSender(), ME.PackMessage(ia_ID, message, SM.CurrentConversation(), ME.INVOICE_ISSUED, payload))
+            if entry is None:
+                await runtime.log(ia_ID, f"undeliverable message to {SM.CurrentSender()} : {message}")
+                return
+            await runtime.log(ia_ID, f"to {entry['id']} : {message}")
+    return await IM.GenerateAndSendInvoiceAsync(clientInfo_Email, clientInfo_identity_address, currency, price, serviceName, autoPayment,
+                                                onCreated = onCreated, callbackQueue = f'{ia_ID}_queue')
+
+
+async def MessageProcessingAsync(runtime, session, messageFromAItoProcess):
+    """
+    MessageProcessingAsync
+    ----------------------
+    Awaitable version of `MessageProcessing`, used by the asyncio runtime.
+
+    Parameters
+    ----------
+    runtime : AR.AsyncAgentRuntime
+        The runtime processing the message.
+    session : AR.AsyncSession
+        The session of the conversation the message belongs to.
+    messageFromAItoProcess : str
+        The message generated by the AI assistant to be processed.
+
+    Returns
+    -------
+    None
+    """
+    if (len(messageFromAItoProcess)>=2) and 'Internal Message'.lower() not in messageFromAItoProcess.lower():
+        await runtime.ask("if this message is meant to be sent to another AI, use the SendMessage tool and check that the case sensitive AI ID is correct, else start your sentence with 'Internal Message: '.  please remember this information and send the message again if required", session, keep = False)
+
+
+#%% In this section : protocol messages handled without querying the AI
+def HandleInvoiceConfirmed(envelope, session):
+    """
+    HandleInvoiceConfirmed
+    ----------------------
+    Confirmation of an invoice created asynchronously, nothing to do for the AI.
+    """
+    log_to_redis(ia_ID, f"Internal Message: {envelope['message']}")
+    return True
+
+
+def HandlePaymentSent(envelope, session):
+    """
+    HandlePaymentSent
+    -----------------
+    Payment of an invoice performed automatically by the client. A confirmed transaction only needs the confirmation
+    of the InvoiceWatcher, the AI is informed with a note sent with its next prompt. A failed payment is handled by the AI.
+    """
+    payment = envelope['payload']
+    if payment.get('result') != "transaction is confirmed":
+        return False
+    log_to_redis(ia_ID, f"Internal Message: {envelope['message']}")
+    session.history.note(f"Internal note: {envelope['sender']} paid the invoice ID {payment['invoiceId']} with payment reference: {payment['paymentReference']}. "
+                         f"Wait for the confirmation of InvoiceWatcher before delivering the service.")
+    return True
+
+
+dispatcher = PRD.ProtocolDispatcher()
+dispatcher.register(ME.INVOICE_CONFIRMED, HandleInvoiceConfirmed)
+dispatcher.register(ME.PAYMENT_SENT, HandlePaymentSent)
+
+
+#%% In this section : Consumers and function to get new message from REDIS
+def HandleMessage(newMessage):
+    """
+    HandleMessage
+    -------------
+    Processes a message received from the Redis queue by querying the AI assistant and handling its response.
+
+    Parameters
+    ----------
+    newMessage : str
+        The decoded message popped from the agent queue.
+
+    Returns
+    -------
+    None
+    """
+    print("new message received")
+    print(newMessage)
+    envelope = ME.UnpackMessage(newMessage)
+    ST.RecordQueueWait(envelope)
+    session = sessions.get(envelope['conversationId'])
+    # turns of a conversation are processed in order, other conversations are processed in parallel by the other workers
+    # the handling continues the trace of the sender
+    with TR.MessageSpan(ia_ID, envelope), session.lock:
+        SM.SetCurrentConversation(envelope['conversationId'], envelope['sender'])
+        if dispatcher.dispatch(envelope, session):
+            # routine protocol step, handled without querying the AI
+            return
+        # response
+        response_text = query_openai(ME.FormatPrompt(envelope), session)
+        MessageProcessing(response_text, session)
+
+
 @app.route('/poll', methods = ['GET'])
 def poll_responses():
     """
     poll_responses
     --------------
-    Polls the Redis queue for new messages and processes any received messages by querying the AI assistant.
+    Manual fallback to the queue consumers: processes one message from the Redis queue, if any.
 
     Returns
     -------
     Response : Flask Response object
         A JSON object indicating whether a message was processed or if no new messages were found.
-    """    
-     
-    if r.llen(f'{ia_ID}_queue') > 0:
-        # new message receiveded
-        print("new message received")
-        newMessage = r.rpop(f'{ia_ID}_queue').decode('utf-8')
-        print(newMessage)
-        # response
-        response_text = query_openai(newMessage)
-        MessageProcessing(response_text)
+    """
+    if QM.ProcessOne(r, f'{ia_ID}_queue', HandleMessage):
+        # response is handled through function calls
         return jsonify({'response': "Message processed"})
-    
+
     return jsonify({'response': "No new messages"})
 
-    
-def poll():
+
+@app.route('/queue', methods = ['GET'])
+def queue_stats():
     """
-    poll
-    ----
-    Periodically polls the Redis queue for new messages by calling the `poll_responses` function.
+    queue_stats
+    -----------
+    Returns the number of waiting and in-flight messages of the agent queue.
 
     Returns
     -------
-    None
+    Response : Flask Response object
+        A JSON object with the queue depth, the in-flight count and the number of registered workers.
+    """
+    return jsonify(QM.QueueStats(r, f'{ia_ID}_queue'))
+
+
+@app.route('/sessions', methods = ['GET'])
+def sessions_stats():
+    """
+    sessions_stats
+    --------------
+    Returns the number of open, created and evicted conversation sessions, and the tokens saved by history compaction per conversation.
+
+    Returns
+    -------
+    Response : Flask Response object
+        A JSON object with the session counters.
+    """
+    return jsonify(runtime.stats() if runtime is not None else sessions.stats())
+
+
+@app.route('/cache', methods = ['GET'])
+def cache_stats():
+    """
+    cache_stats
+    -----------
+    Returns the hit, miss and store counters of the cache of the AI responses.
+
+    Returns
+    -------
+    Response : Flask Response object
+        A JSON object with the cache counters and the hit rate.
+    """
+    return jsonify(responseCache.stats())
+
+
+@app.route('/invoice-api/metrics', methods = ['GET'])
+def invoice_api_metrics():
+    """
+    invoice_api_metrics
+    -------------------
+    Returns the latency of the calls to the invoice API, per endpoint.
+
+    Returns
+    -------
+    Response : Flask Response object
+        A JSON object with the call count, error count, average and maximum latency of each endpoint.
+    """
+    return jsonify(IM.GetApiMetrics())
+
+
+@app.route('/ready', methods = ['GET'])
+def ready():
     """
+    ready
+    -----
+    Readiness probe: tells if the agent has created its resources (assistant, tools, consumers...) and reaches Redis.
 
-    with app.app_context():
-        poll_responses()
+    Returns
+    -------
+    Response : Flask Response object
+        A JSON object with the status of each resource, with the status code 200 if the agent is ready, 503 otherwise.
+    """
+    status = LI.Readiness(r)
+    return jsonify(status), 200 if status['ready'] else 503
+
+
+# Number of consumer threads blocked on the agent queue, they wake up as soon as a message is pushed
+workers = int(os.getenv("AGENT_WORKERS", "4"))
+runtime = None
+heartbeat = None
 
-scheduler = BackgroundScheduler()
-scheduler.add_job(poll, 'interval', seconds = 3)  # Poll every 1 seconds
-scheduler.start()
+
+def StartAsyncRuntime():
+    """
+    StartAsyncRuntime
+    -----------------
+    Creates and starts the asyncio runtime: the LLM runs and the tools are awaited, no thread is held while waiting.
+
+    Returns
+    -------
+    threading.Thread
+        The thread running the event loop of the runtime.
+    """
+    global runtime
+    runtime = AR.AsyncAgentRuntime(
+        ia_ID,
+        gpt_assistant.get().assistant_id,
+        MT.TimedTools(TR.TracedTools({
+            "SendMessage" : SendMessageAsync,
+            "SendInvoice" : SendInvoiceAsync,
+            "CheckInvoiceStatus" : IM.CheckInvoiceStatusAsync
+        })),
+        MessageProcessingAsync,
+        apiKey = key,
+        concurrency = int(os.getenv("AGENT_ASYNC_CONCURRENCY", "1000")),
+        maxSessions = int(os.getenv("AGENT_MAX_SESSIONS", "10000")),
+        idleTTL = float(os.getenv("AGENT_SESSION_TTL", "1800")),
+        redisUrl = f"redis://localhost:6379/{os.getenv('REDIS_DB', '0')}",
+        dispatcher = dispatcher,
+        cache = responseCache,
+        warmThreads = int(os.getenv("AGENT_WARM_SESSIONS", "2"))
+    )
+    return AR.StartInBackground(runtime)
+
+
+def Start():
+    """
+    Start
+    -----
+    Starts the agent: registers it in the agent directory, and creates its resources then starts the consumers of its
+    queue in the background, so the Flask application answers at once. Nothing is started when the module is only imported.
+
+    Returns
+    -------
+    None
+    """
+    global heartbeat, consumers, warmer, watcher, detector
+    # the queue of the agent is registered in the agent directory while the agent is running
+    heartbeat = AD.Register(r, ia_ID)
+    # Checks the created invoices in the background and notifies the agent when they are paid
+    watcher = IW.StartWatcher(r)
+    # started once PaymentDetector is imported
+    detector = LI.Resource("payment detector", lambda: PD.StartDetector(r) if PD.DETECTOR_ENABLED else None)
+    if os.getenv("AGENT_RUNTIME", "threads") == "async":
+        # the runtime needs the ID of the assistant
+        consumers = LI.Resource("async runtime", StartAsyncRuntime)
+    else:
+        # sessions are created ahead of the first message of a conversation
+        warmer = sessions.prewarm()
+        consumers = LI.Resource("consumers", lambda: QM.StartConsumers(r, f'{ia_ID}_queue', HandleMessage, workers = workers))
+    # the messages wait in the queue until the consumers are started, once the assistant is created
+    LI.WarmUp([gpt_assistant, function_map, consumers, detector])
+    # Registering the assistant deletion function at exit.
+    atexit.register(delete_assistant)
 #%%
 
 # Function to delete assistant from the OpenAI Server   
@@ -289,19 +685,22 @@ def delete_assistant():
     """
     delete_assistant
     ----------------
-    Deletes the GPTAssistantAgent instance from the OpenAI server when the program terminates.
+    Deletes the conversation threads from the OpenAI server when the program terminates, and marks the agent offline
+    in the agent directory. The GPTAssistantAgent instance is kept for the next start, unless ASSISTANT_DELETE_ON_EXIT=1.
 
     Returns
     -------
     None
     """
-    if gpt_assistant is not None:
-        gpt_assistant.delete_assistant()
+    AD.Unregister(r, ia_ID, heartbeat)
+    sessions.close_all()
+    # an assistant not created yet is not created to be deleted
+    if gpt_assistant.ready and RG.DELETE_ON_EXIT:
+        RG.DeleteAssistant(r, gpt_assistant.get(), llm_config, instructions, assistant_config)
         print("Assistant deleted.")
 
-# Registering the assistant deletion function at exit.
-atexit.register(delete_assistant)
 
 if __name__ == '__main__':
+    Start()
     app.run(port = 5001)
     #
\ No newline at end of file
@@ -0,0 +1,309 @@
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from MessageEnvelope import DEFAULT_CONVERSATION
+import HistoryManager as HM
+import Metrics as MT
+import ResponseCache as RC
+import StageTimings as ST
+import Tracing as TR
+
+# Conversation handled by the current thread or asyncio task, used by the tools (e.g. SendMessage) called during an AI turn
+_current = contextvars.ContextVar('conversationId', default = DEFAULT_CONVERSATION)
+# Sender of the message being processed
+_sender = contextvars.ContextVar('sender', default = None)
+
+
+def SetCurrentConversation(conversationId, sender = None):
+    """
+    SetCurrentConversation
+    ----------------------
+    Sets the conversation handled by the current thread or asyncio task, and the sender of the message being processed.
+
+    Parameters
+    ----------
+    conversationId : str
+        ID of the conversation.
+    sender : str, optional
+        ID of the sender of the message.
+
+    Returns
+    -------
+    None
+    """
+    _current.set(conversationId)
+    _sender.set(sender)
+
+
+def CurrentConversation():
+    """
+    CurrentConversation
+    -------------------
+    Returns the conversation handled by the current thread or asyncio task, or the default conversation.
+
+    Returns
+    -------
+    str
+        ID of the conversation.
+    """
+    return _current.get()
+
+
+def CurrentSender():
+    """
+    CurrentSender
+    -------------
+    Returns the sender of the message processed by the current thread or asyncio task, None if unknown.
+
+    Returns
+    -------
+    str or None
+        ID of the sender.
+    """
+    return _sender.get()
+
+
+class AgentSession:
+    """
+    AgentSession
+    ------------
+    Assistant / user proxy pair dedicated to a single conversation. The assistant keeps its own OpenAI thread,
+    so the history of a negotiation never bleeds into another one.
+
+    Parameters
+    ----------
+    conversationId : str
+        ID of the conversation handled by the session.
+    assistant : GPTAssistantAgent
+        Assistant agent of the session.
+    proxy : UserProxyAgent
+        User proxy agent initiating the chats with the assistant.
+    cache : ResponseCache, optional
+        Cache of the AI responses, shared by the sessions of the agent. Defaults to None.
+    tools : dict, optional
+        Functions of the assistant by name, used to replay the tool calls of the cached responses.
+    """
+    def __init__(self, conversationId, assistant, proxy, cache = None, tools = None):
+        self.conversationId = conversationId
+        self.assistant = assistant
+        self.proxy = proxy
+        self.cache = cache
+        self.tools = tools or {}
+        # turns of a conversation are processed one at a time
+        self.lock = threading.Lock()
+        self.lastUsed = time.monotonic()
+        self.history = HM.HistoryManager()
+
+    @TR.Traced("query_openai")
+    def ask(self, prompt, keep = True, cache = True):
+        """
+        Sends a prompt to the assistant of the session and returns the generated response, stripped of leading/trailing spaces.
+        The history is compacted first when it exceeds its token budget. Reminder prompts are sent with `keep` False.
+        The response is read from the response cache when possible, unless `cache` is False.
+        """
+        start = time.perf_counter()
+        key = None
+        if self.cache is not None:
+            key, entry = self.cache.lookup(prompt, self.history, keep, cache)
+            if entry is not None:
+                for call in entry['calls']:
+                    self.tools[call['name']](**call['arguments'])
+                text = self.cache.hit(prompt, entry, self.history, keep)
+                TR.SetAttributes(cached = True)
+                MT.QUERY_SECONDS.observe(time.perf_counter() - start, cached = "true")
+                return text
+
+        if self.history.needs_compaction():
+            self.compact()
+        # the run reads the whole thread (the pending summary and notes are already counted), autogen does not report its usage
+        promptTokens = self.history.historyTokens + HM.CountTokens(prompt)
+        message = self.history.prepare(prompt)
+        calls = RC.StartRecording()
+        try:
+            # the time spent in the tools is recorded in their own stages
+            with ST.Stage(ST.LLM_CALL):
+                response = self.proxy.initiate_chat(self.assistant, message = message, clear_history = False)
+        finally:
+            RC.StopRecording()
+        text = response.chat_history[-1]['content'].strip()
+        MT.RecordTokens(promptTokens, HM.CountTokens(text))
+        self.history.record(prompt, text, keep)
+        if key is not None:
+            self.cache.store(key, text, calls, CurrentSender(), keep)
+        MT.QUERY_SECONDS.observe(time.perf_counter() - start, cached = "false")
+        return text
+
+    def compact(self):
+        """
+        Replaces the conversation thread by a summary of the history, sent with the next prompt.
+        """
+        self.history.compact()
+        # the next turn starts a new OpenAI thread
+        self.assistant.reset()
+        self.proxy.reset()
+        print(f"History of conversation {self.conversationId} compacted: {self.history.stats()}")
+
+    def close(self):
+        """
+        Deletes the OpenAI threads of the session. The assistant itself is shared and kept.
+        """
+        self.assistant.reset()
+
+
+class SessionManager:
+    """
+    SessionManager
+    --------------
+    Lazily creates and caches one `AgentSession` per conversation ID. Sessions are evicted when they are idle
+    for more than `idleTTL` seconds, or in least recently used order when more than `maxSessions` are open.
+
+    Parameters
+    ----------
+    sessionFactory : callable
+        Function called with a conversation ID and returning a new `AgentSession`.
+    maxSessions : int, optional
+        Maximum number of sessions kept open. Defaults to 100.
+    idleTTL : float, optional
+        Time (in seconds) after which an idle session is evicted. Defaults to 1800.
+    warmSessions : int, optional
+        Number of sessions created ahead of the conversations by `prewarm`, so a new conversation does not wait
+        for the creation of its agents. Defaults to 0.
+    """
+    def __init__(self, sessionFactory, maxSessions = 100, idleTTL = 1800, warmSessions = 0):
+        self.sessionFactory = sessionFactory
+        self.maxSessions = maxSessions
+        self.idleTTL = idleTTL
+        self.warmSessions = warmSessions
+        self.sessions = OrderedDict()
+        # sessions created ahead, not yet bound to a conversation
+        self.warm = []
+        self.refill = threading.Event()
+        self.lock = threading.Lock()
+        self.created = 0
+        self.evicted = 0
+        self.warmHits = 0
+        # tokens saved by the compaction of the closed sessions
+        self.tokensSaved = 0
+
+    def get(self, conversationId):
+        """
+        Returns the session of a conversation, creating it if needed.
+        """
+        with self.lock:
+            session = self.sessions.get(conversationId)
+            if session is not None:
+                self.sessions.move_to_end(conversationId)
+                session.lastUsed = time.monotonic()
+            evictedSessions = self._evict()
+
+        self._close(evictedSessions)
+        if session is not None:
+            return session
+
+        # the remote session is created outside of the lock, it may take some time
+        session = self._take(conversationId)
+        with self.lock:
+            existing = self.sessions.get(conversationId)
+            if existing is None:
+                self.sessions[conversationId] = session
+                self.created += 1
+            evictedSessions = self._evict()
+        if existing is not None:
+            # created concurrently by another worker
+            evictedSessions.append(session)
+            session = existing
+        self._close(evictedSessions)
+        return session
+
+    def _take(self, conversationId):
+        """
+        Returns a session for a new conversation, taken from the warm sessions when possible.
+        """
+        with self.lock:
+            session = self.warm.pop() if self.warm else None
+            if session is not None:
+                self.warmHits += 1
+        if session is None:
+            return self.sessionFactory(conversationId)
+        session.conversationId = conversationId
+        session.lastUsed = time.monotonic()
+        self.refill.set()
+        return session
+
+    def prewarm(self, retryDelay = 5):
+        """
+        Starts a daemon thread keeping `warmSessions` sessions created ahead of the conversations.
+
+        Returns
+        -------
+        threading.Event
+            Set it to stop the thread.
+        """
+        stop = threading.Event()
+
+        def fill():
+            while not stop.is_set():
+                self.refill.clear()
+                while len(self.warm) < self.warmSessions and not stop.is_set():
+                    try:
+                        session = self.sessionFactory(None)
+                    except Exception as e:
+                        print(f"Error while creating a warm session: {e}")
+                        stop.wait(retryDelay)
+                        continue
+                    with self.lock:
+                        self.warm.append(session)
+                self.refill.wait(timeout = retryDelay)
+
+        if self.warmSessions > 0:
+            threading.Thread(target = fill, name = "warm-sessions", daemon = True).start()
+        return stop
+
+    def _evict(self):
+        """
+        Removes the idle and exceeding sessions, in least recently used order. Must be called with the lock held.
+        Returns the removed sessions, to be closed outside of the lock.
+        """
+        evictedSessions = []
+        now = time.monotonic()
+        while self.sessions:
+            conversationId, oldest = next(iter(self.sessions.items()))
+            if len(self.sessions) <= self.maxSessions and now - oldest.lastUsed < self.idleTTL:
+                break
+            del self.sessions[conversationId]
+            self.tokensSaved += oldest.history.tokensSaved
+            evictedSessions.append(oldest)
+        self.evicted += len(evictedSessions)
+        return evictedSessions
+
+    def _close(self, sessions):
+        for session in sessions:
+            # wait for a turn in progress before deleting the threads
+            with session.lock:
+                try:
+                    session.close()
+                except Exception as e:
+                    print(f"Error while closing session {session.conversationId}: {e}")
+
+    def close_all(self):
+        """
+        Closes all the open sessions.
+        """
+        with self.lock:
+            sessions = list(self.sessions.values()) + self.warm
+            self.sessions.clear()
+            self.warm = []
+        self._close(sessions)
+
+    def stats(self):
+        """
+        Returns the number of open, created, evicted and warm sessions, the tokens saved by history compaction
+        and the history statistics of each open conversation.
+        """
+        with self.lock:
+            history = {conversationId: session.history.stats() for conversationId, session in self.sessions.items()}
+            return {'open': len(self.sessions), 'created': self.created, 'evicted': self.evicted,
+                    'maxSessions': self.maxSessions, 'idleTTL': self.idleTTL, 'warm': len(self.warm), 'warmHits': self.warmHits,
+                    'tokensSaved': self.tokensSaved + sum(stats['tokensSaved'] for stats in history.values()),
+                    'history': history}
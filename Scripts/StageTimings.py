@@ -0,0 +1,135 @@
+import asyncio
+import collections
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import redis
+import Metrics as MT
+import Tracing as TR
+
+# Redis list collecting the stage durations of all the processes, e.g. by the benchmark. Durations are only exported
+# by the /metrics route of the process when unset.
+TIMINGS_KEY = os.getenv("STAGE_TIMINGS_KEY")
+# Time (in seconds) between two flushes of the recorded durations to Redis
+FLUSH_INTERVAL = 0.5
+
+# Stages of a conversation turn
+QUEUE_WAIT = "queue_wait"
+LLM_CALL = "llm_call"
+INVOICE_CREATE = "invoice_create"
+STATUS_CHECK = "status_check"
+PAYMENT = "payment"
+
+# Time spent in the stages nested in the current stage, which is not counted in its own duration
+_nested = contextvars.ContextVar('nestedStages', default = None)
+_buffer = collections.deque()
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def _flush(redisConnexion):
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        items = []
+        while _buffer:
+            items.append(_buffer.popleft())
+        if not items:
+            continue
+        try:
+            redisConnexion.rpush(TIMINGS_KEY, *items)
+        except Exception as e:
+            print(f"Redis connexion error on the stage timings: {e}")
+
+
+def Record(stage, seconds):
+    """
+    Record
+    ------
+    Records the duration of a stage in the `agent_stage_seconds` histogram. Durations are also buffered and pushed
+    to the TIMINGS_KEY list by a background thread, so recording does not wait for Redis.
+    """
+    global _flusher
+    MT.STAGE_SECONDS.observe(seconds, stage = stage)
+    if TIMINGS_KEY is None:
+        return
+    if _flusher is None:
+        with _flusher_lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target = _flush, args = (redis.Redis(host='localhost', port = 6379, db = int(os.getenv("REDIS_DB", "0"))),),
+                                            name = "stage-timings", daemon = True)
+                _flusher.start()
+    _buffer.append(json.dumps([stage, seconds]))
+
+
+class Stage:
+    """
+    Stage
+    -----
+    Context manager timing a stage, also recorded as a span. The time spent in the stages nested in it (e.g. a tool
+    called during an AI turn) is not counted in its duration.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage, e.g. `LLM_CALL`.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.span = TR.Span(self.name).__enter__()
+        self.parent = _nested.get()
+        # intervals of the nested stages, a list so the tool tasks started by an asyncio turn add theirs to the same stage
+        self.nested = []
+        self.token = _nested.set(self.nested)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        _nested.reset(self.token)
+        if self.parent is not None:
+            self.parent.append((self.start, end))
+        # concurrent nested stages overlap, their time is only counted once
+        nestedTime, covered = 0.0, self.start
+        for start, stop in sorted(self.nested):
+            nestedTime += max(0.0, stop - max(start, covered))
+            covered = max(covered, stop)
+        Record(self.name, max(0.0, end - self.start - nestedTime))
+        self.span.__exit__(*exc)
+        return False
+
+
+def Timed(name):
+    """
+    Timed
+    -----
+    Decorator timing the calls of a function, or of a coroutine function, as a stage.
+    """
+    def decorator(function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def timedAsync(*args, **kwargs):
+                with Stage(name):
+                    return await function(*args, **kwargs)
+            return timedAsync
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            with Stage(name):
+                return function(*args, **kwargs)
+        return timed
+    return decorator
+
+
+def RecordQueueWait(envelope):
+    """
+    RecordQueueWait
+    ---------------
+    Records the time a message waited in the agent queue, from the time it was sent.
+    """
+    if 'sentAt' in envelope:
+        Record(QUEUE_WAIT, max(0.0, time.time() - envelope['sentAt']))
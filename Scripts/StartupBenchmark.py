@@ -0,0 +1,134 @@
+"""
+Cold start benchmark of the agents: time to import each agent module, and time from the start of an agent process
+until it answers HTTP requests and until it is ready (its /ready route answering 200), against the local stand-ins
+of BenchmarkStubs.py and a local Redis server. Each measure is taken in `runs` new processes.
+
+The median of each measure is compared with a budget, and the script exits with status 1 if a budget is exceeded,
+so the cold start can be enforced in CI:
+- IMPORT_BUDGET_MS (default 1000) for the import of an agent module, which must also start no thread;
+- COLD_START_BUDGET_MS (default 5000) from the start of an agent process to its readiness.
+
+Usage : python StartupBenchmark.py [runs]
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import redis
+import Benchmark as BM
+
+# Budgets (in milliseconds) of the median import time of an agent module and of the median time to be ready
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "1000"))
+COLD_START_BUDGET_MS = float(os.getenv("COLD_START_BUDGET_MS", "5000"))
+# Modules which must not be imported with an agent, they are imported on first use or by the warm-up
+HEAVY_MODULES = ("autogen", "openai", "web3", "walletManager", "PaymentDetector")
+# Time (in seconds) between two probes of the /ready route
+PROBE_INTERVAL = 0.01
+
+IMPORT_CODE = """
+import json, sys, threading, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'seconds': time.perf_counter() - start, 'threads': threading.active_count(),
+                  'heavy': [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def ImportTime(module, env):
+    """
+    Imports an agent module in a new process. Returns {seconds, threads, heavy}.
+    """
+    output = subprocess.run([sys.executable, "-c", IMPORT_CODE.format(module = module, heavy = HEAVY_MODULES)],
+                            cwd = os.path.dirname(os.path.abspath(__file__)), env = env,
+                            capture_output = True, text = True, check = True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def Probe(url):
+    """
+    Returns the status code of a GET request, None if the server does not answer.
+    """
+    try:
+        with urllib.request.urlopen(url, timeout = 1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def ColdStart(script, port, env, logDir, timeout = 60):
+    """
+    Starts an agent process and probes its /ready route. Returns the time (in seconds) until it answered and
+    until it was ready.
+    """
+    url = f"http://localhost:{port}/ready"
+    start = time.perf_counter()
+    process = BM.Start(script, env, logDir)
+    serving = None
+    try:
+        while time.perf_counter() - start < timeout:
+            status = Probe(url)
+            if status is not None and serving is None:
+                serving = time.perf_counter() - start
+            if status == 200:
+                return serving, time.perf_counter() - start
+            if process.poll() is not None:
+                raise RuntimeError(f"{script} exited with status {process.returncode}, see its log in {logDir}")
+            time.sleep(PROBE_INTERVAL)
+        raise TimeoutError(f"{script} was not ready within {timeout} seconds")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def Median(samples):
+    return BM.Percentile(sorted(samples), 50)
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    logDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_logs")
+    os.makedirs(logDir, exist_ok = True)
+
+    r = redis.Redis(host='localhost', port = 6379, db = int(os.getenv("REDIS_DB", "0")))
+    r.ping()
+    timingsKey = f"startup:{os.getpid()}:timings"
+    env = BM.Environment(timingsKey)
+    failures = []
+
+    print(f"{'module':<24}{'import (ms)':>14}{'threads':>10}  heavy modules imported")
+    for script in BM.AGENT_PORTS:
+        module = script.replace(".py", "")
+        results = [ImportTime(module, env) for _ in range(runs)]
+        importTime = Median([result['seconds'] for result in results]) * 1000
+        threads = max(result['threads'] for result in results)
+        heavy = sorted({name for result in results for name in result['heavy']})
+        print(f"{module:<24}{importTime:>14.1f}{threads:>10}  {', '.join(heavy) or '-'}")
+        if importTime > IMPORT_BUDGET_MS:
+            failures.append(f"import of {module}: {importTime:.0f} ms > IMPORT_BUDGET_MS = {IMPORT_BUDGET_MS:.0f} ms")
+        if threads > 1:
+            failures.append(f"import of {module} started {threads - 1} thread(s)")
+
+    stubs = BM.Start("BenchmarkStubs.py", env, logDir, str(BM.STUBS_PORT))
+    try:
+        BM.WaitFor(f"http://localhost:{BM.STUBS_PORT}/stub/stats")
+        print(f"\n{'agent':<24}{'serving (ms)':>14}{'ready (ms)':>14}")
+        for script, port in BM.AGENT_PORTS.items():
+            samples = [ColdStart(script, port, env, logDir) for _ in range(runs)]
+            serving = Median([sample[0] for sample in samples]) * 1000
+            ready = Median([sample[1] for sample in samples]) * 1000
+            print(f"{script.replace('.py', ''):<24}{serving:>14.1f}{ready:>14.1f}")
+            if ready > COLD_START_BUDGET_MS:
+                failures.append(f"cold start of {script}: {ready:.0f} ms > COLD_START_BUDGET_MS = {COLD_START_BUDGET_MS:.0f} ms")
+    finally:
+        stubs.terminate()
+        stubs.wait()
+        r.delete(timingsKey)
+
+    for failure in failures:
+        print(f"Budget exceeded: {failure}")
+    sys.exit(1 if failures else 0)
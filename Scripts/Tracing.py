@@ -0,0 +1,372 @@
+"""
+Trace propagation across the agents, the web interface and the rnapi server. Each queued message carries the W3C
+`traceparent` of the span that sent it (see `MessageEnvelope.PackMessage`), so the handling of the message by the
+recipient continues the same trace; the calls to the rnapi server carry it as an HTTP header, and the log entries
+carry the trace and span IDs. Spans are recorded around the handling of the messages, the AI queries, the stages
+of a conversation (see `StageTimings.Stage`), the tools called by the AI and the calls to the rnapi server.
+
+Finished spans are exported in the background, as JSON lines to a file per process in TRACE_DIR, and / or as OTLP JSON
+to a local collector at TRACE_COLLECTOR_URL (e.g. http://localhost:4318/v1/traces). The IDs are propagated even when
+no export is configured.
+
+Usage : python Tracing.py [traceId]
+    Lists the last traces written in TRACE_DIR, or prints the spans of a trace with its critical path.
+"""
+import asyncio
+import atexit
+import collections
+import contextvars
+import functools
+import glob
+import json
+import os
+import re
+import secrets
+import sys
+import threading
+import time
+import urllib.request
+
+# Directory of the JSON lines files of the finished spans, one file per process. Spans are not written when unset.
+TRACE_DIR = os.getenv("TRACE_DIR")
+# OTLP/HTTP endpoint of a collector receiving the finished spans as JSON. Spans are not sent when unset.
+COLLECTOR_URL = os.getenv("TRACE_COLLECTOR_URL")
+# Name of the service recording the spans, set by the agents with `SetService`
+SERVICE = os.getenv("TRACE_SERVICE_NAME", os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0])
+# Time (in seconds) between two exports of the finished spans
+EXPORT_INTERVAL = 1.0
+# Kinds of span, with their OTLP code
+KINDS = {"internal": 1, "server": 2, "client": 3, "producer": 4, "consumer": 5}
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+# Span of the current thread or asyncio task, the parent of the spans started in it
+_current = contextvars.ContextVar('span', default = None)
+_buffer = collections.deque()
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def SetService(name):
+    """
+    SetService
+    ----------
+    Sets the name of the service recording the spans of the process, e.g. the ID of the agent.
+    """
+    global SERVICE
+    SERVICE = name
+
+
+def ParseTraceparent(value):
+    """
+    ParseTraceparent
+    ----------------
+    Returns the (trace ID, span ID) of a `traceparent` value, or None if it is missing or malformed.
+    """
+    match = TRACEPARENT.match(value.strip().lower()) if isinstance(value, str) else None
+    return (match.group(1), match.group(2)) if match else None
+
+
+def CurrentSpan():
+    """
+    CurrentSpan
+    -----------
+    Returns the span of the current thread or asyncio task, or None.
+    """
+    return _current.get()
+
+
+def Traceparent():
+    """
+    Traceparent
+    -----------
+    Returns the `traceparent` value of the current span, or None outside of any span.
+    """
+    span = _current.get()
+    return span.traceparent if span is not None else None
+
+
+def Headers():
+    """
+    Headers
+    -------
+    Returns the HTTP headers propagating the current span to a called server.
+    """
+    traceparent = Traceparent()
+    return {'traceparent': traceparent} if traceparent is not None else {}
+
+
+def SetAttributes(**attributes):
+    """
+    SetAttributes
+    -------------
+    Adds attributes to the current span, if any.
+    """
+    span = _current.get()
+    if span is not None:
+        span.attributes.update(attributes)
+
+
+class Span:
+    """
+    Span
+    ----
+    Context manager recording a span. The span is the child of `parent`, or of the current span, or starts a new trace.
+
+    Parameters
+    ----------
+    name : str
+        Name of the span, e.g. 'llm_call'.
+    parent : str, optional
+        `traceparent` of the parent span, e.g. read from a queued message or an HTTP header.
+    kind : str, optional
+        Kind of the span, one of `KINDS`. Defaults to 'internal'.
+    attributes : dict, optional
+        Attributes of the span.
+    """
+    def __init__(self, name, parent = None, kind = "internal", attributes = None):
+        self.name = name
+        self.parent = parent
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+
+    @property
+    def traceparent(self):
+        return f"00-{self.traceId}-{self.spanId}-01"
+
+    def __enter__(self):
+        parentIds = ParseTraceparent(self.parent)
+        if parentIds is None and _current.get() is not None:
+            parentIds = (_current.get().traceId, _current.get().spanId)
+        self.traceId, self.parentSpanId = parentIds if parentIds is not None else (secrets.token_hex(16), None)
+        self.spanId = secrets.token_hex(8)
+        self.token = _current.set(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.time()
+        _current.reset(self.token)
+        if TRACE_DIR or COLLECTOR_URL:
+            record = {'traceId': self.traceId, 'spanId': self.spanId, 'parentSpanId': self.parentSpanId, 'name': self.name,
+                      'service': SERVICE, 'kind': self.kind, 'start': self.start, 'end': end,
+                      'durationMs': round((end - self.start) * 1000, 3), 'attributes': self.attributes,
+                      'status': "error" if exc_type is not None else "ok"}
+            if exc is not None:
+                record['error'] = str(exc)
+            _Export(record)
+        return False
+
+
+def Traced(name, kind = "internal"):
+    """
+    Traced
+    ------
+    Decorator recording the calls of a function, or of a coroutine function, as spans.
+    """
+    def decorator(function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def tracedAsync(*args, **kwargs):
+                with Span(name, kind = kind):
+                    return await function(*args, **kwargs)
+            return tracedAsync
+
+        @functools.wraps(function)
+        def traced(*args, **kwargs):
+            with Span(name, kind = kind):
+                return function(*args, **kwargs)
+        return traced
+    return decorator
+
+
+def TracedTools(functionMap):
+    """
+    TracedTools
+    -----------
+    Returns the functions of a function map, or coroutine functions, wrapped so each call is recorded as a span
+    named after the tool.
+    """
+    return {name: Traced(f"tool {name}")(function) for name, function in functionMap.items()}
+
+
+def MessageSpan(agentId, envelope):
+    """
+    MessageSpan
+    -----------
+    Returns the span of the handling of a queued message by an agent, continuing the trace of its sender.
+
+    Parameters
+    ----------
+    agentId : str
+        ID of the agent handling the message.
+    envelope : dict
+        The unpacked message, see `MessageEnvelope.UnpackMessage`.
+
+    Returns
+    -------
+    Span
+        The span, to be entered.
+    """
+    attributes = {'conversationId': envelope['conversationId'], 'sender': envelope['sender']}
+    if 'type' in envelope:
+        attributes['messageType'] = envelope['type']
+    if 'sentAt' in envelope:
+        attributes['queueWaitMs'] = round(max(0.0, time.time() - envelope['sentAt']) * 1000, 3)
+    return Span(f"{agentId} handle {envelope.get('type', 'message')}", parent = envelope.get('traceparent'),
+                kind = "consumer", attributes = attributes)
+
+
+#%% In this section : export of the finished spans
+def _Export(record):
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = threading.Thread(target = _exportLoop, name = "span-exporter", daemon = True)
+                _exporter.start()
+                atexit.register(Flush)
+    _buffer.append(record)
+
+
+def _exportLoop():
+    while True:
+        time.sleep(EXPORT_INTERVAL)
+        Flush()
+
+
+def OtlpSpan(record):
+    """
+    OtlpSpan
+    --------
+    Converts a span record to the OTLP JSON encoding.
+    """
+    def value(item):
+        if isinstance(item, bool):
+            return {'boolValue': item}
+        if isinstance(item, int):
+            return {'intValue': str(item)}
+        if isinstance(item, float):
+            return {'doubleValue': item}
+        return {'stringValue': str(item)}
+
+    span = {'traceId': record['traceId'], 'spanId': record['spanId'], 'name': record['name'],
+            'kind': KINDS.get(record['kind'], 1), 'startTimeUnixNano': str(int(record['start'] * 1e9)),
+            'endTimeUnixNano': str(int(record['end'] * 1e9)),
+            'attributes': [{'key': key, 'value': value(item)} for key, item in record['attributes'].items() if item is not None],
+            'status': {'code': 2, 'message': record.get('error', "")} if record['status'] == "error" else {'code': 1}}
+    if record['parentSpanId']:
+        span['parentSpanId'] = record['parentSpanId']
+    return span
+
+
+def Flush():
+    """
+    Flush
+    -----
+    Exports the finished spans waiting in the buffer.
+    """
+    records = []
+    while _buffer:
+        records.append(_buffer.popleft())
+    if not records:
+        return
+    if TRACE_DIR:
+        try:
+            os.makedirs(TRACE_DIR, exist_ok = True)
+            with open(os.path.join(TRACE_DIR, f"{SERVICE}-{os.getpid()}.jsonl"), "a") as file:
+                file.writelines(json.dumps(record) + "\n" for record in records)
+        except OSError as e:
+            print(f"Error while writing the spans: {e}")
+    if COLLECTOR_URL:
+        services = collections.defaultdict(list)
+        for record in records:
+            services[record['service']].append(OtlpSpan(record))
+        body = {'resourceSpans': [{'resource': {'attributes': [{'key': "service.name", 'value': {'stringValue': service}}]},
+                                   'scopeSpans': [{'scope': {'name': "ai-ku"}, 'spans': spans}]}
+                                  for service, spans in services.items()]}
+        request = urllib.request.Request(COLLECTOR_URL, data = json.dumps(body).encode('utf-8'),
+                                         headers = {'Content-Type': "application/json"}, method = "POST")
+        try:
+            urllib.request.urlopen(request, timeout = 5).close()
+        except OSError as e:
+            print(f"Error while sending the spans to the collector: {e}")
+#%%
+
+
+#%% In this section : reading of the exported traces
+def ReadSpans(traceDir = TRACE_DIR, traceId = None):
+    """
+    ReadSpans
+    ---------
+    Returns the spans written in the JSON lines files of a directory, by the agents and by the rnapi server,
+    optionally restricted to a trace.
+    """
+    spans = []
+    for path in glob.glob(os.path.join(traceDir, "*.jsonl")):
+        with open(path) as file:
+            for line in file:
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue
+                if traceId is None or span.get('traceId') == traceId:
+                    spans.append(span)
+    return spans
+
+
+def CriticalPath(spans):
+    """
+    CriticalPath
+    ------------
+    Returns the IDs of the spans on the critical path of a trace: from the first root, the child ending last, recursively.
+    """
+    children = collections.defaultdict(list)
+    ids = {span['spanId'] for span in spans}
+    roots = []
+    for span in spans:
+        if span.get('parentSpanId') in ids:
+            children[span['parentSpanId']].append(span)
+        else:
+            roots.append(span)
+    path = set()
+    span = min(roots, key = lambda root: root['start'], default = None)
+    while span is not None:
+        path.add(span['spanId'])
+        span = max(children[span['spanId']], key = lambda child: child['end'], default = None)
+    return path
+
+
+def PrintTrace(spans):
+    children = collections.defaultdict(list)
+    ids = {span['spanId'] for span in spans}
+    for span in sorted(spans, key = lambda span: span['start']):
+        children[span.get('parentSpanId') if span.get('parentSpanId') in ids else None].append(span)
+    path = CriticalPath(spans)
+    origin = min(span['start'] for span in spans)
+
+    def show(span, depth):
+        marker = "*" if span['spanId'] in path else " "
+        print(f"{marker} {(span['start'] - origin) * 1000:>10.1f} {span['durationMs']:>10.1f}  {'  ' * depth}"
+              f"[{span['service']}] {span['name']}{' (error)' if span['status'] == 'error' else ''}")
+        for child in children[span['spanId']]:
+            show(child, depth + 1)
+
+    print(f"  {'start (ms)':>10} {'dur. (ms)':>10}  span, * on the critical path")
+    for root in children[None]:
+        show(root, 0)
+
+
+if __name__ == "__main__":
+    if not TRACE_DIR:
+        sys.exit("Set TRACE_DIR to the directory of the exported spans")
+    if len(sys.argv) > 1:
+        PrintTrace(ReadSpans(TRACE_DIR, sys.argv[1]) or sys.exit(f"No span found for trace {sys.argv[1]}"))
+    else:
+        traces = collections.defaultdict(list)
+        for span in ReadSpans(TRACE_DIR):
+            traces[span['traceId']].append(span)
+        for traceId, spans in sorted(traces.items(), key = lambda item: min(span['start'] for span in item[1]))[-20:]:
+            root = min(spans, key = lambda span: span['start'])
+            duration = (max(span['end'] for span in spans) - root['start']) * 1000
+            print(f"{traceId}  {len(spans):>4} spans {duration:>10.1f} ms  [{root['service']}] {root['name']}")
@@ -0,0 +1,41 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+import AgentDirectory as AD
+import MessageEnvelope as ME
+
+
+@pytest.fixture
+def r():
+    r = fakeredis.FakeRedis()
+    r.hset(AD.DIRECTORY_KEY, "haikuserviceprovider", AD.DirectoryEntry("HaikuServiceProvider", "HaikuServiceProvider_queue"))
+    r.set(AD.HeartbeatKey("HaikuServiceProvider"), 1)
+    return r
+
+
+def test_deliver_ignores_the_letter_casing(r):
+    message = ME.PackMessage("AssistantAgent", "hello", "c1")
+    entry = AD.Deliver(r, " haikuServiceProvider", message)
+
+    assert entry['id'] == "HaikuServiceProvider" and entry['alive']
+    assert r.lrange("HaikuServiceProvider_queue", 0, -1) == [message.encode()]
+    assert AD.DeliveryReport("haikuServiceProvider", entry) == "Message Sent to HaikuServiceProvider"
+
+
+def test_unknown_recipients_go_to_the_dead_letter_queue(r):
+    message = ME.PackMessage("AssistantAgent", "hello", "c1")
+
+    assert AD.Deliver(r, "HaikuProvider", message) is None
+    assert not r.exists("HaikuProvider_queue")
+    deadLetter = AD.ReadDeadLetters(r)['deadLetters'][0]
+    assert (deadLetter['recipient'], deadLetter['reason'], deadLetter['message']) == ("HaikuProvider", AD.UNKNOWN_RECIPIENT, message)
+    assert "Known agents: HaikuServiceProvider" in AD.DeliveryReport("HaikuProvider", None, AD.KnownAgents(r))
+
+
+def test_offline_agents_keep_their_messages(r):
+    r.delete(AD.HeartbeatKey("HaikuServiceProvider"))
+    entry = AD.Deliver(r, "HaikuServiceProvider", ME.PackMessage("AssistantAgent", "hello", "c1"))
+
+    assert not entry['alive']
+    assert r.llen("HaikuServiceProvider_queue") == 1
+    assert "offline" in AD.DeliveryReport("HaikuServiceProvider", entry)
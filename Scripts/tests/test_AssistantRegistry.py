@@ -0,0 +1,58 @@
+import json
+import os
+import urllib.request
+import pytest
+
+for module in ("flask", "autogen", "openai", "web3"):
+    pytest.importorskip(module)
+redis = pytest.importorskip("redis")
+import AssistantRegistry as RG
+import Benchmark as BM
+import StartupBenchmark as SB
+
+# Redis database of the agents started by the test, it must be empty and is flushed afterwards
+TEST_REDIS_DB = int(os.getenv("TEST_REDIS_DB", "15"))
+
+
+def StubStats():
+    with urllib.request.urlopen(f"http://localhost:{BM.STUBS_PORT}/stub/stats", timeout = 5) as response:
+        return json.load(response)
+
+
+@pytest.fixture
+def stubs(tmp_path):
+    """
+    Runs the OpenAIStub application (served by BenchmarkStubs.py with the rnapi and node stand-ins). The agents use
+    the Redis database TEST_REDIS_DB, so the registry and the queues of the running agents are not touched.
+    """
+    r = redis.Redis(host='localhost', port = 6379, db = TEST_REDIS_DB)
+    try:
+        r.ping()
+    except redis.ConnectionError:
+        pytest.skip("the agents need a Redis server on localhost:6379")
+    if r.dbsize():
+        pytest.skip(f"the Redis database {TEST_REDIS_DB} is not empty, set TEST_REDIS_DB to an unused database")
+    env = BM.Environment(f"test:{os.getpid()}:timings", redisDb = TEST_REDIS_DB)
+    env['ASSISTANT_DELETE_ON_EXIT'] = "0"
+    process = BM.Start("BenchmarkStubs.py", env, str(tmp_path), str(BM.STUBS_PORT))
+    try:
+        BM.WaitFor(f"http://localhost:{BM.STUBS_PORT}/stub/stats")
+        yield env, str(tmp_path), r
+    finally:
+        process.terminate()
+        process.wait()
+        r.flushdb()
+
+
+def test_second_start_reuses_the_registered_assistants(stubs):
+    env, logDir, r = stubs
+    for script, port in BM.AGENT_PORTS.items():
+        SB.ColdStart(script, port, env, logDir)
+    created = StubStats()['assistantsCreated']
+    assert created == len(BM.AGENT_PORTS) == r.hlen(RG.REGISTRY_KEY)
+
+    for script, port in BM.AGENT_PORTS.items():
+        SB.ColdStart(script, port, env, logDir)
+    stats = StubStats()
+    assert stats['assistantsCreated'] == created
+    assert stats['assistantsDeleted'] == 0
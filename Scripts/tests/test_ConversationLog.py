@@ -0,0 +1,32 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+import ConversationLog as CL
+
+
+@pytest.fixture
+def r():
+    return fakeredis.FakeRedis()
+
+
+def test_read_logs_after_a_cursor(r):
+    CL.AppendLog(r, "AssistantAgent", "first", "c1")
+    cursor = CL.ReadLogs(r)['cursor']
+    CL.AppendLog(r, "HaikuServiceProvider", "second", "c1")
+    CL.AppendLog(r, "AssistantAgent", "other", "c2")
+
+    assert [log['message'] for log in CL.ReadLogs(r, since = cursor)['logs']] == ["second", "other"]
+    assert [log['message'] for log in CL.ReadLogs(r, conversationId = "c1")['logs']] == ["first", "second"]
+
+
+def test_clear_logs_keeps_the_state_of_the_agents(r):
+    CL.AppendLog(r, "AssistantAgent", "hello", "c1")
+    CL.AppendLog(r, "AssistantAgent", "hello", "c2")
+    r.hset("assistant_registry", "AI Assistant:0123", "asst_1")
+    r.set("nonce:0xabc", 3)
+    r.set("paid_reference:0x01", "AssistantAgent")
+    r.hset("agent_directory", "assistantagent", "{}")
+
+    assert CL.ClearLogs(r) == 3
+    assert CL.ReadLogs(r)['logs'] == []
+    assert sorted(r.keys()) == [b"agent_directory", b"assistant_registry", b"nonce:0xabc", b"paid_reference:0x01"]
@@ -0,0 +1,63 @@
+import HistoryManager as HM
+
+INVOICE = "ID of the invoice is 01a2b3c4d5e6f7a8b9c0d1e2f3"
+REFERENCE = "the client can use this payment Reference to perform payment: 0xb3581f0b0f74cc61"
+
+
+def Negotiation(history):
+    history.record("How much for a haiku?", "The price is 0.001 ETH")
+    history.record("I accept", f"Invoice sent. {INVOICE}")
+    history.record("Invoice received", REFERENCE)
+    for n in range(4):
+        history.record(f"filler prompt {n} " + "word " * 50, f"filler response {n} " + "word " * 50)
+
+
+def test_history_is_compacted_above_the_budget():
+    history = HM.HistoryManager(budget = 200, keepTurns = 2)
+    history.record("hello", "hi")
+    assert not history.needs_compaction()
+
+    Negotiation(history)
+    assert history.needs_compaction()
+    history.compact()
+    assert not history.needs_compaction()
+    assert history.historyTokens == HM.CountTokens(history.summary()) < history.uncompactedTokens
+
+
+def test_summary_pins_the_facts_and_keeps_the_last_turns():
+    history = HM.HistoryManager(budget = 200, keepTurns = 2)
+    Negotiation(history)
+    history.compact()
+
+    prompt = history.prepare("Is the invoice paid?")
+    assert "- price: 0.001 ETH" in prompt
+    assert "- invoice ID: 01a2b3c4d5e6f7a8b9c0d1e2f3" in prompt
+    assert "- payment reference: 0xb3581f0b0f74cc61" in prompt
+    assert "filler prompt 3" in prompt and "filler prompt 2" in prompt and "filler prompt 1" not in prompt
+    assert prompt.endswith("Is the invoice paid?")
+    # the summary is only sent with the first prompt of the new thread
+    assert history.prepare("next") == "next"
+
+
+def test_history_is_not_compacted_twice_in_a_row():
+    history = HM.HistoryManager(budget = 10, keepTurns = 2)
+    Negotiation(history)
+    history.compact()
+
+    assert history.historyTokens > history.budget
+    assert not history.needs_compaction()
+    history.record("prompt", "response")
+    assert history.needs_compaction()
+
+
+def test_tokens_saved_are_counted_per_turn():
+    history = HM.HistoryManager(budget = 200, keepTurns = 2)
+    Negotiation(history)
+    assert history.stats()['tokensSaved'] == 0
+    history.compact()
+
+    history.record("prompt", "response")
+    saved = history.uncompactedTokens - history.historyTokens
+    history.record("prompt", "response")
+    assert history.stats()['tokensSaved'] == 2 * saved
+    assert history.stats()['compactions'] == 1
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("tenacity")
+pytest.importorskip("aiohttp")
+import InvoiceManager as IM
+
+
+class Api(BaseHTTPRequestHandler):
+    # status codes answered in order, then 200 / 201
+    statuses = []
+    calls = []
+
+    def answer(self, default, body):
+        Api.calls.append(f"{self.command} {self.path}")
+        status = Api.statuses.pop(0) if Api.statuses else default
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self.answer(200, {'status': "paid"})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.answer(201, {'id': "inv-1", 'paymentReference': "0xabc"})
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Api)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    Api.statuses, Api.calls = [], []
+    monkeypatch.setattr(IM, "InvoiceEndpoint", f"http://127.0.0.1:{server.server_port}/invoices")
+    monkeypatch.setattr(IM, "MAX_ATTEMPTS", 3)
+    yield Api
+    server.shutdown()
+    server.server_close()
+
+
+async def closing(coroutine):
+    try:
+        return await coroutine
+    finally:
+        for session in IM._async_sessions.values():
+            await session.close()
+        IM._async_sessions.clear()
+
+
+def test_status_checks_are_retried_by_both_clients(api):
+    api.statuses = [503, 502]
+    assert "is: paid" in IM.CheckInvoiceStatus("inv-1", 0)
+    api.statuses = [503, 502]
+    assert "is: paid" in asyncio.run(closing(IM.CheckInvoiceStatusAsync("inv-1", 0)))
+    assert len(api.calls) == 6
+
+
+def test_invoice_creation_is_not_sent_twice_by_both_clients(api):
+    payload = {'expectedAmount': "1"}
+    api.statuses = [503]
+    assert IM.Send_invoice(payload) == (None, None, None)
+    api.statuses = [503]
+    assert asyncio.run(closing(IM.Send_invoiceAsync(payload))) == (None, None, None)
+    assert api.calls == ["POST /invoices", "POST /invoices"]
+    assert asyncio.run(closing(IM.Send_invoiceAsync(payload))) == ('https://invoicing.request.network/', "inv-1", "0xabc")
+
+
+def test_attempts_are_recorded_by_both_clients(api):
+    before = IM.GetApiMetrics().get("GET /invoices/:id", {'count': 0, 'errors': 0})
+    api.statuses = [503]
+    IM.CheckInvoiceStatus("inv-1", 0)
+    api.statuses = [503]
+    asyncio.run(closing(IM.CheckInvoiceStatusAsync("inv-1", 0)))
+    after = IM.GetApiMetrics()["GET /invoices/:id"]
+    assert (after['count'] - before['count'], after['errors'] - before['errors']) == (4, 2)
+
+
+def test_unreachable_server_is_an_error_message(monkeypatch):
+    monkeypatch.setattr(IM, "MAX_ATTEMPTS", 2)
+    # nothing listens on the port 9 (discard) of the test machine
+    monkeypatch.setattr(IM, "InvoiceEndpoint", "http://127.0.0.1:9/invoices")
+    assert asyncio.run(closing(IM.Send_invoiceAsync({'expectedAmount': "1"}))) == (None, None, None)
+    assert "An error occurred" in asyncio.run(closing(IM.CheckInvoiceStatusAsync("inv-1", 0)))
@@ -0,0 +1,34 @@
+import json
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+pytest.importorskip("requests")
+pytest.importorskip("tenacity")
+pytest.importorskip("aiohttp")
+import AgentDirectory as AD
+import InvoiceWatcher as IW
+
+
+@pytest.fixture
+def r():
+    r = fakeredis.FakeRedis()
+    IW.WatchInvoice(r, "inv-1", "HaikuServiceProvider", "c1", "AssistantAgent")
+    return r
+
+
+def test_paid_invoice_is_notified_in_the_registered_queue(r):
+    r.hset(AD.DIRECTORY_KEY, "haikuserviceprovider", AD.DirectoryEntry("HaikuServiceProvider", "provider:inbox"))
+
+    assert IW.CheckWatchedInvoices(r, lambda ids: dict.fromkeys(ids, "paid")) == 1
+    assert json.loads(r.lpop("provider:inbox"))['payload']['invoiceId'] == "inv-1"
+    assert not r.exists("HaikuServiceProvider_queue") and not r.hexists(IW.WATCHED_KEY, "inv-1")
+
+
+def test_unknown_recipient_stays_watched_until_registered(r):
+    assert IW.CheckWatchedInvoices(r, lambda ids: dict.fromkeys(ids, "paid")) == 0
+    assert r.hexists(IW.WATCHED_KEY, "inv-1") and not r.exists("HaikuServiceProvider_queue")
+
+    r.hset(AD.DIRECTORY_KEY, "haikuserviceprovider", AD.DirectoryEntry("HaikuServiceProvider", "HaikuServiceProvider_queue"))
+    assert IW.CheckWatchedInvoices(r, lambda ids: dict.fromkeys(ids, "paid")) == 1
+    assert r.llen("HaikuServiceProvider_queue") == 1
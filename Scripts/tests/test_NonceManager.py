@@ -0,0 +1,55 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+import NonceManager as NM
+
+ADDRESS = "0x" + "11" * 20
+
+
+class Chain:
+    def __init__(self, count):
+        self.count = count
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.count
+
+
+def test_allocate_starts_from_the_chain_once():
+    chain = Chain(7)
+    nonces = NM.NonceManager(fakeredis.FakeRedis(), ADDRESS, chain)
+
+    assert [nonces.allocate() for _ in range(3)] == [7, 8, 9]
+    assert chain.calls == 1
+
+
+def test_replicas_share_the_allocator():
+    r = fakeredis.FakeRedis()
+    first, second = NM.NonceManager(r, ADDRESS, Chain(3)), NM.NonceManager(r, ADDRESS, Chain(3))
+
+    assert [first.allocate(), second.allocate(), first.allocate()] == [3, 4, 5]
+
+
+def test_released_nonces_are_reused_lowest_first():
+    nonces = NM.NonceManager(fakeredis.FakeRedis(), ADDRESS, Chain(0))
+    allocated = [nonces.allocate() for _ in range(4)]
+    nonces.release(allocated[2])
+    nonces.release(allocated[1])
+
+    assert [nonces.allocate(), nonces.allocate(), nonces.allocate()] == [1, 2, 4]
+
+
+def test_resync_follows_the_chain_and_drops_used_released_nonces():
+    chain = Chain(0)
+    nonces = NM.NonceManager(fakeredis.FakeRedis(), ADDRESS, chain)
+    for _ in range(5):
+        nonces.allocate()
+    nonces.release(1)
+    nonces.release(4)
+    # nonces up to 2 were used on chain by another tool
+    chain.count = 3
+
+    assert nonces.resync() == 3
+    assert [nonces.allocate(), nonces.allocate()] == [4, 3]
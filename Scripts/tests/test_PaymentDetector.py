@@ -0,0 +1,113 @@
+import asyncio
+import os
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("web3")
+pytest.importorskip("eth_abi")
+import PaymentDetector as PD
+
+# TransferWithReferenceAndFee logs of the payment contract, blocks 101 to 139
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "transfer_with_reference_logs.json")
+PROXY = "0x" + "cc" * 20
+REFERENCE_A = "0xb3581f0b0f74cc61"
+REFERENCE_B = "0x0d4a2e1c77f3a9b2"
+# keccak256 of the 8 bytes of REFERENCE_A, as recorded in the topics of its logs
+TOPIC_A = "0x05c8ee1c9d79684c995657b7db5f528960fc0508ce55cf2ae2b70be0b1f329c2"
+
+
+class RecordedNode:
+    """
+    Replays the fixture and records the eth_getLogs filters, rejecting the ranges longer than `maxRange` blocks.
+    """
+    def __init__(self, maxRange = None):
+        self.getLogs = PD.FixtureLogs(FIXTURE)
+        self.maxRange = maxRange
+        self.filters = []
+
+    def __call__(self, filterParams):
+        if self.maxRange is not None and filterParams['toBlock'] - filterParams['fromBlock'] + 1 > self.maxRange:
+            raise ValueError("query returned more than 10000 results")
+        self.filters.append(filterParams)
+        return self.getLogs(filterParams)
+
+    def ranges(self):
+        return [(filterParams['fromBlock'], filterParams['toBlock']) for filterParams in self.filters]
+
+
+@pytest.fixture
+def r():
+    r = fakeredis.FakeRedis()
+    PD.WatchReference(r, REFERENCE_A)
+    PD.WatchReference(r, REFERENCE_B)
+    return r
+
+
+def test_reference_topic_is_the_keccak_of_the_reference_bytes():
+    assert PD.ReferenceTopic(REFERENCE_A) == TOPIC_A
+    assert PD.ReferenceTopic(REFERENCE_A) != PD.Web3.to_hex(PD.Web3.keccak(text = REFERENCE_A))
+
+
+def test_topic_filter_selects_the_watched_references(r):
+    node = RecordedNode()
+    r.set(PD.CHECKPOINT_KEY, 100)
+
+    assert PD.ScanPayments(r, node, 139, contractAddress = PROXY, chunkSize = 100) == 4
+    eventTopic, referenceTopics = node.filters[0]['topics']
+    assert eventTopic == PD.EVENT_TOPIC
+    assert sorted(referenceTopics) == sorted([TOPIC_A, PD.ReferenceTopic(REFERENCE_B)])
+    payments = PD.GetPayments(r, [REFERENCE_A, REFERENCE_B, "0x6e9f0c3b1a2d4e58"])
+    # the payment of block 117 to REFERENCE_A was made on another contract
+    assert payments[REFERENCE_A]['amount'] == 4 * 10**15
+    assert (payments[REFERENCE_B]['amount'], payments[REFERENCE_B]['feeAmount']) == (3 * 10**15, 10**13)
+    assert list(payments) == [REFERENCE_A, REFERENCE_B]
+
+
+def test_block_range_is_scanned_in_chunks(r):
+    node = RecordedNode()
+    r.set(PD.CHECKPOINT_KEY, 100)
+
+    PD.ScanPayments(r, node, 139, contractAddress = PROXY, chunkSize = 10)
+    assert node.ranges() == [(101, 110), (111, 120), (121, 130), (131, 139)]
+
+
+def test_chunk_is_halved_when_the_node_rejects_a_range(r):
+    node = RecordedNode(maxRange = 10)
+    r.set(PD.CHECKPOINT_KEY, 100)
+
+    assert PD.ScanPayments(r, node, 139, contractAddress = PROXY, chunkSize = 40) == 4
+    assert node.ranges() == [(101, 110), (111, 120), (121, 130), (131, 139)]
+
+
+def test_first_scan_starts_one_chunk_before_the_latest_block(r):
+    node = RecordedNode()
+
+    PD.ScanPayments(r, node, 139, contractAddress = PROXY, chunkSize = 20)
+    assert node.ranges() == [(120, 139)]
+
+
+def test_scan_resumes_from_the_checkpoint(r):
+    r.set(PD.CHECKPOINT_KEY, 100)
+    assert PD.ScanPayments(r, RecordedNode(), 120, contractAddress = PROXY, chunkSize = 10) == 2
+    assert int(r.get(PD.CHECKPOINT_KEY)) == 120
+
+    node = RecordedNode()
+    assert PD.ScanPayments(r, node, 139, contractAddress = PROXY, chunkSize = 10) == 2
+    assert node.ranges() == [(121, 130), (131, 139)]
+    assert int(r.get(PD.CHECKPOINT_KEY)) == 139
+
+
+def test_rescanned_logs_are_not_counted_twice(r):
+    r.set(PD.CHECKPOINT_KEY, 100)
+    PD.ScanPayments(r, RecordedNode(), 139, contractAddress = PROXY, chunkSize = 10)
+    r.set(PD.CHECKPOINT_KEY, 100)
+
+    assert PD.ScanPayments(r, RecordedNode(), 139, contractAddress = PROXY, chunkSize = 10) == 0
+    assert PD.GetPayments(r, [REFERENCE_A])[REFERENCE_A]['amount'] == 4 * 10**15
+
+
+def test_async_watch_uses_the_same_layout():
+    r = fakeredis.FakeAsyncRedis()
+    asyncio.run(PD.WatchReferenceAsync(r, REFERENCE_A))
+
+    assert asyncio.run(r.hgetall(PD.REFERENCES_KEY)) == {TOPIC_A.encode(): REFERENCE_A.encode()}
@@ -0,0 +1,99 @@
+import threading
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+# the requeue script of RecoverStaleMessages runs in the Lua interpreter of fakeredis
+pytest.importorskip("lupa")
+import AgentDirectory as AD
+import MessageEnvelope as ME
+import QueueManager as QM
+
+QUEUE = "TestAgent_queue"
+
+
+@pytest.fixture
+def r():
+    return fakeredis.FakeRedis()
+
+
+def Crashed(r, workerId, *messages):
+    """
+    Leaves messages in the processing list of a registered worker without heartbeat, as a crashed process does.
+    """
+    r.sadd(QM.WorkersKey(QUEUE), workerId)
+    for message in messages:
+        r.lpush(QM.ProcessingKey(QUEUE, workerId), message)
+
+
+def Consume(r, count):
+    """
+    Starts the consumers and returns the first `count` messages handled.
+    """
+    handled, done = [], threading.Event()
+
+    def handler(message):
+        handled.append(message)
+        if len(handled) == count:
+            done.set()
+
+    stopEvent = QM.StartConsumers(r, QUEUE, handler, workers = 1, blockTimeout = 1)
+    try:
+        assert done.wait(5)
+    finally:
+        stopEvent.set()
+    return handled
+
+
+def test_messages_of_dead_workers_are_redelivered(r):
+    first, second = ME.PackMessage("a", "first", "c1"), ME.PackMessage("a", "second", "c1")
+    Crashed(r, "other-host-7-0123abcd-0", first, second)
+
+    assert Consume(r, 2) == [first, second]
+    assert not r.exists(QM.ProcessingKey(QUEUE, "other-host-7-0123abcd-0"))
+    assert b"other-host-7-0123abcd-0" not in r.smembers(QM.WorkersKey(QUEUE))
+
+
+def test_restart_with_the_same_hostname_and_pid(r):
+    # a container restarted with the same hostname and PID: only the start ID differs
+    crashedId = QM.ProcessId().rsplit("-", 1)[0] + "-deadbeef-0"
+    assert crashedId != f"{QM.ProcessId()}-0"
+    message = ME.PackMessage("a", "in flight", "c1")
+    Crashed(r, crashedId, message)
+
+    assert Consume(r, 1) == [message]
+
+
+def test_live_workers_keep_their_messages(r):
+    message = ME.PackMessage("a", "in flight", "c1")
+    Crashed(r, "other-host-7-0123abcd-0", message)
+    r.set(QM.HeartbeatKey(QUEUE, "other-host-7-0123abcd-0"), 1, ex = QM.HEARTBEAT_TTL)
+
+    assert QM.RecoverStaleMessages(r, QUEUE) == 0
+    assert r.lrange(QM.ProcessingKey(QUEUE, "other-host-7-0123abcd-0"), 0, -1) == [message.encode()]
+
+
+def test_process_one_acknowledges_and_unregisters(r):
+    message = ME.PackMessage("a", "hello", "c1")
+    r.lpush(QUEUE, message)
+    handled = []
+
+    assert QM.ProcessOne(r, QUEUE, handled.append)
+    assert handled == [message]
+    assert not QM.ProcessOne(r, QUEUE, handled.append)
+    assert r.smembers(QM.WorkersKey(QUEUE)) == set()
+    assert QM.QueueStats(r, QUEUE)['inflight'] == 0
+
+
+def test_failing_messages_go_to_the_dead_letter_queue(r):
+    message = ME.PackMessage("a", "boom", "c1")
+    r.lpush(QUEUE, message)
+
+    def handler(message):
+        raise ValueError("boom")
+
+    assert QM.ProcessOne(r, QUEUE, handler)
+    deadLetters = AD.ReadDeadLetters(r)
+    assert deadLetters['count'] == 1
+    assert deadLetters['deadLetters'][0]['reason'] == AD.HANDLER_ERROR
+    assert deadLetters['deadLetters'][0]['message'] == message
+    assert QM.QueueStats(r, QUEUE)['depth'] == 0
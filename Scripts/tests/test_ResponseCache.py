@@ -0,0 +1,86 @@
+import pytest
+import HistoryManager as HM
+import ResponseCache as RC
+
+SENDER = "HaikuServiceProvider"
+
+
+def Cache(**kwargs):
+    return RC.ResponseCache("AssistantAgent", "gpt-4o-mini", "instructions", enabled = True, **kwargs)
+
+
+def Turn(functionMap, prompt):
+    """
+    Runs a turn of the AI calling the recorded tools, returns the recorded calls.
+    """
+    calls = RC.StartRecording()
+    try:
+        functionMap["SendMessage"](recipientID = SENDER, message = f"answer to {prompt}")
+    finally:
+        RC.StopRecording()
+    return calls
+
+
+def test_cached_turn_is_replayed_for_the_same_prompt():
+    cache, history = Cache(), HM.HistoryManager()
+    sent = []
+    functionMap = RC.Recorded({"SendMessage": lambda recipientID, message: sent.append((recipientID, message))})
+
+    key, entry = cache.lookup("What is the price?", history)
+    assert entry is None
+    cache.store(key, "price asked", Turn(functionMap, "price"), SENDER)
+
+    key, entry = cache.lookup("  what is the PRICE ", history)
+    assert entry == {'response': "price asked", 'calls': [{'name': "SendMessage", 'arguments': {'recipientID': SENDER, 'message': "answer to price"}}]}
+    assert cache.hit("what is the price", entry, history) == "price asked"
+    # the replayed exchange is sent to the AI with its next prompt
+    assert "< SendMessage to HaikuServiceProvider: answer to price" in history.prepare("next")
+    assert (cache.stats()['hits'], cache.stats()['misses'], cache.stats()['stored']) == (1, 1, 1)
+
+
+def test_cached_turn_depends_on_the_history():
+    cache, history = Cache(), HM.HistoryManager()
+    key, _ = cache.lookup("hello", history)
+    cache.store(key, "hi", [], SENDER)
+    history.record("hello", "hi")
+
+    assert cache.lookup("hello", history)[1] is None
+    # reminders do not depend on the history
+    key, _ = cache.lookup("reminder", history, keep = False)
+    history.record("other", "turn")
+    cache.store(key, "ok", [], SENDER, keep = False)
+    assert cache.lookup("reminder", history, keep = False)[1] is not None
+
+
+@pytest.mark.parametrize("response, calls", [
+    ("paid", [{'name': "PerformPayment", 'arguments': {'recipient_address': "0x0"}}]),
+    ("sent", [{'name': "SendMessage", 'arguments': {'recipientID': "haikuLover", 'message': "haiku"}}]),
+    ("Exception: rate limited", []),
+])
+def test_turns_that_cannot_be_replayed_are_not_cached(response, calls):
+    cache, history = Cache(), HM.HistoryManager()
+    key, _ = cache.lookup("pay the invoice", history)
+    cache.store(key, response, calls, SENDER)
+
+    assert cache.lookup("pay the invoice", history)[1] is None
+    assert cache.stats()['uncacheable'] == 1
+
+
+def test_expired_responses_are_not_reused():
+    cache, history = Cache(ttl = 0), HM.HistoryManager()
+    key, _ = cache.lookup("hello", history)
+    cache.store(key, "hi", [], SENDER)
+
+    assert cache.lookup("hello", history)[1] is None
+
+
+def test_redis_tier_is_shared_between_processes():
+    fakeredis = pytest.importorskip("fakeredis")
+    r = fakeredis.FakeRedis()
+    first, second = Cache(redisConnexion = r), Cache(redisConnexion = r)
+    key, _ = first.lookup("hello", HM.HistoryManager())
+    first.store(key, "hi", [], SENDER)
+
+    assert second.lookup("hello", HM.HistoryManager())[1]['response'] == "hi"
+    assert second.stats()['redisHits'] == 1
+    assert r.ttl(key) > 0
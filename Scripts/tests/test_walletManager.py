@@ -0,0 +1,94 @@
+import pytest
+
+pytest.importorskip("web3")
+pytest.importorskip("eth_abi")
+import walletManager as WM
+
+# keccak256("batchNativePayments((address,uint256,address[],bytes,uint256,uint256,uint256)[],address)")[:4],
+# the function of the BatchNoConversionPayments contract
+BATCH_SELECTOR = "fb63a45a"
+# selector of the flat array layout, which matches no function of the batch contract
+LEGACY_SELECTOR = "573acf7f"
+BATCH_CONTRACT = "0x" + "22" * 20
+RECIPIENT = "0x" + "11" * 20
+
+
+def word(value):
+    if isinstance(value, str):
+        return value[2:].lower().rjust(64, "0") if value.startswith("0x") else value.ljust(64, "0")
+    return f"{value:064x}"
+
+
+def test_batch_selector():
+    context = WM.PaymentContext(None, BATCH_CONTRACT, WM.BATCH_ABI_json, RECIPIENT)
+    selector, types = context.functions["batchNativePayments"]
+    assert selector.hex().removeprefix("0x") == BATCH_SELECTOR != LEGACY_SELECTOR
+    assert types == ["(address,uint256,address[],bytes,uint256,uint256,uint256)[]", "address"]
+
+
+def test_batch_calldata():
+    context = WM.PaymentContext(None, BATCH_CONTRACT, WM.BATCH_ABI_json, RECIPIENT)
+    payments = [{'recipient_address': RECIPIENT, 'amount_to_pay': 0.001, 'paymentRefence': "0xaabbccddeeff0011"}]
+    details = WM.BatchRequestDetails(payments, [10 ** 15])
+    calldata = context.encode("batchNativePayments", [details, WM.fee_address])
+
+    # ABI layout of batchNativePayments([(recipient, 10**15, [], 0xaabbccddeeff0011, 0, 0, 0)], feeAddress)
+    expected = "0x" + BATCH_SELECTOR + "".join([
+        word(0x40),                 # offset of requestDetails
+        word(WM.fee_address),       # _feeAddress
+        word(1),                    # requestDetails.length
+        word(0x20),                 # offset of requestDetails[0], a dynamic tuple
+        word(RECIPIENT),            # recipient
+        word(10 ** 15),             # requestAmount
+        word(0xe0),                 # offset of path, after the 7 head words of the tuple
+        word(0x100),                # offset of paymentReference
+        word(0),                    # feeAmount
+        word(0),                    # maxToSpend
+        word(0),                    # maxRateTimespan
+        word(0),                    # path.length
+        word(8),                    # paymentReference.length
+        word("aabbccddeeff0011"),   # paymentReference, right padded
+    ])
+    assert calldata == expected
+
+
+class SignedContext:
+    def build_transaction(self, functionName, args, value, nonce, gasKey = None):
+        return {'to': RECIPIENT, 'value': value, 'nonce': nonce, 'gas': 21000, 'gasPrice': 1, 'chainId': 11155111, 'data': "0x"}
+
+
+@pytest.fixture
+def nonces(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    import NonceManager as NM
+    manager = NM.NonceManager(fakeredis.FakeRedis(), RECIPIENT, lambda: 5)
+    monkeypatch.setattr(WM, "nonces", manager)
+    monkeypatch.setattr(WM, "private_key_metamask", "0x" + "01" * 32)
+    return manager
+
+
+def test_already_known_is_the_sent_transaction(monkeypatch, nonces):
+    def send_raw_transaction(raw):
+        raise ValueError({'code': -32000, 'message': 'already known'})
+    monkeypatch.setattr(WM.web3Connex.eth, "send_raw_transaction", send_raw_transaction)
+
+    txn_hash, nonce = WM._SignAndSend(SignedContext(), "transfer", [], 1)
+    signed = WM.web3Connex.eth.account.sign_transaction(SignedContext().build_transaction("transfer", [], 1, 5), WM.private_key_metamask)
+    assert (txn_hash, nonce) == (WM.Web3.to_hex(signed.hash), 5)
+    # the nonce is used, it is not released nor resynced
+    assert nonces.allocate() == 6
+
+
+def test_nonce_too_low_resyncs_once(monkeypatch, nonces):
+    sent = []
+    def send_raw_transaction(raw):
+        sent.append(raw)
+        if len(sent) == 1:
+            raise ValueError({'code': -32000, 'message': 'nonce too low'})
+        return b"\x01" * 32
+    monkeypatch.setattr(WM.web3Connex.eth, "send_raw_transaction", send_raw_transaction)
+    nonces.getTransactionCount = lambda: 9
+
+    assert WM._SignAndSend(SignedContext(), "transfer", [], 1) == ("0x" + "01" * 32, 9)
+    assert len(sent) == 2
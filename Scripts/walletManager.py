@@ -1,6 +1,15 @@
-from web3 import Web3
+from web3 import Web3, AsyncWeb3
 from web3.utils import log_topic_to_bytes
+from web3.exceptions import TransactionNotFound
+from eth_abi import encode as abi_encode
+import asyncio
+import json
 import os
+import threading
+import time
+import redis
+import NonceManager as NM
+import StageTimings as ST
 
 
 # Initialize Web3 connection with Infura URL for Sepolia network
@@ -17,9 +26,278 @@ fee_address = "0x35d0e078755Cd84D3E0656cAaB417Dee1d7939c7"
 
 # Initialize Web3 connection
 web3Connex = Web3(Web3.HTTPProvider(infura_url))
+# Asynchronous Web3 connection, used by the awaitable tools of the asyncio agent runtime
+asyncWeb3Connex = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(infura_url))
+# Redis connexion, used to allocate the nonces and to track the submitted transactions
+r = redis.Redis(host='localhost', port = 6379, db = int(os.getenv("REDIS_DB", "0")))
+# Redis hash of the submitted transactions waiting for their receipt: tx hash -> JSON {paymentReference, nonce, since}
+PENDING_KEY = "pending_payments"
+# Redis hash of the mined transactions: tx hash -> JSON {paymentReference, status, blockNumber}
+RECEIPTS_KEY = "payment_receipts"
+# Time (in seconds) between two checks of the pending transactions by the confirmer
+CONFIRM_INTERVAL = float(os.getenv("PAYMENT_CONFIRM_INTERVAL", "2"))
+# Time (in seconds) after which a transaction still unknown from the node is considered dropped
+RECEIPT_TIMEOUT = float(os.getenv("PAYMENT_RECEIPT_TIMEOUT", "600"))
+
+# Batch payment contract of Request Network (BatchNoConversionPayments) used to pay several invoices in a single transaction,
+# see https://docs.request.network. Without it, the payments of a batch are sent as pipelined transactions.
+batch_contract_address = os.getenv("batchContractAddress")
+# Part of the batch amount added to the value of a batch transaction to cover the batch fee of the contract, the excess is refunded
+BATCH_FEE_MARGIN = float(os.getenv("BATCH_FEE_MARGIN", "0.01"))
+
+# Lifetime (in seconds) of the cached fee data, about a block
+FEE_CACHE_TTL = float(os.getenv("PAYMENT_FEE_CACHE_TTL", "12"))
+# Margin applied on an estimated gas, the estimation being reused for the next payments to the same recipient
+GAS_MARGIN = float(os.getenv("PAYMENT_GAS_MARGIN", "1.2"))
+
+# Nonces of the AI wallet are allocated locally, concurrent payments do not collide nor query the chain each time
+nonces = NM.NonceManager(r, AIWallet, lambda: web3Connex.eth.get_transaction_count(AIWallet, 'pending'))
+
 #ABI of the smart contract used for interaction
 ABI_json = """[{"anonymous":false,"inputs":[{"indexed":false,"internalType":"address","name":"to","type":"address"},{"indexed":false,"internalType":"uint256","name":"amount","type":"uint256"},{"indexed":true,"internalType":"bytes","name":"paymentReference","type":"bytes"},{"indexed":false,"internalType":"uint256","name":"feeAmount","type":"uint256"},{"indexed":false,"internalType":"address","name":"feeAddress","type":"address"}],"name":"TransferWithReferenceAndFee","type":"event"},{"inputs":[{"internalType":"address payable","name":"_to","type":"address"},{"internalType":"uint256","name":"_amount","type":"uint256"},{"internalType":"bytes","name":"_paymentReference","type":"bytes"},{"internalType":"uint256","name":"_feeAmount","type":"uint256"},{"internalType":"address payable","name":"_feeAddress","type":"address"}],"name":"transferExactEthWithReferenceAndFee","outputs":[],"stateMutability":"payable","type":"function"},{"inputs":[{"internalType":"address payable","name":"_to","type":"address"},{"internalType":"bytes","name":"_paymentReference","type":"bytes"},{"internalType":"uint256","name":"_feeAmount","type":"uint256"},{"internalType":"address payable","name":"_feeAddress","type":"address"}],"name":"transferWithReferenceAndFee","outputs":[],"stateMutability":"payable","type":"function"},{"stateMutability":"payable","type":"receive"}]"""
 
+#ABI of the batchNativePayments function of the batch payment contract (BatchNoConversionPayments), paying a list of
+# RequestDetail structs; the path, maxToSpend and maxRateTimespan fields are only used by the conversion payments
+BATCH_ABI_json = """[{"inputs":[{"components":[{"internalType":"address","name":"recipient","type":"address"},{"internalType":"uint256","name":"requestAmount","type":"uint256"},{"internalType":"address[]","name":"path","type":"address[]"},{"internalType":"bytes","name":"paymentReference","type":"bytes"},{"internalType":"uint256","name":"feeAmount","type":"uint256"},{"internalType":"uint256","name":"maxToSpend","type":"uint256"},{"internalType":"uint256","name":"maxRateTimespan","type":"uint256"}],"internalType":"struct BatchNoConversionPayments.RequestDetail[]","name":"requestDetails","type":"tuple[]"},{"internalType":"address payable","name":"_feeAddress","type":"address"}],"name":"batchNativePayments","outputs":[],"stateMutability":"payable","type":"function"}]"""
+
+def AbiType(abiInput):
+    """
+    AbiType
+    -------
+    Returns the canonical type of an input of an ABI, used in the function signatures: the tuples (structs) are
+    written as the list of the types of their components, e.g. '(address,uint256)[]' for 'tuple[]'.
+    """
+    if abiInput['type'].startswith('tuple'):
+        components = ",".join(AbiType(component) for component in abiInput['components'])
+        return f"({components}){abiInput['type'][len('tuple'):]}"
+    return abiInput['type']
+
+
+class PaymentContext:
+    """
+    PaymentContext
+    --------------
+    Prepared payments of a contract. The ABI is parsed and the function selectors are computed once, and the
+    transactions are encoded locally with all their fields set, so building a payment does not query the node:
+    the fee data is cached for `feeTTL` seconds and the gas estimated for a given key (e.g. function and recipient)
+    is reused, the nonce being allocated by the caller.
+
+    Parameters
+    ----------
+    web3 : Web3
+        Connexion used to fetch the fee data and to estimate the gas.
+    contractAddress : str
+        Address of the contract.
+    abi : str
+        JSON ABI of the contract.
+    sender : str
+        Address sending the transactions.
+    chainId : int, optional
+        ID of the chain. Defaults to 11155111 (Sepolia testnet).
+    feeTTL : float, optional
+        Lifetime (in seconds) of the cached fee data.
+    """
+    def __init__(self, web3, contractAddress, abi, sender, chainId = 11155111, feeTTL = FEE_CACHE_TTL):
+        self.web3 = web3
+        self.address = Web3.to_checksum_address(contractAddress)
+        self.sender = sender
+        self.chainId = chainId
+        self.feeTTL = feeTTL
+        # function name -> (selector, input types)
+        self.functions = {}
+        for element in json.loads(abi):
+            if element.get('type') == 'function':
+                types = [AbiType(functionInput) for functionInput in element['inputs']]
+                self.functions[element['name']] = (Web3.keccak(text = f"{element['name']}({','.join(types)})")[:4], types)
+        self.lock = threading.Lock()
+        self.feeData = None
+        self.feeExpiry = 0
+        self.gasCache = {}
+
+    def encode(self, functionName, args):
+        """
+        Returns the call data of a function call.
+        """
+        selector, types = self.functions[functionName]
+        return Web3.to_hex(selector + abi_encode(types, args))
+
+    def fees(self):
+        """
+        Returns the EIP-1559 fee fields of a transaction, fetched from the node at most once per `feeTTL` seconds.
+        """
+        with self.lock:
+            if self.feeData is not None and time.monotonic() < self.feeExpiry:
+                return self.feeData
+        baseFee = self.web3.eth.get_block('latest')['baseFeePerGas']
+        priorityFee = self.web3.eth.max_priority_fee
+        # the max fee covers a doubling of the base fee while the fee data is cached
+        feeData = {'maxFeePerGas': 2 * baseFee + priorityFee, 'maxPriorityFeePerGas': priorityFee}
+        with self.lock:
+            self.feeData = feeData
+            self.feeExpiry = time.monotonic() + self.feeTTL
+        return feeData
+
+    def build_transaction(self, functionName, args, value, nonce, gasKey = None):
+        """
+        Returns the transaction calling a function of the contract, ready to be signed. The gas estimated for
+        `gasKey` is reused, without key it is estimated for this transaction only.
+        """
+        txn = {
+            'type': 2,
+            'chainId': self.chainId,
+            'from': self.sender,
+            'to': self.address,
+            'value': value,
+            'nonce': nonce,
+            'data': self.encode(functionName, args),
+            **self.fees()
+        }
+        gas = self.gasCache.get(gasKey) if gasKey is not None else None
+        if gas is None:
+            gas = int(self.web3.eth.estimate_gas(txn) * GAS_MARGIN)
+            if gasKey is not None:
+                with self.lock:
+                    if len(self.gasCache) >= 10000:
+                        self.gasCache.clear()
+                    self.gasCache[gasKey] = gas
+        txn['gas'] = gas
+        return txn
+
+
+# Prepared payments of the proxy contract and of the batch payment contract
+paymentContext = PaymentContext(web3Connex, contract_address, ABI_json, AIWallet)
+batchContext = PaymentContext(web3Connex, batch_contract_address, BATCH_ABI_json, AIWallet) if batch_contract_address else None
+
+def _IsNonceError(error):
+    """
+    Returns True if a transaction was rejected by the node because of its nonce.
+    """
+    message = str(error).lower()
+    return ('nonce' in message or 'replacement transaction underpriced' in message) and not _IsAlreadyKnown(error)
+
+
+def _IsAlreadyKnown(error):
+    """
+    Returns True if the node already has the transaction (e.g. it was sent again after a timeout): it was
+    submitted, so its hash is the result.
+    """
+    return 'already known' in str(error).lower()
+
+
+def _TrackTransaction(txn_hash, paymentRefence, nonce):
+    """
+    Registers a submitted transaction, its receipt is then recorded by the confirmer.
+    """
+    r.hset(PENDING_KEY, txn_hash, json.dumps({'paymentReference': paymentRefence, 'nonce': nonce, 'since': time.time()}))
+
+
+def _RecordReceipt(txn_hash, paymentRefence, status, blockNumber = None):
+    """
+    Moves a transaction from the pending transactions to the receipts.
+    """
+    pipe = r.pipeline()
+    pipe.hset(RECEIPTS_KEY, txn_hash, json.dumps({'paymentReference': paymentRefence, 'status': status, 'blockNumber': blockNumber}))
+    pipe.hdel(PENDING_KEY, txn_hash)
+    pipe.execute()
+
+
+def _ReceiptMessage(status):
+    if status == 1:
+        return "transaction is confirmed"
+    return "error during the transaction execution or timeout in waiting for completion"
+
+
+def _SignAndSend(context, functionName, args, value, gasKey = None):
+    """
+    Builds, signs and sends a contract call from the AI wallet with a locally allocated nonce.
+    Returns the transaction hash and its nonce.
+    """
+    nonce = nonces.allocate()
+    for attempt in range(2):
+        signed_txn = None
+        try:
+            txn = context.build_transaction(functionName, args, value, nonce, gasKey)
+            signed_txn = web3Connex.eth.account.sign_transaction(txn, private_key_metamask)
+            return Web3.to_hex(web3Connex.eth.send_raw_transaction(signed_txn.raw_transaction)), nonce
+        except Exception as e:
+            if signed_txn is not None and _IsAlreadyKnown(e):
+                # the node has this transaction, the nonce is used
+                return Web3.to_hex(signed_txn.hash), nonce
+            if attempt == 0 and _IsNonceError(e):
+                # the local nonce is out of sync with the chain, resync and retry once
+                nonces.resync()
+                nonce = nonces.allocate()
+                continue
+            nonces.release(nonce)
+            raise
+
+
+def SubmitPayment(recipient_address, amount_to_pay, paymentRefence):
+    """
+    SubmitPayment
+    -------------
+    Signs and sends a payment through the smart contract without waiting for its receipt. The nonce is allocated
+    locally, so several payments from the AI wallet can be sent in the same block. The receipt is recorded by
+    the confirmer started with `StartConfirmer`, see `GetPaymentStatus`.
+
+    Parameters
+    ----------
+    recipient_address : str
+        The Ethereum address of the payment recipient.
+    amount_to_pay : float
+        The amount to be paid in ETH.
+    paymentRefence : str
+        A reference for the payment, used to track the transaction.
+
+    Returns
+    -------
+    str
+        Hash of the transaction, as an hexadecimal string.
+
+    Raises
+    ------
+    Exception
+        If the transaction could not be sent, its nonce is then released.
+    """
+    amount_to_send = Web3.to_wei(amount_to_pay, 'ether')
+    paymentReference_bytes  = log_topic_to_bytes(paymentRefence)
+
+    txn_hash, nonce = _SignAndSend(
+        paymentContext,
+        "transferWithReferenceAndFee",
+        [recipient_address, paymentReference_bytes, 0, fee_address], # No fee for this transaction
+        amount_to_send,
+        gasKey = ("transferWithReferenceAndFee", recipient_address.lower())
+    )
+    _TrackTransaction(txn_hash, paymentRefence, nonce)
+    return txn_hash
+
+
+def GetPaymentStatus(txn_hash):
+    """
+    GetPaymentStatus
+    ----------------
+    Returns the status of a transaction sent with `SubmitPayment`, as recorded by the confirmer.
+
+    Parameters
+    ----------
+    txn_hash : str
+        Hash of the transaction.
+
+    Returns
+    -------
+    str
+        'pending', 'confirmed', 'failed', 'dropped' or 'unknown'.
+    """
+    receipt = r.hget(RECEIPTS_KEY, txn_hash)
+    if receipt is not None:
+        return json.loads(receipt)['status']
+    if r.hexists(PENDING_KEY, txn_hash):
+        return 'pending'
+    return 'unknown'
+
+
+@ST.Timed(ST.PAYMENT)
 def PerformPayment(recipient_address, amount_to_pay, paymentRefence):
     """
     PerformPayment
@@ -44,44 +322,261 @@ def PerformPayment(recipient_address, amount_to_pay, paymentRefence):
     -----
     - The function interacts with a smart contract that uses a method `transferWithReferenceAndFee`.
     - The fee for this transaction is set to 0.
-    - The transaction is signed locally with the provided private key and sent to the blockchain.
+    - The transaction is sent with `SubmitPayment`, the nonce being allocated locally: concurrent payments
+      do not wait for the receipt of each other.
     - The function waits for the transaction receipt to confirm whether the transaction succeeded or failed.
    
     """  
     if recipient_address is None : 
         return "Error , a valid recipient_address should be provided."
-    # Initialize the smart contract with address and ABI
-    contract_instance = web3Connex.eth.contract(address = contract_address, abi = ABI_json)
-
-    # Convert the ETH amount to Wei (smallest unit of ETH)
-    eth_value = amount_to_pay
-    fee_amount = 0 # No fee for this transaction
-    amount_to_send = web3Connex.to_wei(eth_value, 'ether')
-   
-    paymentReference_bytes  = log_topic_to_bytes(paymentRefence) # Convert payment reference to bytes
-
-    # Build the transaction
-    txn = contract_instance.functions.transferWithReferenceAndFee(
-        recipient_address,  
-        paymentReference_bytes,  # payment reference in bytes
-        fee_amount,  # Fee amount (0 in this case)
-        fee_address # Fee address (set but not used since fee = 0)
-    ).build_transaction({
-            'from': AIWallet,
-            'value': amount_to_send,  
-            'nonce': web3Connex.eth.get_transaction_count(AIWallet),
-            'chainId': 11155111,  # Sepolia testnet chain ID
-        })
-    # Sign the transaction with the private key
-    signed_txn = web3Connex.eth.account.sign_transaction(txn, private_key_metamask)
-
-    # Send the signed transaction
-    txn_hash = web3Connex.eth.send_raw_transaction(signed_txn.raw_transaction)
+    try:
+        txn_hash = SubmitPayment(recipient_address, amount_to_pay, paymentRefence)
+    except Exception as e:
+        return f"Error while sending the transaction: {e}"
 
     # Wait for the transaction receipt (confirmation)
-    
     txn_receipt = web3Connex.eth.wait_for_transaction_receipt(txn_hash)
-    if  txn_receipt.status == 1: 
-        return "transaction is confirmed"
-    else: 
-        return "error during the transaction execution or timeout in waiting for completion"
+    _RecordReceipt(txn_hash, paymentRefence, 'confirmed' if txn_receipt.status == 1 else 'failed', txn_receipt.blockNumber)
+    return _ReceiptMessage(txn_receipt.status)
+
+
+async def SubmitPaymentAsync(recipient_address, amount_to_pay, paymentRefence):
+    """
+    SubmitPaymentAsync
+    ------------------
+    Awaitable version of `SubmitPayment`.
+    """
+    amount_to_send = Web3.to_wei(amount_to_pay, 'ether')
+    args = [recipient_address, log_topic_to_bytes(paymentRefence), 0, fee_address]
+    gasKey = ("transferWithReferenceAndFee", recipient_address.lower())
+
+    # the allocator uses the synchronous Redis connexion, it is called outside of the event loop
+    nonce = await asyncio.to_thread(nonces.allocate)
+    for attempt in range(2):
+        signed_txn = None
+        try:
+            # the context only queries the node when its fee data expired or for a new recipient
+            txn = await asyncio.to_thread(paymentContext.build_transaction, "transferWithReferenceAndFee", args, amount_to_send, nonce, gasKey)
+            signed_txn = asyncWeb3Connex.eth.account.sign_transaction(txn, private_key_metamask)
+            txn_hash = Web3.to_hex(await asyncWeb3Connex.eth.send_raw_transaction(signed_txn.raw_transaction))
+            break
+        except Exception as e:
+            if signed_txn is not None and _IsAlreadyKnown(e):
+                txn_hash = Web3.to_hex(signed_txn.hash)
+                break
+            if attempt == 0 and _IsNonceError(e):
+                await asyncio.to_thread(nonces.resync)
+                nonce = await asyncio.to_thread(nonces.allocate)
+                continue
+            await asyncio.to_thread(nonces.release, nonce)
+            raise
+
+    await asyncio.to_thread(_TrackTransaction, txn_hash, paymentRefence, nonce)
+    return txn_hash
+
+
+@ST.Timed(ST.PAYMENT)
+async def PerformPaymentAsync(recipient_address, amount_to_pay, paymentRefence):
+    """
+    PerformPaymentAsync
+    -------------------
+    Awaitable version of `PerformPayment`. The RPC calls and the wait for the transaction receipt
+    do not block the event loop, so a pending transaction does not hold a thread.
+
+    Parameters
+    ----------
+    recipient_address : str
+        The Ethereum address of the payment recipient.
+    amount_to_pay : float
+        The amount to be paid in ETH.
+    paymentRefence : str
+        A reference for the payment, used to track the transaction.
+
+    Returns
+    -------
+    str
+        A message indicating the result of the transaction: either "transaction is confirmed" or an error message.
+    """
+    if recipient_address is None : 
+        return "Error , a valid recipient_address should be provided."
+    try:
+        txn_hash = await SubmitPaymentAsync(recipient_address, amount_to_pay, paymentRefence)
+    except Exception as e:
+        return f"Error while sending the transaction: {e}"
+
+    txn_receipt = await asyncWeb3Connex.eth.wait_for_transaction_receipt(txn_hash)
+    await asyncio.to_thread(_RecordReceipt, txn_hash, paymentRefence, 'confirmed' if txn_receipt.status == 1 else 'failed', txn_receipt.blockNumber)
+    return _ReceiptMessage(txn_receipt.status)
+
+
+@ST.Timed(ST.PAYMENT)
+def PerformPayments(batch):
+    """
+    PerformPayments
+    ---------------
+    Pays several invoices at once. With a batch payment contract (`batchContractAddress`), all the payments are
+    settled in a single transaction: one signature, one gas estimation, one broadcast and one receipt wait.
+    Otherwise the transactions are sent back to back with consecutive nonces, the gas being estimated once
+    per recipient, and their receipts are awaited together.
+
+    Parameters
+    ----------
+    batch : list of dict
+        Payments to perform, each one with the parameters of `PerformPayment`: recipient_address, amount_to_pay and paymentRefence.
+
+    Returns
+    -------
+    list of dict
+        One result per payment, in the same order: {'paymentReference', 'txHash', 'message'}, the message being the
+        one of `PerformPayment`. 'txHash' is None when the payment could not be sent.
+    """
+    results = [{'paymentReference': payment.get('paymentRefence'), 'txHash': None, 'message': None} for payment in batch]
+    valid = []
+    for index, payment in enumerate(batch):
+        if payment.get('recipient_address') is None or payment.get('paymentRefence') is None:
+            results[index]['message'] = "Error , a valid recipient_address and paymentRefence should be provided."
+        else:
+            valid.append(index)
+    if not valid:
+        return results
+
+    if batch_contract_address:
+        _PerformBatchTransaction([batch[index] for index in valid], [results[index] for index in valid])
+    else:
+        _PerformPipelinedTransactions([batch[index] for index in valid], [results[index] for index in valid])
+    return results
+
+
+def BatchRequestDetails(payments, amounts):
+    """
+    BatchRequestDetails
+    -------------------
+    Returns the RequestDetail structs of the payments of a batch, as expected by `batchNativePayments`:
+    (recipient, requestAmount, path, paymentReference, feeAmount, maxToSpend, maxRateTimespan).
+    """
+    return [
+        # No fee for these transactions, no conversion path nor limits for native payments
+        (Web3.to_checksum_address(payment['recipient_address']), amount, [], log_topic_to_bytes(payment['paymentRefence']), 0, 0, 0)
+        for payment, amount in zip(payments, amounts)
+    ]
+
+
+def _PerformBatchTransaction(payments, results):
+    """
+    Settles the payments in a single call of the batch payment contract and fills their results.
+    """
+    amounts = [Web3.to_wei(payment['amount_to_pay'], 'ether') for payment in payments]
+    args = [BatchRequestDetails(payments, amounts), fee_address]
+    try:
+        # the gas depends on the batch, it is estimated once for the whole batch
+        txn_hash, nonce = _SignAndSend(batchContext, "batchNativePayments", args, sum(amounts) + int(sum(amounts) * BATCH_FEE_MARGIN))
+    except Exception as e:
+        for result in results:
+            result['message'] = f"Error while sending the batch transaction: {e}"
+        return
+    # the transaction settles all the payment references of the batch
+    paymentReferences = [payment['paymentRefence'] for payment in payments]
+    _TrackTransaction(txn_hash, paymentReferences, nonce)
+
+    txn_receipt = web3Connex.eth.wait_for_transaction_receipt(txn_hash)
+    _RecordReceipt(txn_hash, paymentReferences, 'confirmed' if txn_receipt.status == 1 else 'failed', txn_receipt.blockNumber)
+    for result in results:
+        result['txHash'] = txn_hash
+        result['message'] = _ReceiptMessage(txn_receipt.status)
+
+
+def _PerformPipelinedTransactions(payments, results):
+    """
+    Sends one transaction per payment without waiting between them, then waits for all the receipts.
+    """
+    sent = []
+    for payment, result in zip(payments, results):
+        try:
+            # the gas is estimated once per recipient, the payments of a batch usually have the same recipient
+            txn_hash, nonce = _SignAndSend(
+                paymentContext,
+                "transferWithReferenceAndFee",
+                [payment['recipient_address'], log_topic_to_bytes(payment['paymentRefence']), 0, fee_address], # No fee for these transactions
+                Web3.to_wei(payment['amount_to_pay'], 'ether'),
+                gasKey = ("transferWithReferenceAndFee", payment['recipient_address'].lower())
+            )
+        except Exception as e:
+            result['message'] = f"Error while sending the transaction: {e}"
+            continue
+        _TrackTransaction(txn_hash, payment['paymentRefence'], nonce)
+        result['txHash'] = txn_hash
+        sent.append((payment, result))
+
+    for payment, result in sent:
+        txn_receipt = web3Connex.eth.wait_for_transaction_receipt(result['txHash'])
+        _RecordReceipt(result['txHash'], payment['paymentRefence'], 'confirmed' if txn_receipt.status == 1 else 'failed', txn_receipt.blockNumber)
+        result['message'] = _ReceiptMessage(txn_receipt.status)
+
+
+async def PerformPaymentsAsync(batch):
+    """
+    PerformPaymentsAsync
+    --------------------
+    Awaitable version of `PerformPayments`. The batch is performed in a worker thread, a single thread per batch.
+    """
+    return await asyncio.to_thread(PerformPayments, batch)
+
+
+def CheckPendingPayments():
+    """
+    CheckPendingPayments
+    --------------------
+    Records the receipts of the mined pending transactions. A transaction unknown from the node for more than
+    `RECEIPT_TIMEOUT` seconds is recorded as dropped and the nonces are resynced, its nonce would block the next ones.
+
+    Returns
+    -------
+    int
+        Number of recorded receipts.
+    """
+    recorded = 0
+    now = time.time()
+    for txn_hash, entry in r.hgetall(PENDING_KEY).items():
+        txn_hash = txn_hash.decode('utf-8')
+        entry = json.loads(entry)
+        try:
+            txn_receipt = web3Connex.eth.get_transaction_receipt(txn_hash)
+        except TransactionNotFound:
+            if now - entry['since'] > RECEIPT_TIMEOUT:
+                _RecordReceipt(txn_hash, entry['paymentReference'], 'dropped')
+                nonces.resync()
+                recorded += 1
+            continue
+        _RecordReceipt(txn_hash, entry['paymentReference'], 'confirmed' if txn_receipt.status == 1 else 'failed', txn_receipt.blockNumber)
+        recorded += 1
+    return recorded
+
+
+def _confirm(stopEvent, interval):
+    while not stopEvent.is_set():
+        try:
+            CheckPendingPayments()
+        except Exception as e:
+            print(f"Error in payment confirmer: {e}")
+        stopEvent.wait(interval)
+
+
+def StartConfirmer(interval = CONFIRM_INTERVAL):
+    """
+    StartConfirmer
+    --------------
+    Starts the background thread recording the receipts of the transactions sent with `SubmitPayment`.
+
+    Parameters
+    ----------
+    interval : float, optional
+        Time (in seconds) between two checks.
+
+    Returns
+    -------
+    threading.Event
+        Event to set in order to stop the confirmer.
+    """
+    stopEvent = threading.Event()
+    threading.Thread(target = _confirm, args = (stopEvent, interval), name = "payment-confirmer", daemon = True).start()
+    return stopEvent
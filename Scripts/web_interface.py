@@ -1,17 +1,26 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request
+import json
+import os
 import redis
 import requests
-from datetime import datetime
-app = Flask(__name__)
-r = redis.Redis(host='localhost', port = 6379, db = 0)
+import uuid
+import MessageEnvelope as ME
+import ConversationLog as CL
+import Metrics as MT # Prometheus metrics, exported by the /metrics route
+import Tracing as TR # a user request starts a trace, followed across the agents
+import AgentDirectory as AD
+app = MT.InstrumentFlask(Flask(__name__))
+r = redis.Redis(host='localhost', port = 6379, db = int(os.getenv("REDIS_DB", "0")))
 conversation_logs=[]
 user_ID = "haikuLover"
 ia_Assistant_ID = "AssistantAgent"
+# the user messages are pushed in the queue of the assistant, its depth is exported with the metrics of the interface
+MT.WatchQueue(r, f'{ia_Assistant_ID}_queue')
+# Time (in milliseconds) a log feed waits for new entries before sending a keep-alive
+SSE_BLOCK_MS = 15000
 
-def log_to_redis(agent, message):
-    timestamp = datetime.now().isoformat()
-    log_entry = {'timestamp': timestamp, 'agent': agent, 'message': message}
-    r.lpush('conversation_logs', str(log_entry))
+def log_to_redis(agent, message, conversationId = None):
+    CL.AppendLog(r, agent, message, conversationId)
 
 
 @app.route('/')
@@ -20,28 +29,98 @@ def index():
 
 @app.route('/logs', methods=['GET'])
 def get_logs():
-    logs  =  [eval(log.decode()) for log in r.lrange('conversation_logs', 0, -1)]
-    return jsonify(logs)
+    """
+    get_logs
+    --------
+    Returns the log entries added after the `since` cursor (at most `limit`, default 100), or the last ones without cursor.
+    The `conversationId` parameter restricts the logs to a conversation.
+
+    Returns
+    -------
+    Response : Flask Response object
+        {'logs': entries oldest first, 'cursor': cursor to send as `since` in the next request}
+    """
+    return jsonify(CL.ReadLogs(r, since = request.args.get('since'), limit = request.args.get('limit', 100, type = int),
+                               conversationId = request.args.get('conversationId')))
+
+@app.route('/logs/stream', methods=['GET'])
+def stream_logs():
+    """
+    stream_logs
+    -----------
+    Server-Sent Events feed of the log entries, pushed as soon as they are written. The feed starts after the
+    `since` cursor, or after the `Last-Event-ID` sent by the browser when it reconnects, or with the new entries only.
+    The `conversationId` parameter restricts the feed to a conversation.
+
+    Returns
+    -------
+    Response : Flask Response object
+        A 'text/event-stream' response, each event carrying a log entry as JSON and its cursor as event ID.
+    """
+    conversationId = request.args.get('conversationId')
+    since = request.headers.get('Last-Event-ID') or request.args.get('since') or CL.ReadLogs(r, limit = 1, conversationId = conversationId)['cursor']
+
+    def events(cursor):
+        while True:
+            result = CL.ReadLogs(r, since = cursor, conversationId = conversationId, block = SSE_BLOCK_MS)
+            if not result['logs']:
+                # keeps the connexion open through proxies, and detects closed connexions
+                yield ": keep-alive\n\n"
+                continue
+            for log in result['logs']:
+                yield f"id: {log['id']}\ndata: {json.dumps(log)}\n\n"
+            cursor = result['cursor']
+
+    return Response(events(since), mimetype = 'text/event-stream', headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/deadletters', methods = ['GET'])
+def get_dead_letters():
+    """
+    get_dead_letters
+    ----------------
+    Returns the last messages of the dead-letter queue (at most `limit`, default 100): the messages sent to an unknown
+    agent, and the messages whose processing failed.
+
+    Returns
+    -------
+    Response : Flask Response object
+        {'deadLetters': entries newest first, with the recipient, the reason, the error and the packed message,
+         'count': number of dead letters kept, 'agents': IDs of the registered agents}
+    """
+    result = AD.ReadDeadLetters(r, limit = min(request.args.get('limit', 100, type = int), AD.DEAD_LETTER_MAXLEN))
+    result['agents'] = AD.KnownAgents(r)
+    return jsonify(result)
+
 
 @app.route('/clearlog', methods = ['POST'])
 def ClearLogs():
     data = request.json  
     action = data.get('action')
-    results = r.flushall()
-    if results: 
-        return jsonify({"Action": "log cleared"}), 200
-    else:
+    # only the log streams are deleted, the state of the agents is kept in the same Redis database
+    try:
+        deleted = CL.ClearLogs(r)
+    except redis.RedisError as e:
+        print(f"Error while clearing the logs: {e}")
         return jsonify({"Action": "log clear error"}), 400
+    return jsonify({"Action": "log cleared", "streams": deleted}), 200
    
 
 @app.route('/start', methods = ['POST'])
 def start_communication():
     user_message = request.json['message']
+    # a new conversation is started unless the page provides the ID of the current one
+    conversationId = request.json.get('conversationId') or uuid.uuid4().hex
     print(f"user_message:{user_message}")
-    log_to_redis(f'{user_ID}', user_message)
-    user_prompt = f'From {user_ID}: ' + user_message
-    r.lpush(f'{ia_Assistant_ID}_queue', user_prompt)    
-    return jsonify({'status': 'AIQuery'})
+    # root span of the user request, its context is carried by the message and by the messages it leads to
+    with TR.Span("start_communication", parent = request.headers.get('traceparent'), kind = "server",
+                 attributes = {'conversationId': conversationId}) as span:
+        log_to_redis(f'{user_ID}', user_message, conversationId)
+        entry = AD.Deliver(r, ia_Assistant_ID, ME.PackMessage(user_ID, user_message, conversationId))
+    if entry is None:
+        return jsonify({'status': 'error', 'error': AD.DeliveryReport(ia_Assistant_ID, entry, AD.KnownAgents(r)),
+                        'conversationId': conversationId, 'traceId': span.traceId}), 503
+    return jsonify({'status': 'AIQuery', 'conversationId': conversationId, 'traceId': span.traceId})
     
 @app.route('/log', methods = ['POST'])
 def log_message():
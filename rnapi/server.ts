@@ -1,6 +1,11 @@
 import express from 'express';
 import { Request, Response } from 'express';
 import dotenv from 'dotenv';
+import { randomBytes } from 'crypto';
+import { AsyncLocalStorage } from 'async_hooks';
+import { appendFile, mkdir } from 'fs/promises';
+import { join } from 'path';
+import { createClient } from 'redis';
 import { RequestNetwork, Types, PaymentReferenceCalculator, Utils } from '@requestnetwork/request-client.js';
 import { EthereumPrivateKeySignatureProvider } from '@requestnetwork/epk-signature';
 import { getTheGraphClient } from "@requestnetwork/payment-detection";
@@ -12,6 +17,197 @@ const port = process.env.PORT || 3000;
 
 app.use(express.json());
 
+// ################ Metrics #############################
+// Upper bounds (in seconds) of the latency buckets, from a cached status to an on-chain confirmation
+const LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120];
+
+type Labels = { [name: string]: string };
+
+function formatLabels(labels: Labels) {
+  const pairs = Object.keys(labels).map((name) =>
+    `${name}="${labels[name].replace(/\\/g, '\\\\').replace(/"/g, '\\"').replace(/\n/g, '\\n')}"`);
+  return pairs.length ? `{${pairs.join(',')}}` : '';
+}
+
+// Distribution of durations per combination of label values, rendered in the Prometheus text format
+class Histogram {
+  private series = new Map<string, { labels: Labels; counts: number[]; sum: number }>();
+
+  constructor(readonly name: string, readonly help: string, private buckets: number[] = LATENCY_BUCKETS) {}
+
+  observe(seconds: number, labels: Labels) {
+    const key = JSON.stringify(labels);
+    let series = this.series.get(key);
+    if (!series) {
+      series = { labels, counts: new Array(this.buckets.length + 1).fill(0), sum: 0 };
+      this.series.set(key, series);
+    }
+    const index = this.buckets.findIndex((bound) => seconds <= bound);
+    series.counts[index === -1 ? this.buckets.length : index]++;
+    series.sum += seconds;
+  }
+
+  // Observes the duration of an async call, failed or not, with an `outcome` label
+  async time<T>(labels: Labels, fn: () => Promise<T>): Promise<T> {
+    const start = process.hrtime.bigint();
+    let outcome = 'error';
+    try {
+      const result = await fn();
+      outcome = 'ok';
+      return result;
+    } finally {
+      this.observe(Number(process.hrtime.bigint() - start) / 1e9, { ...labels, outcome });
+    }
+  }
+
+  render(): string[] {
+    const lines = [`# HELP ${this.name} ${this.help}`, `# TYPE ${this.name} histogram`];
+    for (const { labels, counts, sum } of this.series.values()) {
+      let cumulated = 0;
+      [...this.buckets, Infinity].forEach((bound, index) => {
+        cumulated += counts[index];
+        const le = bound === Infinity ? '+Inf' : String(bound);
+        lines.push(`${this.name}_bucket${formatLabels({ ...labels, le })} ${cumulated}`);
+      });
+      lines.push(`${this.name}_sum${formatLabels(labels)} ${sum}`);
+      lines.push(`${this.name}_count${formatLabels(labels)} ${cumulated}`);
+    }
+    return lines;
+  }
+}
+
+const httpDuration = new Histogram('rnapi_http_request_seconds', 'Latency of the requests served by the rnapi server.');
+// Time spent waiting for the Request Network, by upstream: the gateway (request creation and retrieval),
+// the payments subgraph (balance of a request) and the on-chain confirmation of a new request
+const upstreamDuration = new Histogram('rnapi_upstream_seconds', 'Time spent waiting for the Request Network gateway, payments subgraph and confirmation.');
+
+// Observes the latency of each request under its route template, so the IDs in the paths do not create a series each
+app.use((req: Request, res: Response, next: Function) => {
+  const start = process.hrtime.bigint();
+  res.on('finish', () => {
+    const route = req.route ? req.baseUrl + req.route.path : 'unmatched';
+    httpDuration.observe(Number(process.hrtime.bigint() - start) / 1e9, { method: req.method, route, status: String(res.statusCode) });
+  });
+  next();
+});
+// ######################################################
+
+// ################ Tracing #############################
+// Spans of the requests, continuing the trace of the caller from its `traceparent` header (see Scripts/Tracing.py).
+// Finished spans are written as JSON lines in TRACE_DIR and / or sent as OTLP JSON to TRACE_COLLECTOR_URL.
+const TRACE_DIR = process.env.TRACE_DIR;
+const TRACE_COLLECTOR_URL = process.env.TRACE_COLLECTOR_URL;
+const SERVICE_NAME = process.env.TRACE_SERVICE_NAME || 'rnapi';
+// Time between two exports of the finished spans
+const TRACE_EXPORT_INTERVAL_MS = 1000;
+const SPAN_KINDS: { [kind: string]: number } = { internal: 1, server: 2, client: 3, producer: 4, consumer: 5 };
+
+type SpanContext = { traceId: string; spanId: string };
+type Span = SpanContext & { parentSpanId: string | null; name: string; kind: string; start: number; attributes: { [key: string]: string | number } };
+type SpanRecord = Span & { service: string; end: number; durationMs: number; status: 'ok' | 'error'; error?: string };
+
+// Span of the request being served, followed through its async calls
+const currentSpan = new AsyncLocalStorage<Span>();
+const finishedSpans: SpanRecord[] = [];
+
+function parseTraceparent(value?: string): SpanContext | undefined {
+  const match = /^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$/.exec((value || '').trim().toLowerCase());
+  return match ? { traceId: match[1], spanId: match[2] } : undefined;
+}
+
+function traceparent(span?: SpanContext) {
+  return span ? `00-${span.traceId}-${span.spanId}-01` : undefined;
+}
+
+// Starts a child span of `parent`, or of the current span, or the first span of a new trace
+function startSpan(name: string, kind: string, parent?: SpanContext): Span {
+  parent = parent || currentSpan.getStore();
+  return {
+    traceId: parent ? parent.traceId : randomBytes(16).toString('hex'),
+    spanId: randomBytes(8).toString('hex'),
+    parentSpanId: parent ? parent.spanId : null,
+    name, kind, start: Date.now() / 1000, attributes: {},
+  };
+}
+
+function endSpan(span: Span, error?: Error) {
+  if (!TRACE_DIR && !TRACE_COLLECTOR_URL) return;
+  const end = Date.now() / 1000;
+  finishedSpans.push({
+    ...span, service: SERVICE_NAME, end, durationMs: Math.round((end - span.start) * 1e6) / 1e3,
+    status: error ? 'error' : 'ok', ...(error ? { error: error.message } : {}),
+  });
+}
+
+// Runs an async call in a child span of the current span
+async function traced<T>(name: string, fn: () => Promise<T>): Promise<T> {
+  const span = startSpan(name, 'client');
+  try {
+    const result = await currentSpan.run(span, fn);
+    endSpan(span);
+    return result;
+  } catch (error) {
+    endSpan(span, error as Error);
+    throw error;
+  }
+}
+
+// OTLP JSON encoding of the finished spans
+function otlpBody(records: SpanRecord[]) {
+  return {
+    resourceSpans: [{
+      resource: { attributes: [{ key: 'service.name', value: { stringValue: SERVICE_NAME } }] },
+      scopeSpans: [{
+        scope: { name: 'rnapi' },
+        spans: records.map((record) => ({
+          traceId: record.traceId,
+          spanId: record.spanId,
+          ...(record.parentSpanId ? { parentSpanId: record.parentSpanId } : {}),
+          name: record.name,
+          kind: SPAN_KINDS[record.kind] || 1,
+          startTimeUnixNano: String(Math.round(record.start * 1e9)),
+          endTimeUnixNano: String(Math.round(record.end * 1e9)),
+          attributes: Object.keys(record.attributes).map((key) => {
+            const value = record.attributes[key];
+            return { key, value: typeof value === 'number' ? { intValue: String(value) } : { stringValue: value } };
+          }),
+          status: record.status === 'error' ? { code: 2, message: record.error || '' } : { code: 1 },
+        })),
+      }],
+    }],
+  };
+}
+
+async function flushSpans() {
+  const records = finishedSpans.splice(0);
+  if (!records.length) return;
+  if (TRACE_DIR) {
+    await mkdir(TRACE_DIR, { recursive: true });
+    await appendFile(join(TRACE_DIR, `${SERVICE_NAME}-${process.pid}.jsonl`), records.map((record) => JSON.stringify(record) + '\n').join(''));
+  }
+  if (TRACE_COLLECTOR_URL) {
+    await fetch(TRACE_COLLECTOR_URL, { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(otlpBody(records)) });
+  }
+}
+setInterval(() => flushSpans().catch((error) => console.error('Span export error', error)), TRACE_EXPORT_INTERVAL_MS).unref();
+
+// A span per request, named after its route template once it is known
+app.use((req: Request, res: Response, next: Function) => {
+  const span = startSpan(`${req.method} ${req.path}`, 'server', parseTraceparent(req.header('traceparent')));
+  res.on('finish', () => {
+    span.name = `${req.method} ${req.route ? req.baseUrl + req.route.path : 'unmatched'}`;
+    span.attributes['http.status_code'] = res.statusCode;
+    endSpan(span, res.statusCode >= 500 ? new Error(`Server responded with status code ${res.statusCode}`) : undefined);
+  });
+  currentSpan.run(span, () => next());
+});
+
+// Times a call to the Request Network, as a span and in the upstream latency histogram
+function upstream<T>(name: 'gateway' | 'subgraph' | 'confirmation', operation: string, fn: () => Promise<T>): Promise<T> {
+  return upstreamDuration.time({ upstream: name, operation }, () => traced(`${name} ${operation}`, fn));
+}
+// ######################################################
+
 // Environment variables
 const API_KEY = process.env.RequestNetwork_API_KEY;
 
@@ -57,49 +253,235 @@ const requestNetwork = new RequestNetwork({
 });
 // ######################################################
 
+// Maximum number of invoice IDs accepted by a batch status request
+const STATUS_BATCH_MAX = Number(process.env.STATUS_BATCH_MAX || 500);
+// Maximum number of invoices checked at the same time by a batch status request
+const STATUS_CONCURRENCY = Number(process.env.STATUS_CONCURRENCY || 10);
+
+// Maximum number of invoices accepted by a batch creation request
+const CREATE_BATCH_MAX = Number(process.env.CREATE_BATCH_MAX || 100);
+// Maximum number of invoices created at the same time by a batch creation request
+const CREATE_CONCURRENCY = Number(process.env.CREATE_CONCURRENCY || 5);
+
+// Calls an async function on each item, with at most `limit` calls in flight. Results are in the order of the items.
+async function mapWithConcurrency<T, R>(items: T[], limit: number, fn: (item: T) => Promise<R>): Promise<R[]> {
+  const results: R[] = new Array(items.length);
+  let next = 0;
+  const workers = Array.from({ length: Math.min(limit, items.length) }, async () => {
+    while (next < items.length) {
+      const index = next++;
+      results[index] = await fn(items[index]);
+    }
+  });
+  await Promise.all(workers);
+  return results;
+}
+
+// ################ Cache ###############################
+// Time to live of the status of an open invoice, a paid invoice is pinned and never refreshed
+const STATUS_CACHE_TTL_MS = Number(process.env.STATUS_CACHE_TTL_MS || 5000);
+// Time to live of a Request instance
+const REQUEST_CACHE_TTL_MS = Number(process.env.REQUEST_CACHE_TTL_MS || 10 * 60 * 1000);
+// Maximum number of entries of each cache, least recently used entries are evicted first
+const CACHE_MAX_ENTRIES = Number(process.env.CACHE_MAX_ENTRIES || 10000);
+// Time to live of the failed state of an invoice created asynchronously, its ID is then unknown again
+const FAILED_CONFIRMATION_TTL_MS = Number(process.env.FAILED_CONFIRMATION_TTL_MS || 60 * 60 * 1000);
+
+// LRU cache with a time to live per entry. A Map iterates in insertion order, the first key is the least recently used.
+class LruCache<V> {
+  private entries = new Map<string, { value: V; expiresAt: number }>();
+  hits = 0;
+  misses = 0;
+
+  constructor(private maxEntries: number) {}
+
+  get(key: string): V | undefined {
+    const entry = this.entries.get(key);
+    if (!entry || entry.expiresAt <= Date.now()) {
+      if (entry) this.entries.delete(key);
+      this.misses++;
+      return undefined;
+    }
+    this.entries.delete(key);
+    this.entries.set(key, entry);
+    this.hits++;
+    return entry.value;
+  }
+
+  // ttlMs = Infinity pins the entry, it is then only evicted when the cache is full
+  set(key: string, value: V, ttlMs: number) {
+    this.entries.delete(key);
+    this.entries.set(key, { value, expiresAt: Date.now() + ttlMs });
+    while (this.entries.size > this.maxEntries) {
+      this.entries.delete(this.entries.keys().next().value as string);
+    }
+  }
+
+  delete(key: string) {
+    this.entries.delete(key);
+  }
+
+  stats() {
+    return { size: this.entries.size, maxEntries: this.maxEntries, hits: this.hits, misses: this.misses };
+  }
+}
+
+type InvoiceStatus = { status: 'pending' | 'failed' | 'open' | 'paid'; requestData: any };
+
+const requestCache = new LruCache<Promise<any>>(CACHE_MAX_ENTRIES);
+// Statuses are cached as promises, so concurrent checks of the same invoice share a single network call
+const statusCache = new LruCache<Promise<InvoiceStatus>>(CACHE_MAX_ENTRIES);
+// ######################################################
+
+// Returns the Request instance of an invoice, from the cache when possible
+function getRequest(id: string) {
+  const cached = requestCache.get(id);
+  if (cached) {
+    return cached;
+  }
+  const request = upstream('gateway', 'get_request', () => requestNetwork.fromRequestId(id));
+  requestCache.set(id, request, REQUEST_CACHE_TTL_MS);
+  request.catch(() => requestCache.delete(id));
+  return request;
+}
+
+// Fetches the balance of a request, and tells if it is paid
+async function fetchInvoiceStatus(id: string): Promise<InvoiceStatus> {
+  const request = await getRequest(id);
+  const requestData = await upstream('subgraph', 'refresh_balance', () => request.refreshBalance());
+  const expectedAmount = request.getData().expectedAmount;
+
+  if(!requestData || !requestData.balance || BigInt(requestData?.balance) < BigInt(expectedAmount)) {
+    return { status: 'open', requestData };
+  }
+  return { status: 'paid', requestData };
+}
+
+// Returns the status of an invoice. Open invoices are fetched at most once per STATUS_CACHE_TTL_MS,
+// paid invoices are pinned in the cache and never fetched again.
+async function getInvoiceStatus(id: string): Promise<InvoiceStatus> {
+  // invoices created asynchronously are not known by the Request Network until confirmed
+  const confirmation = confirmations.get(id);
+  if (confirmation) {
+    return { status: confirmation.state === 'pending' ? 'pending' : 'failed', requestData: confirmation };
+  }
+  const cached = statusCache.get(id);
+  if (cached) {
+    return cached;
+  }
+  const pending = fetchInvoiceStatus(id);
+  statusCache.set(id, pending, STATUS_CACHE_TTL_MS);
+  try {
+    const result = await pending;
+    if (result.status === 'paid') {
+      statusCache.set(id, pending, Infinity);
+    }
+    return result;
+  } catch (error) {
+    statusCache.delete(id);
+    throw error;
+  }
+}
+
 
 
 // Routes
 
-// POST /invoices
-app.post('/invoices', authenticateApiKey, async (req: Request, res: Response) => {
-  if(!req.body.currency) {
-    throw Error('currency not found');
+// ################ Invoice creation ####################
+// Confirmation of the invoices created asynchronously, by request ID. Pending entries are pinned until confirmed or failed,
+// failed ones expire after FAILED_CONFIRMATION_TTL_MS. Kept in memory only, the states are lost when the server restarts.
+const confirmations = new LruCache<{ state: 'pending' | 'confirmed' | 'failed'; error?: string }>(CACHE_MAX_ENTRIES);
+
+// Redis client used for the confirmation callbacks, connected on first use
+let redisClient: ReturnType<typeof createClient> | undefined;
+let redisReady: Promise<unknown> | undefined;
+
+// Pushes a message envelope (see Scripts/MessageEnvelope.py) in a Redis queue
+async function pushCallback(queue: string, envelope: object) {
+  if (!redisClient) {
+    redisClient = createClient({ url: process.env.REDIS_URL || 'redis://localhost:6379' });
+    redisClient.on('error', (error) => console.error('Redis error', error));
+    redisReady = redisClient.connect();
   }
-  if(req.body.currency !== 'ETH-sepolia') {
-    return res.status(400).json({ error: 'currency must be ETH-sepolia' });
+  await redisReady;
+  await redisClient.lPush(queue, JSON.stringify(envelope));
+}
+
+// Returns an error message if the body of an invoice creation is not valid
+function validateInvoiceBody(body: any): string | undefined {
+  if(!body.currency) {
+    return 'currency not found';
+  }
+  if(body.currency !== 'ETH-sepolia') {
+    return 'currency must be ETH-sepolia';
   }
-  
-  if(!req.body.expectedAmount) {
-    return res.status(400).json({ error: 'expectedAmount not found' });
+  if(!body.expectedAmount) {
+    return 'expectedAmount not found';
   }
-  if(!req.body.payerAddress) {
-    return res.status(400).json({ error: 'payerAddress not found' });
+  if(!body.payerAddress) {
+    return 'payerAddress not found';
   }
-  if(!req.body.paymentAddress) {
-    return res.status(400).json({ error: 'paymentAddress not found' });
+  if(!body.paymentAddress) {
+    return 'paymentAddress not found';
   }
-  if(!req.body.contentdata) {
-    return res.status(400).json({ error: 'contentdata not found' });
-    
+  if(!body.contentdata) {
+    return 'contentdata not found';
   }
+  return undefined;
+}
 
+// Tracks the confirmation of a request in the background, and notifies the callback queue if any
+function trackConfirmation(request: any, body: any) {
+  const requestId: string = request.requestId;
+  confirmations.set(requestId, { state: 'pending' }, Infinity);
+
+  const notify = (type: string, message: string, payload: object) => {
+    if (!body.callbackQueue) return;
+    pushCallback(body.callbackQueue, {
+      conversationId: body.callbackConversationId || 'default',
+      sender: 'rnapi',
+      type,
+      message,
+      payload,
+      sentAt: Date.now() / 1000,
+      // the agent continues the trace of the invoice creation
+      traceparent: traceparent(currentSpan.getStore()),
+    }).catch((error) => console.error(`Callback error for ${requestId}`, error));
+  };
+
+  upstream('confirmation', 'create_invoice_async', () => request.waitForConfirmation())
+    .then(() => {
+      // confirmed requests are then checked through the Request Network as usual
+      confirmations.delete(requestId);
+      notify('invoice_confirmed', `The invoice ID ${requestId} is confirmed.`, { invoiceId: requestId });
+    })
+    .catch((error: Error) => {
+      confirmations.set(requestId, { state: 'failed', error: error.message }, FAILED_CONFIRMATION_TTL_MS);
+      notify('invoice_failed', `The creation of the invoice ID ${requestId} failed: ${error.message}`, { invoiceId: requestId, error: error.message });
+    });
+}
+
+// Creates an invoice. The payment reference is computed from a salt generated here, so it is known before the confirmation.
+// If waitForConfirmation is false, the confirmation is tracked in the background.
+async function createInvoice(body: any, waitForConfirmation: boolean) {
   const requestInfo: Types.IRequestInfo = {
-    currency: req.body.currency,
-    expectedAmount: req.body.expectedAmount,
+    currency: body.currency,
+    expectedAmount: body.expectedAmount,
     payee,
     payer: {
-      value: req.body.payerAddress,
+      value: body.payerAddress,
       type: Types.Identity.TYPE.ETHEREUM_ADDRESS
     },
   };
-  
+
+  const salt = randomBytes(8).toString('hex');
   const paymentNetwork: Types.Payment.PaymentNetworkCreateParameters = {
     id: Types.Extension.PAYMENT_NETWORK_ID.ETH_FEE_PROXY_CONTRACT,
     parameters: {
-      paymentAddress: req.body.paymentAddress,
+      paymentAddress: body.paymentAddress,
       feeAddress: '0x0000000000000000000000000000000000000000',
-      feeAmount: '0'
+      feeAmount: '0',
+      salt
     },
   };
 
@@ -107,21 +489,72 @@ app.post('/invoices', authenticateApiKey, async (req: Request, res: Response) =>
     paymentNetwork,
     requestInfo,
     signer: payee,
-    contentdata: req.body.contentdata
+    contentdata: body.contentdata
   };
 
-  const request = await requestNetwork.createRequest(createParams);
+  const request = await upstream('gateway', 'create_request', () => requestNetwork.createRequest(createParams));
+  const paymentReference = PaymentReferenceCalculator.calculate(request.requestId, salt, body.paymentAddress);
 
-  // Wait for confirmation
-  const requestData = await request.waitForConfirmation();
+  if (waitForConfirmation) {
+    await upstream('confirmation', 'create_invoice', () => request.waitForConfirmation());
+  } else {
+    trackConfirmation(request, body);
+  }
+  return { id: request.requestId, paymentReference };
+}
+// ######################################################
 
-  const paymentReference = PaymentReferenceCalculator.calculate(
-    request.requestId,
-    requestData.extensions[Types.Extension.ID.ETH_FEE_PROXY_CONTRACT].values.salt,
-    req.body.paymentAddress
-  );
 
-  res.status(201).json({ id: request.requestId, paymentReference });
+// POST /invoices
+// With `async: true` in the body, replies 202 as soon as the request is signed and sent, without waiting for its confirmation.
+// The optional `callbackQueue` / `callbackConversationId` give the Redis queue notified of the confirmation.
+app.post('/invoices', authenticateApiKey, async (req: Request, res: Response) => {
+  const error = validateInvoiceBody(req.body);
+  if(error) {
+    return res.status(400).json({ error });
+  }
+
+  try {
+    if(req.body.async === true) {
+      const invoice = await createInvoice(req.body, false);
+      return res.status(202).json({ ...invoice, status: 'pending' });
+    }
+
+    res.status(201).json(await createInvoice(req.body, true));
+  } catch (error) {
+    // Express 4 does not pass the rejections of async handlers to the error middleware
+    res.status(500).json({ error: (error as Error).message });
+  }
+});
+
+
+// POST /invoices/batch
+// Body: { invoices: [invoice body, ...], async?: boolean }. Invoices are created concurrently, at most CREATE_CONCURRENCY at a time.
+// Returns { results: [{ index, status, id?, paymentReference?, error? }] }, a failure only affects its own item.
+app.post('/invoices/batch', authenticateApiKey, async (req: Request, res: Response) => {
+  const invoices = req.body.invoices;
+  if(!Array.isArray(invoices)) {
+    return res.status(400).json({ error: 'invoices must be a list of invoices' });
+  }
+  if(invoices.length > CREATE_BATCH_MAX) {
+    return res.status(400).json({ error: `at most ${CREATE_BATCH_MAX} invoices per request` });
+  }
+
+  const waitForConfirmation = req.body.async !== true;
+  const results = await mapWithConcurrency(invoices, CREATE_CONCURRENCY, async (body: any) => {
+    const error = validateInvoiceBody(body || {});
+    if(error) {
+      return { status: 400, error };
+    }
+    try {
+      const invoice = await createInvoice(body, waitForConfirmation);
+      return { status: waitForConfirmation ? 201 : 202, ...invoice };
+    } catch (error) {
+      return { status: 500, error: (error as Error).message };
+    }
+  });
+
+  res.status(200).json({ results: results.map((result, index) => ({ index, ...result })) });
 });
 
 
@@ -129,15 +562,59 @@ app.post('/invoices', authenticateApiKey, async (req: Request, res: Response) =>
 app.get('/invoices/:id', authenticateApiKey, async (req: Request, res: Response) => {
   const { id } = req.params;
 
-  const request = await requestNetwork.fromRequestId(id);
-  const requestData = await request.refreshBalance();
-  const expectedAmount = request.getData().expectedAmount;
+  try {
+    res.status(200).json(await getInvoiceStatus(id));
+  } catch (error) {
+    res.status(500).json({ error: (error as Error).message });
+  }
+});
 
-  if(!requestData || !requestData.balance || BigInt(requestData?.balance) < BigInt(expectedAmount)) {
-    res.status(200).json({ status: 'open', requestData });
-  } else {
-    res.status(200).json({ status: 'paid', requestData });
+
+// POST /invoices/status
+// Body: { ids: string[] }. Returns { statuses: { [id]: { status: 'pending' | 'failed' | 'open' | 'paid' } | { status: 'error', error } } }
+app.post('/invoices/status', authenticateApiKey, async (req: Request, res: Response) => {
+  const ids = req.body.ids;
+  if(!Array.isArray(ids) || ids.some((id) => typeof id !== 'string')) {
+    return res.status(400).json({ error: 'ids must be a list of invoice IDs' });
+  }
+  if(ids.length > STATUS_BATCH_MAX) {
+    return res.status(400).json({ error: `at most ${STATUS_BATCH_MAX} ids per request` });
+  }
+
+  const uniqueIds: string[] = Array.from(new Set(ids));
+  const results = await mapWithConcurrency(uniqueIds, STATUS_CONCURRENCY, async (id) => {
+    try {
+      const { status } = await getInvoiceStatus(id);
+      return { status };
+    } catch (error) {
+      return { status: 'error', error: (error as Error).message };
+    }
+  });
+
+  const statuses: { [id: string]: object } = {};
+  uniqueIds.forEach((id, index) => { statuses[id] = results[index]; });
+  res.status(200).json({ statuses });
+});
+
+
+// GET /cache/stats
+app.get('/cache/stats', authenticateApiKey, (req: Request, res: Response) => {
+  res.status(200).json({ requests: requestCache.stats(), statuses: statusCache.stats() });
+});
+
+
+// GET /metrics
+// Prometheus text format. Not behind the API key, so it can be scraped; it only holds latencies and cache counters.
+app.get('/metrics', (req: Request, res: Response) => {
+  const lines = [...httpDuration.render(), ...upstreamDuration.render()];
+  const caches = { requests: requestCache.stats(), statuses: statusCache.stats() };
+  for (const counter of ['hits', 'misses'] as const) {
+    lines.push(`# HELP rnapi_cache_${counter}_total Lookups of the request and status caches (${counter}).`, `# TYPE rnapi_cache_${counter}_total counter`);
+    for (const cache of ['requests', 'statuses'] as const) {
+      lines.push(`rnapi_cache_${counter}_total${formatLabels({ cache })} ${caches[cache][counter]}`);
+    }
   }
+  res.status(200).type('text/plain; version=0.0.4').send(lines.join('\n') + '\n');
 });
 
 